@@ -1,16 +1,49 @@
-import requests, time
-import util
+import time, random
+import util, ratelimit, httpclient
 from util import log, get_err
+from circuitbreaker import CircuitBreaker, CircuitOpenError
 from const import *
 
+_breakers = {}
+def get_breaker(endpoint):
+	"Circuit breaker of the API endpoint, e.g. bridge"
+	if endpoint not in _breakers:
+		_breakers[endpoint] = CircuitBreaker(f"ALS API {endpoint}",
+			ALS_BREAKER_THRESHOLD, ALS_BREAKER_MIN_DELAY, ALS_BREAKER_MAX_DELAY)
+	return _breakers[endpoint]
+
+def get_breakers():
+	return dict(_breakers)
+
 def _send_request(url, validate_fn=None, retries=3):
+	"""
+	Retries with jittered exponential backoff. Only the API not responding
+	(connection errors, timeouts, 5xx and broken responses) counts as the
+	endpoint failure for its circuit breaker
+	"""
+	breaker = get_breaker(url.split("?")[0].rstrip("/").split("/")[-1])
 	for attempt in range(retries):
-		util.cap_freq("als_api", 1)
+		breaker.before_request() # raises CircuitOpenError when open
+		ratelimit.singleton.acquire("als_api")
 		
 		try:
-			resp = requests.get(url, headers={"Authorization": MOZAM_API_KEY})
+			try:
+				resp = httpclient.singleton.get(url,
+					headers={"Authorization": MOZAM_API_KEY},
+					timeout=(ALS_CONNECT_TIMEOUT, ALS_READ_TIMEOUT))
+				if resp.status_code >= 500:
+					resp.raise_for_status()
+				resp_data = resp.json() if resp.ok else None
+			except Exception:
+				breaker.record_failure()
+				raise
+			breaker.record_success()
+			
+			if resp.status_code == 429:
+				ratelimit.singleton.report_throttled("als_api",
+					ratelimit.parse_retry_after(resp.headers.get("Retry-After")))
 			resp.raise_for_status()
-			resp_data = resp.json()
+			ratelimit.singleton.report_success("als_api")
 			if validate_fn:
 				assert validate_fn(resp_data)
 			return resp_data
@@ -19,12 +52,93 @@ def _send_request(url, validate_fn=None, retries=3):
 			if (attempt + 1) == retries:
 				raise e
 			else:
-				time.sleep(1)
+				time.sleep(ALS_RETRY_DELAY * 2 ** attempt * \
+					random.uniform(0.5, 1.5))
 
 def get_player_stat(player_uid):
 	url = f"https://api.mozambiquehe.re/bridge?version=5&platform=PC" \
 		f"&uid={player_uid}&merge=true&removeMerged=true"
-	return _send_request(url, lambda r: "global" in r and "realtime" in r)
+	return _send_request(url, _is_player_stat)
+
+_batch_disabled_until = 0
+def get_players_stat(player_uids):
+	"""
+	Fetches stats of the players packing up to ALS_BATCH_SIZE of them into
+	one bridge request. A failed batch is split in halves until the players
+	breaking it are singled out, players missing in a successful response
+	are fetched one by one. Returns {uid: stat} of the fetched players, raises
+	the last error only if none of them were fetched
+	"""
+	global _batch_disabled_until
+	stats, last_err = {}, None
+	for i in range(0, len(player_uids), ALS_BATCH_SIZE):
+		batch = [str(uid) for uid in player_uids[i:i + ALS_BATCH_SIZE]]
+		if len(batch) > 1 and time.time() > _batch_disabled_until:
+			batch_stats, missing, err = _get_players_bisect(batch)
+			if not batch_stats and not err: # API may not support batches anymore
+				log("Got no players in batched stat response, fetching "
+					"one by one for an hour", send_tg=True)
+				_batch_disabled_until = time.time() + 60 * 60
+				continue
+			stats.update(batch_stats)
+			last_err = err or last_err
+			batch = missing
+		
+		for uid in batch:
+			try:
+				stats[uid] = get_player_stat(uid)
+			except Exception as e:
+				last_err = e
+	
+	if last_err and not stats:
+		raise last_err
+	return stats
+
+def _get_players_bisect(player_uids):
+	"""
+	Returns ({uid: stat}, missing uids, last error) of the batch, halving it
+	on errors. Missing uids are the ones absent in a successful response
+	of several players
+	"""
+	try:
+		stats = _get_players_batch(player_uids)
+		missing = [uid for uid in player_uids if uid not in stats] \
+			if len(player_uids) > 1 else []
+		return stats, missing, None
+	except CircuitOpenError as e: # no point in splitting it
+		return {}, [], e
+	except Exception as e:
+		if len(player_uids) == 1:
+			return {}, [], e
+		log(f"Batched stat request of {len(player_uids)} players failed, "
+			f"splitting it:\n{get_err()}", err=True)
+	
+	middle = len(player_uids) // 2
+	stats, missing, err = _get_players_bisect(player_uids[:middle])
+	half_stats, half_missing, half_err = \
+		_get_players_bisect(player_uids[middle:])
+	stats.update(half_stats)
+	return stats, missing + half_missing, half_err or err
+
+def _get_players_batch(player_uids):
+	url = f"https://api.mozambiquehe.re/bridge?version=5&platform=PC" \
+		f"&uid={','.join(player_uids)}&merge=true&removeMerged=true"
+	resp = _send_request(url, retries=1)
+	if isinstance(resp, dict): # single player is not wrapped in a list
+		resp = [resp]
+	
+	stats = {}
+	for player_stat in resp:
+		if not isinstance(player_stat, dict) or \
+		not _is_player_stat(player_stat):
+			continue
+		uid = str(player_stat["global"].get("uid"))
+		if uid in player_uids:
+			stats[uid] = player_stat
+	return stats
+
+def _is_player_stat(resp):
+	return "global" in resp and "realtime" in resp
 
 def get_map_rotation():
 	url = f"https://api.mozambiquehe.re/maprotation?version=3"
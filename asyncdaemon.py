@@ -0,0 +1,168 @@
+import asyncio, threading, schedule
+from concurrent.futures import ThreadPoolExecutor
+from const import *
+from util import log, get_err
+import alsapi
+
+class AsyncRuntime():
+	"""
+	Runs the scheduling, player stat fetches and IPC commands of the daemon
+	as coroutines on an event loop of its own thread, instead of fetch
+	workers and scheduler thread. Blocking network calls are run in io
+	executor of io_threads threads, so up to ALS_FETCH_CONCURRENCY fetches
+	and command responses proceed at once. Daemon state and timeline work,
+	commands reading the state included, is still done on the main worker,
+	one task at a time
+	"""
+	# answered on io executor as the listener did, without waiting for the
+	# main worker: they read no daemon state or queue main worker tasks of
+	# their own, and run_id must be answered even when the worker is busy
+	DIRECT_CMDS = {"run_id", "status", "tgupd", "query", "rollups",
+		"ratelimits", "worker_stats", "http_stats"}
+	
+	def __init__(self, daemon, io_threads):
+		self.daemon = daemon
+		self.loop = asyncio.new_event_loop()
+		self.io_executor = ThreadPoolExecutor(io_threads,
+			thread_name_prefix="async_io")
+		self.thread = threading.Thread(target=self._run, name="asyncio",
+			daemon=True)
+		self.fetches_in_flight = 0
+		self._stop_event = asyncio.Event()
+		self._tasks = set()
+	
+	def start(self):
+		self.thread.start()
+	
+	def is_alive(self):
+		return self.thread.is_alive()
+	
+	def stop(self, timeout=10):
+		if self.thread.is_alive():
+			self.loop.call_soon_threadsafe(self._stop_event.set)
+			self.thread.join(timeout)
+		self.io_executor.shutdown(wait=False, cancel_futures=True)
+		if self.thread.is_alive():
+			raise TimeoutError
+	
+	def submit(self, coro):
+		"Runs coroutine on the loop from any other thread"
+		return asyncio.run_coroutine_threadsafe(coro, self.loop)
+	
+	async def run_io(self, func, *args):
+		return await self.loop.run_in_executor(self.io_executor, func, *args)
+	
+	async def run_main(self, func, *args):
+		"Runs func on the main worker without blocking the loop"
+		future = self.daemon.main_worker.task(func).run(*args)
+		return await asyncio.wrap_future(future)
+	
+	async def serve_cmd(self, conn, msg, args):
+		"""
+		Handles the command on the main worker in turn with the rest of the
+		daemon work, unless it is one of DIRECT_CMDS. The response is sent on
+		io executor
+		"""
+		try:
+			if msg in self.DIRECT_CMDS:
+				resp = await self.run_io(self.daemon.handle_cmd, msg, args)
+			else:
+				try:
+					resp = await asyncio.wait_for(self.run_main(
+						self.daemon.handle_cmd, msg, args), DAEMON_CMD_TIMEOUT)
+				except asyncio.TimeoutError:
+					resp = "Timed out waiting for the daemon, try again later"
+			await self.run_io(conn.send, resp)
+		except Exception:
+			log(f"Failed to serve '{msg}' command:\n{get_err()}", err=True)
+		finally:
+			conn.close()
+	
+	def _run(self):
+		asyncio.set_event_loop(self.loop)
+		try:
+			self.loop.run_until_complete(self._main())
+		finally:
+			self.loop.close()
+	
+	async def _main(self):
+		self._fetch_slots = asyncio.Semaphore(ALS_FETCH_CONCURRENCY)
+		self.daemon.setup_schedule(with_updater=False)
+		
+		loops = [
+			asyncio.create_task(self._run_schedule()),
+			asyncio.create_task(self._run_updater())
+		]
+		await self._stop_event.wait()
+		
+		for task in loops + list(self._tasks):
+			task.cancel()
+		await asyncio.gather(*loops, *self._tasks, return_exceptions=True)
+	
+	async def _run_schedule(self):
+		while True:
+			try:
+				schedule.run_pending() # jobs only queue main worker tasks
+			except Exception:
+				log(f"Failed to execute scheduled task:\n{get_err()}",
+					err=True, send_tg=True)
+			await asyncio.sleep(1)
+	
+	async def _run_updater(self):
+		while True:
+			try:
+				await self._fill_fetch_slots()
+			except Exception:
+				log(f"Failed to start player fetch:\n{get_err()}",
+					err=True, send_tg=True)
+			await asyncio.sleep(self.daemon.state.get("player_fetch_delay", 2))
+	
+	async def _fill_fetch_slots(self):
+		"Starts fetches of the most overdue players while there are free slots"
+		while self.daemon.is_running and not self._fetch_slots.locked():
+			if alsapi.get_breaker("bridge").get_wait():
+				return
+			
+			players = await self.run_main(
+				self.daemon._get_players_to_upd, ALS_BATCH_SIZE)
+			if not players: return
+			
+			await self._fetch_slots.acquire()
+			with self.daemon._fetching_lock:
+				for player in players:
+					self.daemon._fetching[player.uid] = None
+			task = asyncio.create_task(self._fetch(players))
+			self._tasks.add(task)
+			task.add_done_callback(self._tasks.discard)
+	
+	async def _fetch(self, players):
+		updated_uids, is_failed = set(), True
+		self.fetches_in_flight += 1
+		try:
+			try:
+				stats = await self.run_io(alsapi.get_players_stat,
+					[p.uid for p in players])
+			except alsapi.CircuitOpenError as err:
+				is_failed = False
+				log(f"Skipped stat fetch: {err}")
+				return
+			except Exception:
+				log(f"Failed to fetch players stat:\n{get_err()}",
+					err=True, send_tg=True)
+				return
+			
+			for player in players: # players not fetched are backed off
+				if player.uid not in stats or not self.daemon.is_running:
+					continue
+				updated_uids.add(player.uid) # failed update is not retried
+				try:
+					await self.run_main(self.daemon._apply_update,
+						player, stats[player.uid])
+				except Exception:
+					pass # logged by the main worker
+		finally:
+			self.fetches_in_flight -= 1
+			self._fetch_slots.release()
+			for player in players:
+				self.daemon._finish_fetch(player,
+					is_updated=player.uid in updated_uids, is_failed=is_failed)
@@ -0,0 +1,526 @@
+"""
+Compact binary timeline format
+
+File starts with MAGIC and then contains blocks of the following layout:
+	type (1 byte) | payload size (varint) | payload | crc32 (4 bytes) |
+	block size (4 bytes)
+Checksum covers type, payload size and payload. Trailing block size
+allows reading blocks backwards from the end of the file
+
+KEYS block payload: count, then (legend, stat_name) string pairs. Keys get
+sequential ids in the order they appear in the file, so each KEYS block is
+written right before the first ENTRIES block using its keys
+ENTRIES block payload: base timestamp, count, then for each entry timestamp
+delta from the previous entry (varint), key id (varint) and typed value
+CHECKPOINT block payload: timestamp, count, then (key id, typed value) pairs
+of the full stat at this point of the file
+"""
+
+import re, struct, zlib, io
+from pathlib import Path
+from util import log
+import filepool
+
+MAGIC = b"PTL1"
+
+BLOCK_KEYS    = 0x4b # "K"
+BLOCK_ENTRIES = 0x45 # "E"
+BLOCK_CHECKPOINT = 0x43 # "C"
+
+VALUE_NULL = 0 # "$null"
+VALUE_INT  = 1 # zigzag varint
+VALUE_DEC  = 2 # scale varint + zigzag varint mantissa
+VALUE_STR  = 3 # utf-8 string
+
+_TRAILER = struct.Struct("<II") # crc32, block size
+
+# only strings which can be restored char to char are stored as numbers
+_INT_RE = re.compile(r"-?(0|[1-9][0-9]*)")
+_DEC_RE = re.compile(r"-?(0|[1-9][0-9]*)\.([0-9]+)")
+
+class BinaryTimelineError(ValueError):
+	pass
+
+class Checkpoint():
+	def __init__(self, timestamp, stat):
+		self.timestamp = timestamp
+		self.stat = stat
+
+class BinaryTimelineFile():
+	"""
+	Timeline file appended block by block. If data is given, the file
+	contents are read from it instead (e.g. decompressed archived segment)
+	"""
+	def __init__(self, path, data=None):
+		self.path = Path(path)
+		self.data = data
+		self._keys = None # key id -> (legend, stat_name)
+		self._key_ids = None # (legend, stat_name) -> key id
+		self._scanned_size = 0
+	
+	def append(self, entries):
+		"""
+		Writes (timestamp, legend, stat_name, value) tuples as a single
+		ENTRIES block (preceded by KEYS block if there are new keys).
+		Returns file size after writing
+		"""
+		keys = [(legend, stat_name) for _, legend, stat_name, _ in entries]
+		return self._append(keys,
+			lambda key_ids: encode_entries_block(entries, key_ids))
+	
+	def append_checkpoint(self, timestamp, stat):
+		"Writes CHECKPOINT block of {(legend, stat_name): value} stat"
+		return self._append(list(stat),
+			lambda key_ids: encode_checkpoint_block(timestamp, stat, key_ids))
+	
+	def _append(self, keys, encode_fn):
+		self._load_keys(truncate_broken=True)
+		
+		data = bytearray()
+		if not self._scanned_size:
+			data += MAGIC
+		
+		key_ids = self._key_ids.copy()
+		new_keys = []
+		for legend, stat_name in keys:
+			key = (str(legend), str(stat_name))
+			if key not in key_ids:
+				key_ids[key] = len(key_ids)
+				new_keys.append(key)
+		if new_keys:
+			data += encode_keys_block(new_keys)
+		data += encode_fn(key_ids)
+		
+		self._scanned_size = filepool.singleton.append(self.path, bytes(data))
+		
+		# keys are registered only after they are actually written
+		for key in new_keys:
+			self._register_key(key)
+		return self._scanned_size
+	
+	def iter(self, reverse=False, offset=None, with_offsets=False,
+			with_checkpoints=False):
+		"""
+		Yields (timestamp, legend, stat_name, value) tuples starting from the
+		block boundary offset, or ending at it if reversed. with_offsets
+		yields (offset, entry) pairs instead, where offset is the block start
+		for the first entry of each block and None for the rest.
+		with_checkpoints also yields Checkpoint objects
+		"""
+		if not self._exists():
+			return
+		self._load_keys()
+		
+		if reverse:
+			blocks = self._iter_blocks_reverse(offset)
+		else:
+			blocks = self._iter_blocks(max(offset or 0, len(MAGIC)))
+		
+		for block_type, payload, start, end in blocks:
+			if block_type == BLOCK_CHECKPOINT and with_checkpoints:
+				checkpoint = decode_checkpoint_block(payload, self._keys)
+				yield (start, checkpoint) if with_offsets else checkpoint
+				continue
+			if block_type != BLOCK_ENTRIES:
+				continue
+			
+			entries = decode_entries_block(payload, self._keys)
+			offsets = [start] + [None] * (len(entries) - 1)
+			if reverse:
+				entries.reverse()
+				offsets.reverse()
+			
+			if with_offsets:
+				yield from zip(offsets, entries)
+			else:
+				yield from entries
+	
+	def iter_at(self, offsets, reverse=False):
+		"""
+		Yields entries of the first ENTRIES block found at each of the block
+		boundary offsets (reversed within the block if reverse is set)
+		"""
+		if not self._exists():
+			return
+		self._load_keys()
+		
+		with self._open() as fh:
+			for offset in offsets:
+				fh.seek(offset)
+				try:
+					block = _read_block(fh)
+					while block and block[0] != BLOCK_ENTRIES:
+						block = _read_block(fh)
+				except BinaryTimelineError as e:
+					log(f"Failed to read {self.path.name} timeline at offset "
+						f"{offset}: {e}", err=True)
+					return
+				if not block:
+					continue
+				
+				entries = decode_entries_block(block[1], self._keys)
+				if reverse:
+					entries.reverse()
+				yield from entries
+	
+	def is_block_end(self, offset):
+		"Checks whether a valid block ends exactly at the given offset"
+		if offset == len(MAGIC):
+			return True
+		if offset < len(MAGIC) + _TRAILER.size:
+			return False
+		
+		with self._open() as fh:
+			fh.seek(offset - 4)
+			block_size, = struct.unpack("<I", fh.read(4))
+			if block_size > offset - len(MAGIC):
+				return False
+			fh.seek(offset - block_size)
+			try:
+				_read_block(fh)
+			except BinaryTimelineError:
+				return False
+			return fh.tell() == offset
+	
+	def _register_key(self, key):
+		self._key_ids[key] = len(self._keys)
+		self._keys.append(key)
+	
+	def _load_keys(self, truncate_broken=False):
+		"""
+		Reads the key dictionary by skimming through all the blocks not
+		read yet. Broken tail (e.g. left by interrupted write) is cut off
+		if truncate_broken is set, so new blocks are not written after it
+		"""
+		if self._keys is None:
+			self._keys, self._key_ids, self._scanned_size = [], {}, 0
+		
+		file_size = self._size()
+		if self._scanned_size >= file_size:
+			return
+		
+		if not self._scanned_size:
+			with self._open() as fh:
+				if fh.read(len(MAGIC)) != MAGIC:
+					raise BinaryTimelineError(
+						f"{self.path.name} is not a binary timeline")
+			self._scanned_size = len(MAGIC)
+		
+		for block_type, payload, _, end in self._iter_blocks(
+				self._scanned_size):
+			if block_type == BLOCK_KEYS:
+				for key in decode_keys_block(payload):
+					self._register_key(key)
+			self._scanned_size = end
+		
+		if self._scanned_size < file_size and truncate_broken:
+			log(f"Cutting off {file_size - self._scanned_size} broken bytes "
+				f"at the end of {self.path.name} timeline", err=True)
+			with self.path.open("r+b") as fh:
+				fh.truncate(self._scanned_size)
+	
+	def _iter_blocks(self, offset):
+		"Yields (type, payload, start, end) of the blocks starting at offset"
+		with self._open() as fh:
+			fh.seek(offset)
+			while True:
+				try:
+					block = _read_block(fh)
+				except BinaryTimelineError as e:
+					log(f"Stopped reading {self.path.name} timeline at offset "
+						f"{offset}: {e}", err=True)
+					return
+				if not block:
+					return
+				start, offset = offset, fh.tell()
+				yield (*block, start, offset)
+	
+	def _iter_blocks_reverse(self, offset=None):
+		"Yields (type, payload, start, end) of the blocks ending at offset"
+		with self._open() as fh:
+			if offset is None:
+				offset = self._scanned_size
+			offset = min(offset, self._scanned_size)
+			while offset > len(MAGIC):
+				fh.seek(offset - 4)
+				block_size, = struct.unpack("<I", fh.read(4))
+				try:
+					if not _TRAILER.size < block_size <= offset - len(MAGIC):
+						raise BinaryTimelineError(
+							f"Invalid block size {block_size}")
+					fh.seek(offset - block_size)
+					block = _read_block(fh)
+					if fh.tell() != offset:
+						raise BinaryTimelineError("Block size mismatch")
+				except BinaryTimelineError as e:
+					log(f"Stopped reading {self.path.name} timeline backwards "
+						f"at offset {offset}: {e}", err=True)
+					return
+				yield (*block, offset - block_size, offset)
+				offset -= block_size
+	
+	def _open(self):
+		if self.data is not None:
+			return io.BytesIO(self.data)
+		return self.path.open("rb")
+	
+	def _exists(self):
+		return self.data is not None or self.path.exists()
+	
+	def _size(self):
+		if self.data is not None:
+			return len(self.data)
+		return self.path.stat().st_size if self.path.exists() else 0
+
+def write_file(path, entries, block_entries=256, checkpoint_interval=None):
+	"""
+	Writes (timestamp, legend, stat_name, value) tuples into a new binary
+	timeline file packing them into blocks. Checkpoints are put between the
+	blocks every checkpoint_interval bytes if it is set. Checkpoint objects
+	met among the entries are written as they are.
+	Returns number of entries written
+	"""
+	key_ids = {}
+	stat = {}
+	count = 0
+	last_checkpoint = 0
+	
+	with Path(path).open("xb") as fh:
+		fh.write(MAGIC)
+		
+		def _write_keys(keys):
+			new_keys = []
+			for legend, stat_name in keys:
+				key = (str(legend), str(stat_name))
+				if key not in key_ids:
+					key_ids[key] = len(key_ids)
+					new_keys.append(key)
+			if new_keys:
+				fh.write(encode_keys_block(new_keys))
+		
+		def _write_checkpoint(timestamp):
+			nonlocal last_checkpoint
+			last_checkpoint = fh.tell()
+			_write_keys(stat)
+			fh.write(encode_checkpoint_block(timestamp, stat, key_ids))
+		
+		def _flush(batch):
+			if checkpoint_interval and stat and \
+			fh.tell() - last_checkpoint >= checkpoint_interval:
+				_write_checkpoint(prev_ts)
+			
+			_write_keys((legend, stat_name) for \
+				_, legend, stat_name, _ in batch)
+			for _, legend, stat_name, value in batch:
+				stat[(str(legend), str(stat_name))] = str(value)
+			fh.write(encode_entries_block(batch, key_ids))
+		
+		# blocks are only split between timestamps when checkpoints are on
+		batch = []
+		prev_ts = None
+		for entry in entries:
+			if isinstance(entry, Checkpoint):
+				if batch:
+					_flush(batch)
+					batch = []
+				stat = {(str(legend), str(stat_name)): str(value) for \
+					(legend, stat_name), value in entry.stat.items()}
+				prev_ts = entry.timestamp
+				_write_checkpoint(entry.timestamp)
+				continue
+			if len(batch) >= block_entries and \
+			(not checkpoint_interval or entry[0] != batch[-1][0]):
+				_flush(batch)
+				prev_ts = batch[-1][0]
+				batch = []
+			batch.append(entry)
+			count += 1
+		if batch:
+			_flush(batch)
+	
+	return count
+
+def encode_keys_block(keys):
+	payload = bytearray(_varint(len(keys)))
+	for legend, stat_name in keys:
+		payload += _encode_str(legend)
+		payload += _encode_str(stat_name)
+	return _encode_block(BLOCK_KEYS, payload)
+
+def decode_keys_block(payload):
+	buf = _Buf(payload)
+	return [(buf.str(), buf.str()) for _ in range(buf.varint())]
+
+def encode_checkpoint_block(timestamp, stat, key_ids):
+	payload = bytearray(_varint(_zigzag(int(timestamp))))
+	payload += _varint(len(stat))
+	for key, value in stat.items():
+		payload += _varint(key_ids[(str(key[0]), str(key[1]))])
+		payload += _encode_value(str(value))
+	return _encode_block(BLOCK_CHECKPOINT, payload)
+
+def decode_checkpoint_block(payload, keys):
+	buf = _Buf(payload)
+	timestamp = _unzigzag(buf.varint())
+	stat = {}
+	
+	for _ in range(buf.varint()):
+		key_id = buf.varint()
+		if key_id >= len(keys):
+			raise BinaryTimelineError(f"Unknown key id {key_id}")
+		stat[keys[key_id]] = _decode_value(buf)
+	
+	return Checkpoint(timestamp, stat)
+
+def encode_entries_block(entries, key_ids):
+	base_ts = int(entries[0][0])
+	payload = bytearray(_varint(_zigzag(base_ts)))
+	payload += _varint(len(entries))
+	
+	prev_ts = base_ts
+	for timestamp, legend, stat_name, value in entries:
+		payload += _varint(_zigzag(int(timestamp) - prev_ts))
+		payload += _varint(key_ids[(str(legend), str(stat_name))])
+		payload += _encode_value(str(value))
+		prev_ts = int(timestamp)
+	
+	return _encode_block(BLOCK_ENTRIES, payload)
+
+def decode_entries_block(payload, keys):
+	buf = _Buf(payload)
+	timestamp = _unzigzag(buf.varint())
+	entries = []
+	
+	for _ in range(buf.varint()):
+		timestamp += _unzigzag(buf.varint())
+		key_id = buf.varint()
+		if key_id >= len(keys):
+			raise BinaryTimelineError(f"Unknown key id {key_id}")
+		entries.append((timestamp, *keys[key_id], _decode_value(buf)))
+	
+	return entries
+
+def _encode_block(block_type, payload):
+	block = bytearray((block_type,))
+	block += _varint(len(payload))
+	block += payload
+	block_size = len(block) + _TRAILER.size
+	block += _TRAILER.pack(zlib.crc32(block), block_size)
+	return bytes(block)
+
+def _read_block(fh):
+	"""
+	Reads a single block returning (type, payload) or None at the end of the
+	file. Raises BinaryTimelineError on broken or incomplete block
+	"""
+	header = bytearray(fh.read(1))
+	if not header:
+		return None
+	
+	while True: # payload size varint
+		byte = fh.read(1)
+		if not byte:
+			raise BinaryTimelineError("Incomplete block header")
+		header += byte
+		if byte[0] < 0x80:
+			break
+		if len(header) > 10:
+			raise BinaryTimelineError("Invalid block header")
+	payload_size = _Buf(header, 1).varint()
+	
+	data = fh.read(payload_size + _TRAILER.size)
+	if len(data) < payload_size + _TRAILER.size:
+		raise BinaryTimelineError("Incomplete block")
+	payload = data[:payload_size]
+	crc, block_size = _TRAILER.unpack_from(data, payload_size)
+	
+	if block_size != len(header) + len(data):
+		raise BinaryTimelineError("Block size mismatch")
+	if crc != zlib.crc32(payload, zlib.crc32(header)):
+		raise BinaryTimelineError("Block checksum mismatch")
+	
+	return (header[0], payload)
+
+def _encode_value(value):
+	if value == "$null":
+		return bytes((VALUE_NULL,))
+	
+	if _INT_RE.fullmatch(value) and value != "-0":
+		return bytes((VALUE_INT,)) + _varint(_zigzag(int(value)))
+	
+	dec_match = _DEC_RE.fullmatch(value)
+	if dec_match:
+		mantissa = int(value.replace(".", ""))
+		if mantissa or not value.startswith("-"):
+			scale = len(dec_match.group(2))
+			return bytes((VALUE_DEC,)) + _varint(scale) + \
+				_varint(_zigzag(mantissa))
+	
+	return bytes((VALUE_STR,)) + _encode_str(value)
+
+def _decode_value(buf):
+	value_type = buf.byte()
+	
+	if value_type == VALUE_NULL:
+		return "$null"
+	if value_type == VALUE_INT:
+		return str(_unzigzag(buf.varint()))
+	if value_type == VALUE_DEC:
+		scale = buf.varint()
+		mantissa = _unzigzag(buf.varint())
+		digits = str(abs(mantissa)).zfill(scale + 1)
+		sign = "-" if mantissa < 0 else ""
+		return f"{sign}{digits[:-scale]}.{digits[-scale:]}"
+	if value_type == VALUE_STR:
+		return buf.str()
+	
+	raise BinaryTimelineError(f"Unknown value type {value_type}")
+
+def _encode_str(text):
+	text_bytes = text.encode("utf-8")
+	return _varint(len(text_bytes)) + text_bytes
+
+def _varint(num):
+	result = bytearray()
+	while num > 0x7f:
+		result.append((num & 0x7f) | 0x80)
+		num >>= 7
+	result.append(num)
+	return result
+
+def _zigzag(num):
+	return num * 2 if num >= 0 else -num * 2 - 1
+
+def _unzigzag(num):
+	return num >> 1 if not num & 1 else -(num >> 1) - 1
+
+class _Buf():
+	"Sequential reader of a bytes-like object"
+	def __init__(self, data, pos=0):
+		self.data = data
+		self.pos = pos
+	
+	def byte(self):
+		try:
+			byte = self.data[self.pos]
+		except IndexError:
+			raise BinaryTimelineError("Unexpected end of block")
+		self.pos += 1
+		return byte
+	
+	def varint(self):
+		result = shift = 0
+		while True:
+			byte = self.byte()
+			result |= (byte & 0x7f) << shift
+			if byte < 0x80:
+				return result
+			shift += 7
+	
+	def str(self):
+		size = self.varint()
+		if self.pos + size > len(self.data):
+			raise BinaryTimelineError("Unexpected end of block")
+		text = str(self.data[self.pos:self.pos + size], "utf-8")
+		self.pos += size
+		return text
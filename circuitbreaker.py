@@ -0,0 +1,76 @@
+import random, threading, time
+
+class CircuitOpenError(Exception):
+	pass
+
+class CircuitBreaker():
+	"""
+	Stops requests to a failing service. After failure_threshold failures
+	in a row the circuit opens for a jittered delay, which doubles with
+	every failed retry from min_delay up to max_delay. Once the delay is
+	over, the circuit is half-open and lets a single trial request
+	through: its success closes the circuit, its failure opens it again
+	"""
+	CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+	
+	def __init__(self, name, failure_threshold=3, min_delay=5, max_delay=300):
+		self.name = name
+		self.failure_threshold = failure_threshold
+		self.min_delay = min_delay
+		self.max_delay = max_delay
+		self.lock = threading.Lock()
+		
+		self.state = self.CLOSED
+		self.failures = 0 # in a row
+		self.opened = 0 # times opened in a row, the delay grows with it
+		self.open_until = 0
+		self._trial_in_flight = False
+		
+		self.total_failures = 0
+		self.total_rejected = 0
+	
+	def before_request(self):
+		"Raises CircuitOpenError if the request is not to be sent"
+		with self.lock:
+			if self.state == self.OPEN and time.time() >= self.open_until:
+				self.state = self.HALF_OPEN
+				self._trial_in_flight = False
+			
+			if self.state == self.CLOSED:
+				return
+			if self.state == self.HALF_OPEN and not self._trial_in_flight:
+				self._trial_in_flight = True
+				return
+			
+			self.total_rejected += 1
+			raise CircuitOpenError(f"{self.name} circuit is {self.state}, "
+				f"retrying in {self.get_wait():.0f}s")
+	
+	def record_success(self):
+		with self.lock:
+			self.state = self.CLOSED
+			self.failures = self.opened = 0
+			self._trial_in_flight = False
+	
+	def record_failure(self):
+		with self.lock:
+			self.failures += 1
+			self.total_failures += 1
+			if self.state == self.HALF_OPEN or \
+			self.failures >= self.failure_threshold:
+				self._open()
+	
+	def get_wait(self):
+		"Seconds until a request may be sent, 0 if it may be sent now"
+		if self.state == self.CLOSED:
+			return 0
+		if self.state == self.HALF_OPEN:
+			return 0 if not self._trial_in_flight else self.min_delay
+		return max(0, self.open_until - time.time())
+	
+	def _open(self):
+		delay = min(self.max_delay, self.min_delay * 2 ** self.opened)
+		self.open_until = time.time() + delay * random.uniform(0.5, 1.5)
+		self.opened += 1
+		self.state = self.OPEN
+		self._trial_in_flight = False
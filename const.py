@@ -48,6 +48,70 @@ ASL_CHAT_ID      = int(environ["PATHY_ASL_CHAT_ID"])
 DL_PROXY_CHAT_ID = int(environ["PATHY_DL_PROXY_CHAT_ID"])
 
 SESS_MAX_BREAK = int(getenv("PATHY_SESS_MAX_BREAK", 30 * 60)) # default 30 min
+TIMELINE_SNAPSHOT_INTERVAL = int(getenv("PATHY_TIMELINE_SNAPSHOT_INTERVAL",
+	64 * 1024)) # bytes of timeline appended between end stat snapshots
+TIMELINE_INDEX_STEP = int(getenv("PATHY_TIMELINE_INDEX_STEP",
+	16 * 1024)) # min bytes of timeline between sparse index points
+TIMELINE_CHECKPOINT_INTERVAL = int(getenv("PATHY_TIMELINE_CHECKPOINT_INTERVAL",
+	256 * 1024)) # bytes of timeline between full stat checkpoints
+TIMELINE_SEGMENT_PERIOD = getenv("PATHY_TIMELINE_SEGMENT_PERIOD",
+	"%Y-%m") # strftime format, segment is rotated when it changes ("" - never)
+TIMELINE_ARCHIVE_COMPRESSION = getenv("PATHY_TIMELINE_ARCHIVE_COMPRESSION",
+	"gzip") # "gzip" or "lzma"
+TIMELINE_MAX_OPEN_FILES = int(getenv("PATHY_TIMELINE_MAX_OPEN_FILES",
+	128)) # append handles of timelines kept open
+TIMELINE_FSYNC_INTERVAL = int(getenv("PATHY_TIMELINE_FSYNC_INTERVAL",
+	-1)) # seconds between timeline fsyncs (0 - every write, -1 - never)
+TIMELINE_POSTINGS_STATS = _parse_list(getenv("PATHY_TIMELINE_POSTINGS_STATS",
+	"is_online,is_in_match")) # stats with entry offsets kept in the index
+DAEMON_CMD_TIMEOUT = float(getenv("PATHY_DAEMON_CMD_TIMEOUT",
+	4)) # seconds a command waits for the main worker (ctl waits 5)
+TIMELINE_FORMAT = getenv("PATHY_TIMELINE_FORMAT",
+	"text") # "text", "binary", "sqlite" or "memory" (not persisted)
+ALS_FETCH_CONCURRENCY = int(getenv("PATHY_ALS_FETCH_CONCURRENCY",
+	4)) # player stat requests to ALS API kept in flight
+ALS_BATCH_SIZE = int(getenv("PATHY_ALS_BATCH_SIZE",
+	10)) # players fetched in one ALS API request (1 - no batching)
+DAEMON_RUNTIME = getenv("PATHY_DAEMON_RUNTIME",
+	"threads") # "threads" or "asyncio"
+ASYNC_IO_THREADS = int(getenv("PATHY_ASYNC_IO_THREADS",
+	16)) # threads running blocking io of the asyncio runtime
+HTTP_POOL_SIZE = int(getenv("PATHY_HTTP_POOL_SIZE",
+	8)) # keep-alive connections kept per host
+HTTP_CONNECT_TIMEOUT = float(getenv("PATHY_HTTP_CONNECT_TIMEOUT", 10)) # seconds
+HTTP_READ_TIMEOUT = float(getenv("PATHY_HTTP_READ_TIMEOUT",
+	120)) # seconds, default of the requests which don't set their own
+ALS_CONNECT_TIMEOUT = float(getenv("PATHY_ALS_CONNECT_TIMEOUT", 5)) # seconds
+ALS_READ_TIMEOUT = float(getenv("PATHY_ALS_READ_TIMEOUT", 20)) # seconds
+ALS_RETRY_DELAY = float(getenv("PATHY_ALS_RETRY_DELAY",
+	0.5)) # seconds before the first retry, doubled for the next ones
+ALS_BREAKER_THRESHOLD = int(getenv("PATHY_ALS_BREAKER_THRESHOLD",
+	3)) # failures in a row which stop requests to the ALS API endpoint
+ALS_BREAKER_MIN_DELAY = int(getenv("PATHY_ALS_BREAKER_MIN_DELAY",
+	5)) # seconds before the first trial request, doubled on its failure
+ALS_BREAKER_MAX_DELAY = int(getenv("PATHY_ALS_BREAKER_MAX_DELAY", 5 * 60))
+ALS_RATE_LIMIT = float(getenv("PATHY_ALS_RATE_LIMIT",
+	1)) # ALS API requests per second
+ALS_RATE_BURST = int(getenv("PATHY_ALS_RATE_BURST",
+	1)) # ALS API requests allowed at once on top of the rate
+TG_RATE_LIMIT = float(getenv("PATHY_TG_RATE_LIMIT",
+	25)) # Telegram Bot API requests per second
+TG_RATE_BURST = int(getenv("PATHY_TG_RATE_BURST", 5))
+POLL_INTERVAL_IN_MATCH = int(getenv("PATHY_POLL_INTERVAL_IN_MATCH",
+	15)) # seconds between player stat polls by player state
+POLL_INTERVAL_IN_LOBBY = int(getenv("PATHY_POLL_INTERVAL_IN_LOBBY", 20))
+POLL_INTERVAL_RECENTLY_OFFLINE = int(getenv(
+	"PATHY_POLL_INTERVAL_RECENTLY_OFFLINE", 30)) # within SESS_MAX_BREAK
+POLL_INTERVAL_OFFLINE = int(getenv("PATHY_POLL_INTERVAL_OFFLINE", 60))
+POLL_INTERVAL_LONG_OFFLINE = int(getenv("PATHY_POLL_INTERVAL_LONG_OFFLINE",
+	10 * 60)) # offline for POLL_LONG_OFFLINE_AFTER
+POLL_LONG_OFFLINE_AFTER = int(getenv("PATHY_POLL_LONG_OFFLINE_AFTER",
+	14 * 24 * 60 * 60)) # default 2 weeks
+POLL_INTERVAL_BANNED = int(getenv("PATHY_POLL_INTERVAL_BANNED", 5 * 60))
+POLL_INTERVAL_NO_CHATS = int(getenv("PATHY_POLL_INTERVAL_NO_CHATS", 30 * 60))
+POLL_RETRY_DELAY = float(getenv("PATHY_POLL_RETRY_DELAY",
+	5)) # seconds before retrying a failed poll, doubles with every failure
+POLL_RETRY_MAX_DELAY = float(getenv("PATHY_POLL_RETRY_MAX_DELAY", 5 * 60))
 MAINTAINANCE_MODE = bool(int(getenv("PATHY_MAINTAINANCE_MODE", 0)))
 
 GDRIVE_ASSETS_ID = environ["PATHY_GDRIVE_ASSETS_ID"]
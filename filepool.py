@@ -0,0 +1,72 @@
+import os, time
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from const import *
+
+class AppendFilePool():
+	"""
+	Keeps append handles of frequently written files open, so that they are
+	not reopened on every write. Least recently used handles are closed
+	when there are too many of them. Every write is flushed right away, as
+	files are read back through separate handles; fsync happens at most
+	once per fsync_interval seconds (0 - on every write, -1 - never)
+	"""
+	def __init__(self, max_open, fsync_interval):
+		self.max_open = max_open
+		self.fsync_interval = fsync_interval
+		self.lock = Lock()
+		self._files = OrderedDict() # path -> [handle, last fsync time]
+	
+	def append(self, path, data):
+		"Appends data with a single write, returns file size after writing"
+		path = str(path)
+		with self.lock:
+			file = self._get(path)
+			fh = file[0]
+			try:
+				fh.write(data)
+				fh.flush()
+				if self.fsync_interval >= 0 and \
+				time.time() - file[1] >= self.fsync_interval:
+					os.fsync(fh.fileno())
+					file[1] = time.time()
+				return fh.tell()
+			except OSError:
+				self._close(path) # will be reopened on the next write
+				raise
+	
+	def close(self, path):
+		"Must be called before the file is moved or removed"
+		with self.lock:
+			self._close(str(path))
+	
+	def close_all(self):
+		with self.lock:
+			for path in list(self._files):
+				self._close(path)
+	
+	def _get(self, path):
+		if path in self._files:
+			self._files.move_to_end(path)
+			return self._files[path]
+		
+		while len(self._files) >= self.max_open:
+			self._close(next(iter(self._files)))
+		
+		self._files[path] = [Path(path).open("ab"), time.time()]
+		return self._files[path]
+	
+	def _close(self, path):
+		file = self._files.pop(path, None)
+		if not file:
+			return
+		
+		try:
+			if self.fsync_interval >= 0:
+				file[0].flush()
+				os.fsync(file[0].fileno())
+		finally:
+			file[0].close()
+
+singleton = AppendFilePool(TIMELINE_MAX_OPEN_FILES, TIMELINE_FSYNC_INTERVAL)
@@ -1,7 +1,7 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-import random, requests
-import tgapi
+import random
+import tgapi, httpclient
 from const import *
 from util import bytes2type
 
@@ -92,6 +92,6 @@ class GoogleDriveFile():
 			file_url=self.data["webContentLink"], file_type=file_type)
 	
 	def read(self, data_type=bytes):
-		resp = requests.get(self.data["webContentLink"])
+		resp = httpclient.singleton.get(self.data["webContentLink"])
 		resp.raise_for_status()
 		return bytes2type(resp.content, data_type)
\ No newline at end of file
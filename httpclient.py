@@ -0,0 +1,92 @@
+import requests, threading, weakref
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from const import *
+
+class HttpClient():
+	"""
+	Keeps a keep-alive connection pool (adapter) per host, so that requests
+	to the same host reuse their connections instead of making new TCP and
+	TLS handshakes. The pool is bounded to pool_size connections, requests
+	wait for a free one when all of them are busy. requests.Session is not
+	thread-safe, so every thread has a session of its own per host mounting
+	the shared adapter. Requests without a timeout get the default
+	(connect, read) one
+	"""
+	def __init__(self, pool_size, timeout):
+		self.pool_size = pool_size
+		self.timeout = timeout
+		self.lock = threading.Lock()
+		self._adapters = {} # host -> HTTPAdapter
+		self._requests = {} # host -> requests sent
+		self._local = threading.local() # sessions: host -> requests.Session
+		self._sessions = weakref.WeakSet() # sessions of all threads
+	
+	def request(self, method, url, **kwargs):
+		kwargs.setdefault("timeout", self.timeout)
+		host = urlsplit(url).netloc
+		session = self._get_session(host)
+		with self.lock:
+			self._requests[host] = self._requests.get(host, 0) + 1
+		return session.request(method, url, **kwargs)
+	
+	def get(self, url, **kwargs):
+		return self.request("GET", url, **kwargs)
+	
+	def post(self, url, **kwargs):
+		return self.request("POST", url, **kwargs)
+	
+	def get_stats(self):
+		"Returns {host: {requests, connections, reused}} of the sessions"
+		with self.lock:
+			adapters = dict(self._adapters)
+			requests_sent = dict(self._requests)
+		
+		stats = {}
+		for host, adapter in adapters.items():
+			connections = 0
+			pools = adapter.poolmanager.pools
+			for key in pools.keys():
+				pool = pools.get(key)
+				if pool:
+					connections += pool.num_connections
+			
+			sent = requests_sent.get(host, 0)
+			stats[host] = {
+				"requests": sent,
+				"connections": connections,
+				"reused": max(0, sent - connections)
+			}
+		return stats
+	
+	def close(self):
+		"Closes sessions and pools, threads get new sessions on the next request"
+		with self.lock:
+			for session in list(self._sessions):
+				session.close()
+			for adapter in self._adapters.values():
+				adapter.close()
+			self._sessions.clear()
+			self._adapters.clear()
+	
+	def _get_session(self, host):
+		with self.lock:
+			if host not in self._adapters:
+				# a few more host pools are kept for the redirects
+				self._adapters[host] = HTTPAdapter(pool_connections=4,
+					pool_maxsize=self.pool_size, pool_block=True)
+			adapter = self._adapters[host]
+		
+		if not hasattr(self._local, "sessions"):
+			self._local.sessions = {}
+		session = self._local.sessions.get(host)
+		if not session or session.adapters["https://"] is not adapter:
+			session = requests.Session()
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+			self._local.sessions[host] = session
+			with self.lock:
+				self._sessions.add(session)
+		return session
+
+singleton = HttpClient(HTTP_POOL_SIZE, (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
@@ -1,8 +1,16 @@
-import time, json, threading, schedule, io
-import util, alsapi, tgapi, gdrive, youtube
+import time, json, threading, schedule, io, gzip, lzma, shutil, tempfile
+import util, alsapi, tgapi, gdrive, youtube, binarytimeline, filepool
+import ratelimit, httpclient, asyncdaemon
+import sqlitetimeline
+import timelinequery, pollscheduler
 from pathlib import Path
 from multiprocessing.connection import Listener
 from collections import deque
+from concurrent.futures import Future
+from itertools import zip_longest
+from copy import deepcopy
+from array import array
+from bisect import bisect_left, bisect_right
 from util import get_rnd_str, log, format_time, get_err, fix_text_layout
 from const import *
 from resourcemanager import singleton as resmgr
@@ -16,13 +24,25 @@ class PathyDaemon():
 	def __init__(self):
 		self.started = False
 		self.state = None
-		self.last_updated_player = None
-		self.last_als_err_time = 0
+		self.poll_scheduler = pollscheduler.PollScheduler(POLL_RETRY_DELAY,
+			POLL_RETRY_MAX_DELAY)
 		self.is_running = False
 		self.run_id = None
 		
 		self.main_worker  = WorkerThread("main",  daemon=True)
-		self.fetch_worker = WorkerThread("fetch", daemon=True)
+		self._fetching = {} # uid -> fetch worker (None in asyncio) of the fetch
+		self._fetching_lock = threading.Lock()
+		
+		# asyncio runtime replaces the fetch workers and scheduler thread
+		self.runtime = None
+		self.fetch_workers = []
+		if DAEMON_RUNTIME == "asyncio":
+			self.runtime = asyncdaemon.AsyncRuntime(self, ASYNC_IO_THREADS)
+		elif DAEMON_RUNTIME == "threads":
+			self.fetch_workers = [WorkerThread(f"fetch_{i}", daemon=True) \
+				for i in range(ALS_FETCH_CONCURRENCY)]
+		else:
+			raise ValueError(f"Unknown daemon runtime: {DAEMON_RUNTIME}")
 		self.scheduler = threading.Thread(
 			target=self.run_scheduler, daemon=True)
 	
@@ -43,9 +63,13 @@ class PathyDaemon():
 		self.load_state()
 		
 		self.main_worker.start()
-		self.fetch_worker.start()
-		self.scheduler.start()
 		self.is_running = True
+		if self.runtime:
+			self.runtime.start()
+		else:
+			for fetch_worker in self.fetch_workers:
+				fetch_worker.start()
+			self.scheduler.start()
 		
 		log("Started daemon instance with run_id " + self.run_id, send_tg=True)
 		self.run_listener()
@@ -73,18 +97,30 @@ class PathyDaemon():
 			log("Stopping daemon")
 			
 			self.is_running = False
+			if self.runtime:
+				try:
+					self.runtime.stop(timeout=10)
+					log("Asyncio runtime stopped gracefully")
+				except TimeoutError:
+					log("Failed to gracefully stop asyncio runtime, killing")
 			try:
 				self.main_worker.stop(timeout=10)
 				log("Main worker stopped gracefully")
 			except TimeoutError:
 				log("Failed to gracefully stop main worker, killing")
-			try:
-				self.fetch_worker.stop(timeout=10)
-				log("Fetch worker stopped gracefully")
-			except TimeoutError:
-				log("Failed to gracefully stop fetch worker, killing")
+			for fetch_worker in self.fetch_workers:
+				try:
+					fetch_worker.stop(timeout=10)
+					log(f"Worker {fetch_worker.name} stopped gracefully")
+				except TimeoutError:
+					log(f"Failed to gracefully stop worker {fetch_worker.name}"
+						", killing")
 			
 			self.save_state()
+			for player in self.iter_players():
+				player.timeline.close()
+			filepool.singleton.close_all()
+			httpclient.singleton.close()
 			self.unlock()
 			log("Gracefully stopped daemon instance with run_id "
        			+ self.run_id, send_tg=True)
@@ -111,6 +147,10 @@ class PathyDaemon():
 						"Daemon: accepted connection but got no msg")
 				
 				msg, args = conn.recv()
+				if self.runtime and msg != "stop":
+					# handled by the runtime, the listener doesn't wait
+					self.runtime.submit(self.runtime.serve_cmd(conn, msg, args))
+					continue
 				conn.send(self.handle_cmd(msg, args))
 				conn.close()
 			except Exception:
@@ -141,6 +181,36 @@ class PathyDaemon():
 			sess_segs = player.get_last_sess().split_by_states()
 			return "\n--- --- ---\n".join([seg.format() for seg in sess_segs])
 		
+		if msg == "query":
+			query = timelinequery.TimelineQuery.from_args(args)
+			try: # timelines are only read on the main worker
+				return self.main_worker.task(self.run_query, sync=True,
+					timeout=DAEMON_CMD_TIMEOUT).run(str(args.get("uid")), query)
+			except TimeoutError:
+				return "Timed out waiting for the daemon, try again later"
+		
+		if msg == "rollups":
+			days = float(args.get("days", 7))
+			try: # timelines are only read on the main worker
+				return self.main_worker.task(self.get_rollups_text, sync=True,
+					timeout=DAEMON_CMD_TIMEOUT).run(str(args.get("uid")), days)
+			except TimeoutError:
+				return "Timed out waiting for the daemon, try again later"
+		
+		if msg == "ratelimits":
+			result = json.dumps(ratelimit.singleton.get_stats(), indent=1)
+			return f"<pre>{util.sanitize_html(result)}</pre>"
+		
+		if msg == "worker_stats":
+			workers = [self.main_worker] + self.fetch_workers
+			stats = {w.name: w.get_stats() for w in workers}
+			result = json.dumps(stats, indent=1)
+			return f"<pre>{util.sanitize_html(result)}</pre>"
+		
+		if msg == "http_stats":
+			result = json.dumps(httpclient.singleton.get_stats(), indent=1)
+			return f"<pre>{util.sanitize_html(result)}</pre>"
+		
 		if msg == "players":
 			result = ""
 			for player in self.iter_players():
@@ -177,61 +247,126 @@ class PathyDaemon():
 		if msg == "run_id":
 			return self.run_id
 		
+		if msg == "convert_timelines":
+			self.main_worker.task(self.convert_timelines).run()
+			return "STARTED"
+		
+		if msg == "migrate_timelines":
+			self.main_worker.task(self.migrate_timelines).run(
+				args.get("format", TIMELINE_FORMAT))
+			return "STARTED"
+		
+		if msg == "benchmark_timelines":
+			player = self.get_player_by_uid(str(args.get("uid")))
+			if not player:
+				return "Unknown player"
+			self.main_worker.task(self.benchmark_timelines).run(player)
+			return "STARTED"
+		
 		else:
 			return "UNKNOWN_MSG"
 	
-	def _get_player_to_upd(self):
-		# This approach is inconsistent if player list is updated in runtime
-		players = self.state["tracked_players"]
-		if not players:
-			return
-		
-		if self.last_updated_player in players:
-			idx = (players.index(self.last_updated_player) + 1) % len(players)
-		else:
-			idx = 0
-		
-		self.last_updated_player = players[idx]
-		return players[idx]
+	def _get_players_to_upd(self, count):
+		players = {p.uid: p for p in self.state["tracked_players"]}
+		self.poll_scheduler.sync(players)
+		result = []
+		while len(result) < count:
+			uid = self.poll_scheduler.pop()
+			if not uid: break
+			result.append(players[uid])
+		return result
 	
 	def do_player_upd(self):
 		"""
-		Uses main worker to get player to update, then retrieves player
-		statistics from ALS API using fetch worker (to not to slow down main
+		Uses main worker to get players to update, then retrieves player
+		statistics from ALS API using fetch workers (to not to slow down main
 		worker with web requests), then runs update on retrieved data on
-		main worker
+		main worker. Every free fetch worker gets up to ALS_BATCH_SIZE most
+		overdue players (see PollScheduler) to fetch in one request, so that
+		up to ALS_FETCH_CONCURRENCY requests are in flight, while alsapi
+		keeps them within ALS_RATE_LIMIT. Player is not fetched again until
+		its update is applied, so updates of a player are applied in order.
+		Next poll of the player is scheduled by its activity, failed one is
+		retried after a growing backoff (POLL_RETRY_DELAY doubling up to
+		POLL_RETRY_MAX_DELAY). Nothing is fetched while ALS API circuit
+		breaker doesn't let the requests through, players it held back are
+		retried before the others
 		"""
 		
-		throttle_cooldown = 30
-		if self.last_als_err_time + throttle_cooldown > time.time():
-			return # throttling in case of ALS API errors
-		
-		player = self.main_worker.task(
-			self._get_player_to_upd, sync=True).run()
-		if not player: return
+		if alsapi.get_breaker("bridge").get_wait():
+			return
 		
+		while self.is_running:
+			with self._fetching_lock:
+				busy_workers = set(self._fetching.values())
+			free_workers = [w for w in self.fetch_workers if \
+				w not in busy_workers]
+			if not free_workers:
+				return
+			
+			players = self.main_worker.task(
+				self._get_players_to_upd, sync=True).run(ALS_BATCH_SIZE)
+			if not players: return
+			self._fetch_players(players, free_workers[0])
+	
+	def _fetch_players(self, players, fetch_worker):
 		def _fetch_step():
-			if not self.is_running: return
+			scheduled_uids, is_failed = set(), False
 			try:
-				stat = alsapi.get_player_stat(player.uid)
-			except Exception:
-				self.last_als_err_time = time.time()
-				log("Detected ALS API error, throttling")
-				raise
-			if not self.is_running: return
-			self.main_worker.task(_update_step).run(stat)
-		
-		def _update_step(stat):
-			if not self.is_running: return
-			upd_resp = player.update(stat)
-			if upd_resp["went_online"] or upd_resp["went_offline"]:
-				self.handle_party_events(player)
-		
+				if not self.is_running: return
+				is_failed = True
+				try:
+					stats = alsapi.get_players_stat([p.uid for p in players])
+				except alsapi.CircuitOpenError as err:
+					is_failed = False
+					log(f"Skipped stat fetch: {err}")
+					return
+				if not self.is_running: return
+				for player in players: # players not fetched are backed off
+					if player.uid in stats:
+						self.main_worker.task(_update_step).run(
+							player, stats[player.uid])
+						scheduled_uids.add(player.uid)
+			finally:
+				for player in players:
+					if player.uid not in scheduled_uids:
+						self._finish_fetch(player, is_failed=is_failed)
+		
+		def _update_step(player, stat):
+			try:
+				self._apply_update(player, stat)
+			finally:
+				# failed update is not retried
+				self._finish_fetch(player, is_updated=True)
+		
+		with self._fetching_lock:
+			for player in players:
+				self._fetching[player.uid] = fetch_worker
 		try:
-			self.fetch_worker.task(
-				_fetch_step, max=1, tag="stat_fetch").run()
-		except OverflowError:
-			pass
+			fetch_worker.task(_fetch_step, max=1, tag="stat_fetch").run()
+		except Exception:
+			for player in players:
+				self._finish_fetch(player)
+			raise
+	
+	def _apply_update(self, player, stat):
+		if not self.is_running: return
+		upd_resp = player.update(stat)
+		if upd_resp["went_online"] or upd_resp["went_offline"]:
+			self.handle_party_events(player)
+	
+	def _finish_fetch(self, player, is_updated=False, is_failed=False):
+		"Schedules next poll of the fetched player, backs it off or retries it"
+		with self._fetching_lock:
+			self._fetching.pop(player.uid, None)
+		if is_updated:
+			now = time.time()
+			self.poll_scheduler.done(player.uid,
+				now + player.get_poll_interval(now))
+		elif is_failed:
+			self.poll_scheduler.fail(player.uid)
+		else:
+			self.poll_scheduler.retry(player.uid)
 	
 	def handle_party_events(self, player):
 		for chat_id in player.state["chats"]:
@@ -269,16 +404,54 @@ class PathyDaemon():
 			self.state["chats_data"][str(chat_id)] = {}
 		return self.state["chats_data"][str(chat_id)]
 	
+	def run_query(self, uid, query):
+		player = self.get_player_by_uid(uid)
+		if not player:
+			return "Unknown player"
+		result = query.format(query.run(player.timeline))
+		return f"<pre>{util.sanitize_html(result)}</pre>"
+	
+	def get_rollups_text(self, uid, days):
+		player = self.get_player_by_uid(uid)
+		if not player:
+			return "Unknown player"
+		now = int(time.time())
+		summary = player.timeline.get_rollup_summary(
+			now - int(days * 86400), now)
+		result = json.dumps(summary, ensure_ascii=False, indent=1)
+		return f"<pre>{util.sanitize_html(result)}</pre>"
+	
 	def get_status(self):
 		result = ""
 		result += f"Головний потік: "
 		result += f"{'Живий' if True else '😵'}\n"
 		result += f"Робочий потік: "
 		result += f"{'Живий' if self.main_worker.is_alive() else '😵'}\n"
-		result += f"Потік отримання стати: "
-		result += f"{'Живий' if self.fetch_worker.is_alive() else '😵'}\n"
-		result += f"Потік планувальника: "
-		result += f"{'Живий' if self.scheduler.is_alive() else '😵'}\n"
+		if self.runtime:
+			result += f"Цикл asyncio: "
+			result += f"{'Живий' if self.runtime.is_alive() else '😵'}\n"
+			result += f"Запитів стати в процесі: "
+			result += f"{self.runtime.fetches_in_flight}\n"
+		else:
+			fetch_alive = len([w for w in self.fetch_workers if w.is_alive()])
+			result += f"Потоки отримання стати: "
+			result += f"{fetch_alive}/{len(self.fetch_workers)} живі"
+			result += f"{'' if fetch_alive else ' 😵'}\n"
+		for breaker in alsapi.get_breakers().values():
+			result += f"{breaker.name}: "
+			if breaker.state == breaker.CLOSED:
+				result += "Працює\n"
+			elif breaker.state == breaker.HALF_OPEN:
+				result += "Перевіряється\n"
+			else:
+				wait = format_time(breaker.get_wait(), include_seconds=True)
+				result += f"Недоступне, перевірка через {wait}\n"
+		overdue, lag = self.poll_scheduler.get_lag()
+		result += f"Гравців в черзі оновлення: {overdue}"
+		result += f" (до {format_time(lag)})\n" if overdue else "\n"
+		if not self.runtime:
+			result += f"Потік планувальника: "
+			result += f"{'Живий' if self.scheduler.is_alive() else '😵'}\n"
 		
 		return result.strip()
 	
@@ -295,6 +468,17 @@ class PathyDaemon():
 		self.lock_handle.close()
 	
 	def run_scheduler(self):
+		self.setup_schedule()
+		while True:
+			try:
+				schedule.run_pending()
+			except Exception:
+				log(f"Failed to execute scheduled task:" \
+					f"\n{get_err()}",
+					err=True, send_tg=True)
+			time.sleep(1)
+	
+	def setup_schedule(self, with_updater=True):
 		def _hour(hour):
 			return str(hour - util.get_hours_offset()).zfill(2)
 		
@@ -310,8 +494,9 @@ class PathyDaemon():
 		def upd_player():
 			if not self.is_running: return
 			self.do_player_upd()
-		updater_interval = self.state.get("player_fetch_delay", 2)
-		schedule.every(updater_interval).seconds.do(upd_player)
+		if with_updater:
+			updater_interval = self.state.get("player_fetch_delay", 2)
+			schedule.every(updater_interval).seconds.do(upd_player)
 		
 		def save_state():
 			self.main_worker.task(self.save_state).run()
@@ -320,15 +505,6 @@ class PathyDaemon():
 		def ensure_single_instance():
 			self.main_worker.task(self.ensure_single_instance).run()
 		schedule.every(60).seconds.do(ensure_single_instance)
-		
-		while True:
-			try:
-				schedule.run_pending()
-			except Exception:
-				log(f"Failed to execute scheduled task:" \
-					f"\n{get_err()}",
-					err=True, send_tg=True)
-			time.sleep(1)
 	
 	def load_state(self):
 		self.state = util.get_state()
@@ -583,6 +759,63 @@ class PathyDaemon():
 			chat_state["delplayer_initiator"] = None
 			return
 	
+	def convert_timelines(self):
+		converted = 0
+		for text_path in sorted(TIMELINE_DIR.glob("*.txt")):
+			try:
+				convert_timeline(text_path, text_path.with_suffix(".ptl"))
+				converted += 1
+			except Exception:
+				log(f"Failed to convert {text_path.name} timeline:"
+					f"\n{get_err()}", err=True, send_tg=True)
+		
+		for player in self.iter_players():
+			player.timeline = open_stored_timeline(player.uid)
+		
+		log(f"Converted {converted} timelines to binary format", send_tg=True)
+	
+	def migrate_timelines(self, timeline_format):
+		"""
+		Copies player timelines into the backend of timeline_format. Text
+		and binary timelines share their archives, so these are switched
+		with convert_timelines
+		"""
+		if timeline_format != "sqlite":
+			raise ValueError(f"Can't migrate timelines to {timeline_format}")
+		backend_cls, suffix = get_timeline_backends()[timeline_format]
+		migrated = 0
+		for player in self.iter_players():
+			target_path = TIMELINE_DIR / f"{player.uid}{suffix}"
+			if target_path.exists():
+				continue
+			
+			target = backend_cls(target_path)
+			try:
+				migrate_timeline(player.timeline, target)
+				migrated += 1
+			except Exception:
+				target.close()
+				for path in TIMELINE_DIR.glob(f"{player.uid}{suffix}*"):
+					path.unlink()
+				log(f"Failed to migrate {player.uid} timeline:"
+					f"\n{get_err()}", err=True, send_tg=True)
+				continue
+			
+			target.close()
+			player.timeline.close()
+			player.timeline = open_stored_timeline(player.uid)
+		
+		log(f"Migrated {migrated} timelines to {timeline_format} format" + \
+			("" if timeline_format == TIMELINE_FORMAT else \
+			f", set TIMELINE_FORMAT to {timeline_format} to use them"),
+			send_tg=True)
+	
+	def benchmark_timelines(self, player):
+		with tempfile.TemporaryDirectory(dir=TIMELINE_DIR) as work_dir:
+			result = benchmark_timeline_backends(player.timeline, work_dir)
+		log(f"Timeline backends benchmark on {player.name}:\n{result}",
+			send_tg=True)
+	
 	def send_hate_monday_pic(self):
 		resmgr.get_hate_monday_img().send_tg(
 			ASL_CHAT_ID, force_file_type="animation")
@@ -619,37 +852,65 @@ class PathyDaemon():
 				log(f"Failed to notify about {channel['name']} " \
 					f"videos:\n{get_err()}", err=True, send_tg=True)
 
-class WorkerThread(threading.Thread):
-	def __init__(self, name=None, daemon=False):
-		super().__init__(daemon=daemon)
+class WorkerThread():
+	"""
+	Runs tasks one at a time in order of submission, or a few at a time
+	if it has several threads. Idle threads wait on a condition variable,
+	queued tasks are counted by tag to enforce the max of the task in O(1).
+	Every task gets a Future of its result, and its queue wait and run
+	times are accounted
+	"""
+	def __init__(self, name=None, daemon=False, threads=1):
 		self.name = name
+		self.daemon = daemon
+		self._threads = [threading.Thread(target=self.run, daemon=daemon,
+			name=name if threads == 1 else f"{name}_{i}") \
+			for i in range(threads)]
 		self._tasks = deque()
-		self._idle = threading.Lock()
+		self._cond = threading.Condition()
+		self._tag_counts = {} # tag -> queued tasks with the tag
+		self._stopping = False
+		
+		self.running = 0
+		self.done = 0
+		self.failed = 0
+		self.wait_time = 0
+		self.max_wait_time = 0
+		self.run_time = 0
+		self.max_run_time = 0
+	
+	def start(self):
+		for thread in self._threads:
+			thread.start()
+	
+	def is_alive(self):
+		return all(thread.is_alive() for thread in self._threads)
 	
 	def run(self):
 		while True:
-			if self._tasks:
+			with self._cond:
+				while not self._tasks and not self._stopping:
+					self._cond.wait()
+				if not self._tasks:
+					return # stopping and no tasks left
 				task = self._tasks.popleft()
-				
-				try:
-					if util.equal_functions(task.func, self._stop_identifier):
-						break
-					
-					task.result = task.func(*task.args, **task.kwargs)
-					if task.then: task.then()
-				
-				except Exception as e:
-					task.err = e
-					log(f"Worker '{self.name}' error:\n{get_err()}",
-						err=True, send_tg=True)
-				
-				finally:
-					if task.lock:
-						task.lock.release()
-			else:
-				self._idle.acquire()
-				self._idle.acquire()
-				self._idle.release()
+				self._untag(task)
+				if not task.future.set_running_or_notify_cancel():
+					continue
+				self.running += 1
+			
+			task.started_at = time.time()
+			try:
+				result = task.func(*task.args, **task.kwargs)
+				if task.then: task.then()
+				task.future.set_result(result)
+			except Exception as e:
+				task.future.set_exception(e)
+				log(f"Worker '{self.name}' error:\n{get_err()}",
+					err=True, send_tg=True)
+			finally:
+				task.finished_at = time.time()
+				self._account(task)
 	
 	def task(self, func, *args, **kwargs):
 		return WorkerTask(self, func, *args, **kwargs)
@@ -657,37 +918,88 @@ class WorkerThread(threading.Thread):
 	def do_task(self, task):
 		if not self.is_alive():
 			raise RuntimeError(f"Worker thread {self.name} is dead")
+		if task.sync and threading.current_thread() in self._threads:
+			# task of the worker itself would wait for itself forever
+			result = task.func(*task.args, **task.kwargs)
+			if task.then: task.then()
+			return result
 		
-		if task.max:
-			same_tasks = len(list(filter(
-				lambda prev_task: prev_task.tag == task.tag, self._tasks)))
-			if same_tasks >= task.max:
+		with self._cond:
+			if self._stopping:
+				raise RuntimeError(f"Worker thread {self.name} is stopped")
+			if task.max and self._tag_counts.get(task.tag, 0) >= task.max:
 				raise OverflowError(f"Daemon worker queue limit reached " \
 					f"for task with tag {task.tag}")
-		
-		if len(self._tasks) > 10:
-			log(f"WARN: Worker {self.name} queue size is {len(self._tasks)}",
+			
+			task.queued_at = time.time()
+			self._tasks.append(task)
+			if task.tag is not None:
+				self._tag_counts[task.tag] = \
+					self._tag_counts.get(task.tag, 0) + 1
+			queue_size = len(self._tasks)
+			self._cond.notify()
+		
+		if queue_size > 10:
+			log(f"WARN: Worker {self.name} queue size is {queue_size}",
 				send_tg=True)
 		
-		self._tasks.append(task)
-		if self._idle.locked():
-			self._idle.release()
-		
 		if task.sync:
-			if not task.lock.acquire(timeout=task.timeout):
-				raise TimeoutError
-			task.lock.release()
-			
-			if task.err: raise task.err
-			return task.result
+			timeout = task.timeout if task.timeout >= 0 else None
+			return task.future.result(timeout) # raises TimeoutError
+		return task.future
 	
 	def stop(self, drop_pending=False, timeout=10):
-		if drop_pending:
-			self._tasks.clear()
-		self.task(self._stop_identifier, sync=True, timeout=timeout).run()
+		"Lets the queued tasks finish (unless dropped) and stops the threads"
+		with self._cond:
+			self._stopping = True
+			if drop_pending:
+				while self._tasks:
+					task = self._tasks.popleft()
+					self._untag(task)
+					task.future.cancel()
+			self._cond.notify_all()
+		
+		deadline = time.time() + timeout
+		for thread in self._threads:
+			if thread.is_alive():
+				thread.join(max(0, deadline - time.time()))
+			if thread.is_alive():
+				raise TimeoutError
 	
-	def _stop_identifier(self):
-		pass
+	def get_stats(self):
+		with self._cond:
+			return {
+				"threads": len(self._threads),
+				"alive": len([t for t in self._threads if t.is_alive()]),
+				"queued": len(self._tasks),
+				"queued_by_tag": dict(self._tag_counts),
+				"running": self.running,
+				"done": self.done,
+				"failed": self.failed,
+				"avg_wait_time": round(self.wait_time / self.done, 3) \
+					if self.done else 0,
+				"max_wait_time": round(self.max_wait_time, 3),
+				"avg_run_time": round(self.run_time / self.done, 3) \
+					if self.done else 0,
+				"max_run_time": round(self.max_run_time, 3)
+			}
+	
+	def _untag(self, task):
+		if task.tag is not None:
+			self._tag_counts[task.tag] -= 1
+			if not self._tag_counts[task.tag]:
+				del self._tag_counts[task.tag]
+	
+	def _account(self, task):
+		with self._cond:
+			self.running -= 1
+			self.done += 1
+			if task.future.exception():
+				self.failed += 1
+			self.wait_time += task.wait_time
+			self.max_wait_time = max(self.max_wait_time, task.wait_time)
+			self.run_time += task.run_time
+			self.max_run_time = max(self.max_run_time, task.run_time)
 
 class WorkerTask():
 	def __init__(self, thread, func, sync=False,
@@ -706,15 +1018,23 @@ class WorkerTask():
 		self.timeout = timeout
 		
 		self.invoked = False
-		self.result = None
-		self.err = None
-		
-		self.lock = None
-		if self.sync:
-			self.lock = threading.Lock()
-			self.lock.acquire()
+		self.future = Future()
+		self.queued_at = self.started_at = self.finished_at = None
+	
+	@property
+	def wait_time(self):
+		"Seconds the task was queued for"
+		return self.started_at - self.queued_at if self.started_at else 0
+	
+	@property
+	def run_time(self):
+		return self.finished_at - self.started_at if self.finished_at else 0
 	
 	def run(self, *args, **kwargs):
+		"""
+		Queues the task, returns its result in sync mode (raising its error),
+		otherwise its Future
+		"""
 		if self.invoked:
 			raise RuntimeError("Worker task can be invoked only once")
 		self.invoked = True
@@ -730,8 +1050,9 @@ class TrackedPlayer():
 		if not "chats" in self.state:
 			self.state["chats"] = {}
 		
-		self.timeline = StoredTimeline(TIMELINE_DIR / f"{self.uid}.txt")
+		self.timeline = open_stored_timeline(self.uid)
 		self.read_timeline()
+		self._stat_fingerprint = None # (timeline, fingerprint) of last update
 	
 	def read_timeline(self):
 		self.name = self.get_stat("name") or "???"
@@ -782,10 +1103,10 @@ class TrackedPlayer():
 		legend = resmgr.trans(f"{self.legend}_v_mis", self.legend)
 		
 		state_duration = None
-		for entry in self.timeline.iter(reverse=True):
-			if entry.stat_name in ["is_in_match", "is_online"]:
-				state_duration = time.time() - entry.timestamp
-				break
+		for entry in self.timeline.iter(reverse=True,
+				keys=[("_", "is_in_match"), ("_", "is_online")]):
+			state_duration = time.time() - entry.timestamp
+			break
 		
 		result = f"{state} на {legend}"
 		if state_duration:
@@ -794,6 +1115,23 @@ class TrackedPlayer():
 			result += f" (👨‍👦‍👦 фул паті)"
 		return result
 	
+	def get_poll_interval(self, now):
+		"Seconds until the next stat poll, the less active the player the more"
+		if not self.state["chats"]:
+			return POLL_INTERVAL_NO_CHATS
+		if self.is_banned:
+			return POLL_INTERVAL_BANNED
+		if self.is_online:
+			return POLL_INTERVAL_IN_MATCH if self.is_in_match else \
+				POLL_INTERVAL_IN_LOBBY
+		
+		offline_duration = now - (self.get_last_online(now) or 0)
+		if offline_duration < SESS_MAX_BREAK:
+			return POLL_INTERVAL_RECENTLY_OFFLINE
+		if offline_duration < POLL_LONG_OFFLINE_AFTER:
+			return POLL_INTERVAL_OFFLINE
+		return POLL_INTERVAL_LONG_OFFLINE
+	
 	def gen_new_moniker(self):
 		self.moniker = resmgr.get_moniker()
 		moniker_entry = TimelineEntry(
@@ -805,8 +1143,15 @@ class TrackedPlayer():
 		
 		self.handle_goodnights()
 		
-		diff = self.timeline.consume_als_stat(stat)
-		self.read_timeline()
+		# unchanged response of the same timeline can't make any diff,
+		# timeline is compared by identity, as it's reopened on conversions
+		stat_fingerprint = (self.timeline, get_als_stat_fingerprint(stat))
+		if stat_fingerprint == self._stat_fingerprint:
+			diff = {}
+		else:
+			diff = self.timeline.consume_als_stat(stat)
+			self.read_timeline()
+			self._stat_fingerprint = stat_fingerprint
 		
 		upd_resp["went_online"] = upd_resp["went_offline"] = False
 		if diff.get(("_", "is_online")) and diff[("_", "is_online")][0]:
@@ -943,33 +1288,10 @@ class TrackedPlayer():
 			self.notify_chat(chat_id, msg, as_html, **kwargs)
 	
 	def get_last_online(self, before_moment):
-		for entry in self.timeline.iter(reverse=True):
-			if entry.timestamp > before_moment:
-				continue
-			if entry.stat_name == "is_online" and entry.stat_value == "0":
-				return entry.timestamp
+		return self.timeline.get_last_online(before_moment)
 	
 	def get_sess_start(self, before_moment):
-		sess_start = None
-		for entry in self.timeline.iter(reverse=True):
-			if entry.timestamp > before_moment:
-				continue
-			
-			if sess_start == None:
-				# looking for went online event
-				if entry.stat_name == "is_online" and entry.stat_value == "1":
-					sess_start = entry.timestamp
-			else:
-				# looking for any event happened earlier
-				# than (sess_start - SESS_MAX_BREAK) or to reset
-				# sess_start if another went offline event found earlier
-				if entry.timestamp < (sess_start - SESS_MAX_BREAK):
-					break
-				elif entry.stat_name == "is_online" and \
-				entry.stat_value == "0":
-					sess_start = None
-		
-		return sess_start
+		return self.timeline.get_sess_start(before_moment)
 	
 	def add_to_chat(self, chat_id):
 		if str(chat_id) not in self.state["chats"]:
@@ -981,17 +1303,43 @@ class TrackedPlayer():
 
 class Timeline():
 	def __init__(self, start_stat=None):
-		self._entries = []
+		# entries are kept in a range of the columns, which may be shared
+		# with the parent timeline if this one is its view
+		self._columns = TimelineColumns()
+		self._lo = self._hi = 0
+		self._is_view = False
 		self.start_stat = start_stat or {}
+		self._tracker_keys = None # legend -> {non-null tracker stat name}
 		self.clear_cache()
 	
 	def clear_cache(self):
 		self._cache = {}
 	
 	def add_entry(self, entry):
-		self._entries.append(entry)
+		self.add_entries([entry])
+	
+	def add_entries(self, entries):
+		"Adds a batch of entries, stored timelines write it at once"
+		if self._is_view: # copy on write
+			self._columns = self._columns.copy(self._lo, self._hi)
+			self._lo, self._hi = 0, self._hi - self._lo
+			self._is_view = False
+		
+		for entry in entries: # may be a generator, so indexed in place
+			self._columns.append(entry)
+			if self._tracker_keys is not None:
+				self._index_tracker(entry.legend, entry.stat_name,
+					entry.stat_value)
+		self._hi = len(self._columns.timestamps)
 		self.clear_cache()
 	
+	def get_view(self, timeline_cls, start_stat, lo, hi):
+		"Returns timeline of the columns range sharing them with this one"
+		view = timeline_cls(start_stat)
+		view._columns, view._lo, view._hi = self._columns, lo, hi
+		view._is_view = True
+		return view
+	
 	def add_timestamp(self, ts):
 		for entry in ts.data.values():
 			self.add_entry(entry)
@@ -999,59 +1347,95 @@ class Timeline():
 	def get_end_stat(self):
 		if self._cache.get("end_stat"):
 			return self._cache["end_stat"]
-		self._cache["end_stat"] = self.start_stat.copy()
+		end_stat = self._cache["end_stat"] = self.start_stat.copy()
 		
-		for entry in self.iter():
-			key = (entry.legend, entry.stat_name)
-			self._cache["end_stat"][key] = entry.stat_value
+		key_ids, values = self._columns.key_ids, self._columns.values
+		for i in range(self._lo, self._hi):
+			end_stat[timeline_keys.keys[key_ids[i]]] = values[i]
 		
-		return self._cache["end_stat"]
+		return end_stat
+	
+	def get_tracker_keys(self, legend):
+		"""
+		Returns tracker stat names of the legend which are not null in the
+		end stat, kept up to date along with it once requested
+		"""
+		if self._tracker_keys is None:
+			self._tracker_keys = {}
+			for key, value in self.get_end_stat().items():
+				self._index_tracker(key[0], key[1], value)
+		return self._tracker_keys.get(legend, {})
+	
+	def _index_trackers(self, entries):
+		if self._tracker_keys is None:
+			return
+		for entry in entries:
+			self._index_tracker(entry.legend, entry.stat_name, entry.stat_value)
+	
+	def _index_tracker(self, legend, stat_name, value):
+		if not str(stat_name).startswith("tracker_"):
+			return
+		# dicts keep the stat names in the order they were met
+		legend_keys = self._tracker_keys.setdefault(str(legend), {})
+		if str(value) == "$null":
+			legend_keys.pop(str(stat_name), None)
+		else:
+			legend_keys[str(stat_name)] = None
 	
 	def get_diff(self):
-		if self._cache.get("diff"):
-			return self._cache["diff"]
-		diff = self._cache["diff"] = {}
-		
-		for key in self.start_stat:
-			if self.start_stat[key] == "$null":
-				continue
-			diff[key] = (self.start_stat[key], self.start_stat[key])
-		
-		for entry in self.iter():
-			key = (entry.legend, entry.stat_name)
-			
-			if not diff.get(key):
-				diff[key] = (entry.stat_value, entry.stat_value)
-				continue
-			
-			if entry.isnull:
-				continue
-			
-			diff[key] = (diff[key][0], entry.stat_value)
-		
-		# filtering out equal start-end values
-		keys_to_remove = [k for k, v in diff.items() if v[0] == v[1]]
-		for key in keys_to_remove:
-			diff.pop(key)
-		
-		return diff
+		if self._cache.get("diff") is None:
+			self._cache["diff"] = dict(self.get_summary().get_diff())
+		return self._cache["diff"]
+	
+	def analyze(self):
+		"Returns SessionAnalyzer made in a single sweep over the timeline"
+		if self._cache.get("analysis") is None:
+			self._cache["analysis"] = SessionAnalyzer(self,
+				with_segments=not isinstance(self, ConstantStateTimeline))
+		return self._cache["analysis"]
+	
+	def get_summary(self):
+		"Segments get their summaries from the analysis of split timeline"
+		if self._cache.get("summary") is None:
+			self._cache["summary"] = self.analyze().summary
+		return self._cache["summary"]
 	
 	def get_states_duration(self):
 		durations = {"offline": 0, "inLobby": 0, "inFiringRange": 0,
 			"inMatch": 0}
 		
-		for seg in self.split_by_states():
+		for seg in self.analyze().segments:
 			durations[seg.get_state()] += seg.get_duration()
 		
 		return durations
 	
-	def iter(self, reverse=False):
-		iterable = self._entries
+	def iter(self, reverse=False, start=None, end=None, stat_names=None,
+			keys=None):
+		"keys filter is a list of (legend, stat_name) tuples"
+		key_table = timeline_keys.keys
+		allowed_ids = None # key filters are turned into key id sets
+		if keys is not None:
+			allowed_ids = {timeline_keys.ids.get(tuple(k)) for k in keys}
+		if stat_names:
+			names_ids = {i for i, (_, stat_name) in enumerate(key_table) if \
+				stat_name in stat_names}
+			allowed_ids = names_ids if allowed_ids is None else \
+				allowed_ids & names_ids
+		
+		timestamps = self._columns.timestamps
+		key_ids, values = self._columns.key_ids, self._columns.values
+		indices = range(self._lo, self._hi)
 		if reverse:
-			iterable = reversed(self._entries)
+			indices = reversed(indices)
 		
-		for entry in iterable:
-			yield entry
+		for i in indices:
+			timestamp = timestamps[i]
+			if start is not None and timestamp < start: continue
+			if end is not None and timestamp > end: continue
+			if allowed_ids is not None and key_ids[i] not in allowed_ids:
+				continue
+			legend, stat_name = key_table[key_ids[i]]
+			yield TimelineEntry(timestamp, legend, stat_name, values[i])
 	
 	def iter_timestamps(self, reverse=False):
 		cur_ts = None
@@ -1068,38 +1452,134 @@ class Timeline():
 		if cur_ts:
 			yield cur_ts
 	
+	def iter_timestamp_items(self):
+		"Yields (timestamp, [(key, value), ...]) for each timestamp"
+		key_table = timeline_keys.keys
+		timestamps = self._columns.timestamps
+		key_ids, values = self._columns.key_ids, self._columns.values
+		for lo, hi in self._iter_timestamp_ranges():
+			yield timestamps[lo], [(key_table[key_ids[i]], values[i]) \
+				for i in range(lo, hi)]
+	
+	def _iter_timestamp_ranges(self):
+		"Yields (lo, hi) columns range of each timestamp"
+		timestamps = self._columns.timestamps
+		lo = self._lo
+		for i in range(self._lo + 1, self._hi):
+			if timestamps[i] != timestamps[lo]:
+				yield lo, i
+				lo = i
+		if lo < self._hi:
+			yield lo, self._hi
+	
+	def _get_timestamp_stat(self, lo, hi):
+		ts = TimestampStat(self._columns.timestamps[lo])
+		for i in range(lo, hi):
+			legend, stat_name = timeline_keys.keys[self._columns.key_ids[i]]
+			ts.add_entry(TimelineEntry(self._columns.timestamps[i], legend,
+				stat_name, self._columns.values[i]))
+		return ts
+	
 	def get_stat(self, *args):
 		key = parse_timeline_key(*args)
 		return self.get_end_stat().get(key)
 	
+	def get_stat_at(self, moment):
+		"Returns stat as it was at the moment (including its entries)"
+		stat = self.start_stat.copy()
+		for entry in self.iter(end=moment):
+			stat[(entry.legend, entry.stat_name)] = entry.stat_value
+		return stat
+	
+	def get_stat_before(self, moment):
+		"Returns stat as it was right before the moment"
+		stat = self.start_stat.copy()
+		for entry in self.iter():
+			if entry.timestamp < moment:
+				stat[(entry.legend, entry.stat_name)] = entry.stat_value
+		return stat
+	
+	def get_last_online(self, before_moment):
+		for entry in self.iter(reverse=True, end=before_moment,
+				stat_names=("is_online",)):
+			if entry.stat_value == "0":
+				return entry.timestamp
+	
+	def get_sess_start(self, before_moment):
+		sess_start = None
+		for entry in self.iter(reverse=True, end=before_moment):
+			if sess_start == None:
+				# looking for went online event
+				if entry.stat_name == "is_online" and entry.stat_value == "1":
+					sess_start = entry.timestamp
+			else:
+				# looking for any event happened earlier
+				# than (sess_start - SESS_MAX_BREAK) or to reset
+				# sess_start if another went offline event found earlier
+				if entry.timestamp < (sess_start - SESS_MAX_BREAK):
+					break
+				elif entry.stat_name == "is_online" and \
+				entry.stat_value == "0":
+					sess_start = None
+		
+		return sess_start
+	
 	def get_sub_timeline(self, start, end):
+		"""
+		Returns a view of the columns. If timestamps ever decrease (e.g. after
+		clock skew) the entries are filtered instead, up to the first one
+		past the end
+		"""
+		if not self._columns.is_sorted:
+			return self._filter_sub_timeline(start, end)
+		
+		timestamps = self._columns.timestamps
+		lo = bisect_left(timestamps, start, self._lo, self._hi)
+		hi = bisect_right(timestamps, end, lo, self._hi)
+		if lo == hi:
+			return None
+		
 		start_stat = self.start_stat.copy()
-		sub_timeline = None
+		key_ids, values = self._columns.key_ids, self._columns.values
+		for i in range(self._lo, lo):
+			start_stat[timeline_keys.keys[key_ids[i]]] = values[i]
 		
+		return self.get_view(Timeline, start_stat, lo, hi)
+	
+	def _filter_sub_timeline(self, start, end):
+		start_stat = self.start_stat.copy()
+		entries = []
 		for entry in self.iter():
 			if entry.timestamp < start:
 				start_stat[(entry.legend, entry.stat_name)] = entry.stat_value
 			elif entry.timestamp > end:
 				break
 			else:
-				if not sub_timeline:
-					sub_timeline = Timeline(start_stat)
-				sub_timeline.add_entry(entry)
+				entries.append(entry)
 		
+		if not entries:
+			return None
+		sub_timeline = Timeline(start_stat)
+		sub_timeline.add_entries(entries)
 		return sub_timeline
 	
 	def consume_als_stat(self, player_stat):
 		timestamp = int(time.time())
 		diff_data = {}
+		new_entries = []
 		
+		# entries are collected and added in one batch in the end
 		def _add(stat_name, stat_value, legend="_"):
-			prev_value = self.get_stat(legend, stat_name)
+			if (legend, stat_name) in diff_data:
+				prev_value = diff_data[(legend, stat_name)][1]
+			else:
+				prev_value = self.get_stat(legend, stat_name)
 			new_value = str(stat_value)
 			if prev_value == new_value:
 				return False
 			
 			entry = TimelineEntry(timestamp, legend, stat_name, stat_value)
-			self.add_entry(entry)
+			new_entries.append(entry)
 			diff_data[(legend, stat_name)] = (prev_value, new_value)
 			
 			return True
@@ -1142,13 +1622,12 @@ class Timeline():
 		
 		# nullifying unavailable trackers (probably unequipped)
 		# $null is treated as a special value
-		for legend, stat_name in self.get_end_stat():
-			if legend != selected_legend: continue
-			if not stat_name.startswith("tracker_"): continue
-			if stat_name in legend_trackers: continue
-			
+		for stat_name in [s for s in self.get_tracker_keys(selected_legend) \
+				if s not in legend_trackers]:
 			_add(stat_name, "$null", selected_legend)
 		
+		if new_entries:
+			self.add_entries(new_entries)
 		return diff_data
 	
 	def get_start(self):
@@ -1180,7 +1659,8 @@ class Timeline():
 	
 	def format(self, easter_eggs=False):
 		diff = self.get_diff()
-		matches = [m for m in self.get_matches() if m.is_ended()]
+		matches = [m for m in self.analyze().segments if \
+			m.is_match and m.is_ended]
 		
 		text = ""
 		is_current = bool(int(self.get_stat("is_online")))
@@ -1226,7 +1706,7 @@ class Timeline():
 		# filling matches count to display
 		for match in matches:
 			if not match.is_real(): continue
-			legend = match.get_legend()
+			legend = match.legend
 			if not legend:
 				continue
 			if not legends.get(legend):
@@ -1266,32 +1746,26 @@ class Timeline():
 		return text.strip()
 	
 	def split_by_states(self):
-		if self._cache.get("state_segs") != None:
+		"Makes views of the state segments found by the analyzer sweep"
+		if self._cache.get("state_segs") is not None:
 			return self._cache["state_segs"]
-		segs = self._cache["state_segs"] = []
-		sweep_stat = self.start_stat.copy()
-		
-		def _append_seg(is_match):
-			seg_cls = MatchTimeline if is_match else ConstantStateTimeline
-			segs.append(seg_cls(sweep_stat.copy()))
+		analysis = self.analyze()
+		if isinstance(self, ConstantStateTimeline): # not split by analyze
+			analysis = SessionAnalyzer(self)
 		
-		_append_seg(sweep_stat.get(("_", "is_in_match")) == "1")
-		
-		for ts in self.iter_timestamps():
-			segs[-1].add_timestamp(ts)
-			
-			if ts.get_value("level"):
-				if isinstance(segs[-1], MatchTimeline):
-					segs[-1].result_stamp = ts
-				if len(segs) > 1 and isinstance(segs[-2], MatchTimeline):
-					segs[-2].result_stamp = ts
-			
-			if ts.get_value("is_online") or ts.get_value("is_in_match"):
-				_append_seg(ts.get_value("is_in_match") == "1")
-				segs[-1].add_timestamp(ts)
-			
-			for key, entry in ts.data.items():
-				sweep_stat[key] = entry.stat_value
+		# the timestamp of state change belongs to both adjacent segments
+		segs = self._cache["state_segs"] = []
+		for summary in analysis.segments:
+			seg_cls = MatchTimeline if summary.is_match else \
+				ConstantStateTimeline
+			seg = self.get_view(seg_cls, summary.start_stat,
+				self._lo + summary.lo, self._lo + summary.hi)
+			seg._cache["summary"] = summary
+			if summary.result_range:
+				lo, hi = summary.result_range
+				seg.result_stamp = self._get_timestamp_stat(self._lo + lo,
+					self._lo + hi)
+			segs.append(seg)
 		
 		return segs
 	
@@ -1310,13 +1784,7 @@ class ConstantStateTimeline(Timeline):
 		super().__init__(*args, **kwargs)
 	
 	def get_state(self):
-		sweep_stat = self.start_stat.copy()
-		for ts in self.iter_timestamps():
-			if ts.get_value("is_in_match") == "1":
-				return "inMatch"
-			if ts.get_value("is_online") == "0":
-				return "offline"
-			return "inLobby"
+		return self.get_summary().get_state()
 	
 	def format(self):
 		state = resmgr.trans(self.get_state())
@@ -1325,14 +1793,7 @@ class ConstantStateTimeline(Timeline):
 		return f"{state} на {legend} ({duration})"
 	
 	def get_legend(self):
-		legend = self.start_stat.get(("_", "legend"))
-		for ts in self.iter_timestamps():
-			if ts.timestamp == self.get_end():
-				break
-				# legend change at the state end belongs to the next state
-			legend = ts.get_value("legend") or legend
-		
-		return legend
+		return self.get_summary().legend
 
 class MatchTimeline(ConstantStateTimeline):
 	def __init__(self, *args, **kwargs):
@@ -1367,23 +1828,8 @@ class MatchTimeline(ConstantStateTimeline):
 		
 		return diff
 	
-	def get_legend(self):
-		legend = self.start_stat.get(("_", "legend"))
-		for ts in self.iter_timestamps():
-			if ts.timestamp == self.get_end():
-				break # do not count legend change at the match end
-			legend = ts.get_value("legend") or legend
-		
-		return legend
-	
 	def is_ended(self):
-		for entry in self.iter():
-			if entry.stat_name == "is_in_match" and \
-			entry.stat_value == "0":
-				return True
-			if entry.stat_name == "is_online":
-				return True
-		return False
+		return self.get_summary().is_ended
 	
 	def get_type(self):
 		if not self.is_real():
@@ -1422,8 +1868,9 @@ class MatchTimeline(ConstantStateTimeline):
 		
 		text += _format_rank_diff("br", "Ранг в БР") or ""
 		
+		match_legend = self.get_legend()
 		for legend, stat_name in diff:
-			if legend not in [self.get_legend(), "_"] or \
+			if legend not in [match_legend, "_"] or \
 			not stat_name.startswith("tracker_"):
 				continue
 			
@@ -1438,51 +1885,1639 @@ class MatchTimeline(ConstantStateTimeline):
 		
 		return text.strip()
 
-class StoredTimeline(Timeline):
-	def __init__(self, path, **kwargs):
-		kwargs["start_stat"] = {}
+class TimelineBackend(Timeline):
+	"""
+	Base of the persistent timelines, which are to implement:
+	  add_entries(entries) - appending the batch at once, calling
+	    _load_rollups before and rollups.add_entries after the write
+	  iter(reverse, start, end, stat_names, keys) - range and reverse reads
+	  get_end_stat(), get_stat_at(moment), get_stat_before(moment)
+	Sub-timelines, state splits and rollups are built on top of those
+	"""
+	def __init__(self, rollups_path=None, **kwargs):
 		super().__init__(**kwargs)
-		self.path = Path(path)
+		self.rollups = RollupTable(rollups_path)
+		self._rollups_loaded = False
 	
-	def add_entry(self, entry):
-		self.clear_cache()
+	def get_sub_timeline(self, start, end):
+		sub_timeline = None
+		for entry in self.iter(start=start, end=end):
+			if not sub_timeline:
+				sub_timeline = Timeline(self.get_stat_before(start))
+			sub_timeline.add_entry(entry)
 		
-		with self.path.open("ab") as fh:
-			fh.write(entry.serialize().encode("utf-8") + b"\n")
+		return sub_timeline
 	
-	def iter(self, reverse=False):
-		if not self.path.exists():
+	def iter_timestamp_items(self):
+		timestamp, items = None, []
+		for entry in self.iter():
+			if items and entry.timestamp != timestamp:
+				yield timestamp, items
+				items = []
+			timestamp = entry.timestamp
+			items.append(((entry.legend, entry.stat_name), entry.stat_value))
+		
+		if items:
+			yield timestamp, items
+	
+	def split_by_states(self):
+		"Splits in-memory copy, as the segments are views of its columns"
+		if self._cache.get("state_segs") is None:
+			timeline = Timeline(self.start_stat.copy())
+			timeline.add_entries(self.iter())
+			self._cache["state_segs"] = timeline.split_by_states()
+		return self._cache["state_segs"]
+	
+	def _load_rollups(self):
+		"""
+		Rollups are caught up with the timeline entries newer than their
+		saved state, and rebuilt if that state is ahead of the timeline
+		"""
+		if self._rollups_loaded:
 			return
 		
-		if reverse:
-			iterable = util.reverse_readline(self.path)
-		else:
-			iterable = self.path.open("r", encoding="utf-8")
+		is_loaded = self.rollups.load()
+		last_entry = next(self.iter(reverse=True), None)
+		if is_loaded and (not last_entry or \
+		self.rollups.last_timestamp > last_entry.timestamp):
+			log(f"Rebuilding outdated {self.rollups.path.name} rollups")
+			is_loaded = False
 		
-		try:
-			for line in iterable:
-				try:
-					entry = TimelineEntry.parse(line)
-				except TimelineEntryError:
-					if line.strip(): # do not report empty lines
-						log(f"Skipping invalid entry in"
-							f" {self.path.name} timeline: '{line}'\n"
-							f"Traceback:\n{get_err()}")
-					continue
-				
-				yield entry
-		finally:
-			if getattr(iterable, "close"):
-				iterable.close()
+		if is_loaded: # entries of the held timestamp are added again
+			self.rollups.add_entries(
+				self.iter(start=self.rollups.last_timestamp))
+		else:
+			self.rollups.reset()
+			self.rollups.add_entries(self.iter())
+		self.rollups.flush()
+		self._rollups_loaded = True
+	
+	def rebuild_rollups(self):
+		self._rollups_loaded = False
+		if self.rollups.path:
+			self.rollups.path.unlink(missing_ok=True)
+		self._load_rollups()
+	
+	def get_rollups(self, period="hour", start=None, end=None):
+		"Returns [(bucket start, row)] of RollupTable, see its docs"
+		self._load_rollups()
+		return self.rollups.get_rows(period, start, end)
+	
+	def get_rollup_summary(self, start, end):
+		self._load_rollups()
+		return self.rollups.get_summary(start, end)
+	
+	def close(self):
+		"Releases handles, required before the files are moved or removed"
+		pass
 
-class TimestampStat():
-	def __init__(self, timestamp):
-		self.timestamp = int(timestamp)
-		self.data = {}
+class StoredTimeline(TimelineBackend):
+	def __init__(self, path, **kwargs):
+		kwargs["start_stat"] = {}
+		super().__init__(rollups_path=f"{path}.rollups", **kwargs)
+		self.path = Path(path)
+		self.snapshot_path = Path(f"{self.path}.snapshot.json")
+		
+		# end stat is maintained in place on every append, so it is not a part
+		# of the regular cache. _end_offset is the timeline size it reflects
+		self._end_stat = None
+		self._end_offset = 0
+		self._snapshot_offset = 0
+		
+		self.index = TimelineIndex(f"{self.path}.idx")
+		self._index_end = None # timeline size covered by the index
+		self._last_timestamp = None
+		
+		# self.path is the active segment, closed ones are in the archive
+		self.archive = TimelineArchive(self.path.with_suffix(".segments"))
+		
+		self.sessions = SessionIndex(f"{self.path}.sessions")
+		self._sessions_loaded = False
 	
 	def add_entry(self, entry):
-		if not entry.timestamp == self.timestamp:
-			raise ValueError
+		self.add_entries([entry])
+	
+	def close(self):
+		filepool.singleton.close(self.path)
+	
+	def add_entries(self, entries):
+		"Entries of the same timestamp are written with a single write"
+		self.clear_cache()
+		self._load_index()
+		
+		batch = []
+		for entry in entries:
+			if batch and entry.timestamp != batch[0].timestamp:
+				self._add_batch(batch)
+				batch = []
+			batch.append(entry)
+		if batch:
+			self._add_batch(batch)
+	
+	def _add_batch(self, entries):
+		if self._is_rotation_due(entries[0]):
+			self.rotate()
+		elif self._is_checkpoint_due(entries[0]):
+			self.write_checkpoint()
+		
+		online_entries = [e for e in entries if e.legend == "_" and \
+			e.stat_name == "is_online"]
+		if online_entries:
+			self._load_sessions() # validated against the stat before write
+		self._load_rollups()
+		
+		offset = batch_offset = self._index_end
+		end_offset = self._write_entries(entries)
+		for entry in entries: # only batch start can be read from directly
+			self._index_entry(offset, entry)
+			offset = None
+		if [e for e in entries if e.stat_name in self.index.posted_stats]:
+			for entry_offset, entry in zip(
+					self._get_entry_offsets(batch_offset, entries), entries):
+				self._post_entry(entry_offset, entry)
+		self._index_end = end_offset
+		self.index.flush()
+		
+		for entry in online_entries:
+			self.sessions.add(entry.timestamp, entry.stat_value)
+		self.sessions.flush()
+		self.rollups.add_entries(entries)
+		self.rollups.flush()
+		
+		if self._end_stat is None:
+			return # will be read from the file on demand
+		
+		# values are kept the same way they are read back from the file
+		for entry in entries:
+			key = (str(entry.legend), str(entry.stat_name))
+			self._end_stat[key] = str(entry.stat_value)
+		self._index_trackers(entries)
+		self._end_offset = end_offset
+		if end_offset - self._snapshot_offset >= TIMELINE_SNAPSHOT_INTERVAL:
+			self.save_snapshot()
+	
+	def get_end_stat(self):
+		if self._end_stat is None:
+			self._load_end_stat()
+		return self._end_stat
+	
+	def _load_end_stat(self):
+		"""
+		Restores end stat from the snapshot and replays only the entries
+		appended after it. Falls back to the full scan if snapshot is missing
+		or doesn't match the timeline file
+		"""
+		end_stat, offset = self._read_snapshot() or (None, 0)
+		self._snapshot_offset = offset
+		if end_stat is None:
+			# active segment normally starts with a checkpoint anyway
+			end_stat = self._get_archived_stat_until(None, inclusive=True)
+		
+		for record in self._iter_entries(offset=offset, with_checkpoints=True):
+			if isinstance(record, TimelineCheckpoint):
+				end_stat = record.stat.copy()
+			else:
+				end_stat[(record.legend, record.stat_name)] = record.stat_value
+		self._end_offset = self.path.stat().st_size if self.path.exists() else 0
+		
+		self._end_stat = end_stat
+		if self._end_offset - offset >= TIMELINE_SNAPSHOT_INTERVAL:
+			self.save_snapshot()
+	
+	def _read_snapshot(self):
+		if not self.snapshot_path.exists():
+			return None
+		
+		try:
+			snapshot = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+			offset = snapshot["offset"]
+			end_stat = {(l, n): v for l, n, v in snapshot["stat"]}
+		except (ValueError, KeyError, TypeError):
+			log(f"Ignoring broken {self.snapshot_path.name} snapshot:\n"
+				f"{get_err()}", err=True)
+			return None
+		
+		# snapshot is only valid if it ends exactly on the entry boundary
+		# of the current timeline file
+		if offset:
+			if not self.path.exists() or self.path.stat().st_size < offset:
+				return None
+			if not self._is_entry_boundary(offset):
+				return None
+		
+		return (end_stat, offset)
+	
+	def save_snapshot(self):
+		if self._end_stat is None:
+			return
+		
+		snapshot = {
+			"offset": self._end_offset,
+			"stat": [[*key, value] for key, value in self._end_stat.items()]
+		}
+		tmp_path = self.snapshot_path.with_suffix(".tmp")
+		tmp_path.write_text(json.dumps(snapshot), encoding="utf-8")
+		tmp_path.replace(self.snapshot_path)
+		self._snapshot_offset = self._end_offset
+	
+	def iter(self, reverse=False, start=None, end=None, stat_names=None,
+			keys=None):
+		"""
+		Reads archived segments overlapping the time range and the active one.
+		Segments are only opened when iteration gets to them, and the active
+		one is read right from the requested time range using the index.
+		stat_names filtering skips other lines before parsing them, keys of
+		the posted stats are read from their postings in the index only
+		"""
+		if keys is not None: # only keys of stat_names are read
+			keys = {(str(legend), str(stat_name)) for legend, stat_name in \
+				keys if not stat_names or stat_name in stat_names}
+			stat_names = {stat_name for _, stat_name in keys}
+		# ranges are found by timestamps, unordered timeline is filtered
+		is_ordered = self.is_ordered()
+		
+		def _active():
+			if keys is not None and is_ordered and \
+			not stat_names - set(self.index.posted_stats):
+				yield from self._iter_postings(keys, reverse, start, end)
+				return
+			
+			offset = None
+			if is_ordered and (start if not reverse else end) is not None:
+				if reverse:
+					offset = self.index.find_end_offset(end)
+				else:
+					offset = self.index.find_start_offset(start)
+			yield from self._iter_entries(reverse=reverse, offset=offset,
+				stat_names=stat_names)
+		
+		segments = self.archive.get_segments(start, end) if is_ordered \
+			else self.archive.get_segments()
+		sources = [self.archive.iter_segment(segment, reverse=reverse,
+			stat_names=stat_names) for segment in segments] + [_active()]
+		if reverse:
+			sources.reverse()
+		
+		for source in sources:
+			for entry in source:
+				if keys is not None and \
+				(entry.legend, entry.stat_name) not in keys: continue
+				if start is not None and entry.timestamp < start:
+					if reverse and is_ordered: return
+					continue
+				if end is not None and entry.timestamp > end:
+					if not reverse and is_ordered: return
+					continue
+				yield entry
+	
+	def is_ordered(self):
+		"Whether timestamps never decrease, which range reads rely on"
+		self._load_index()
+		return self.index.is_ordered and \
+			all(s.get("ordered", True) for s in self.archive.get_segments())
+	
+	def get_stat_at(self, moment):
+		return self._get_stat_until(moment, inclusive=True)
+	
+	def get_stat_before(self, moment):
+		return self._get_stat_until(moment, inclusive=False)
+	
+	def _get_stat_until(self, moment, inclusive):
+		"""
+		Replays entries after the nearest checkpoint preceding the moment.
+		Without such a checkpoint the stat is built backwards from the end stat
+		"""
+		if not self.is_ordered():
+			if inclusive:
+				return super().get_stat_at(moment)
+			return super().get_stat_before(moment)
+		
+		offset = self.index.find_checkpoint_offset(moment, inclusive)
+		if offset is None and self.archive.get_segments():
+			return self._get_archived_stat_until(moment, inclusive)
+		if offset is None:
+			return self._get_stat_backwards(moment, inclusive)
+		
+		records = self._iter_entries(offset=offset, with_checkpoints=True)
+		return self._replay(records, {}, moment, inclusive)
+	
+	def _iter_postings(self, keys, reverse=False, start=None, end=None):
+		"""
+		Jumps straight to the entries of the keys using their postings. The
+		tail not covered by the index (appended by someone else) is read as
+		usual, so the result is complete anyway
+		"""
+		start_offset = end_offset = None
+		if start is not None:
+			start_offset = self.index.find_start_offset(start)
+		if end is not None:
+			end_offset = self.index.find_end_offset(end)
+		offsets = self.index.find_postings(keys, start_offset, end_offset)
+		
+		tail = []
+		size = self.path.stat().st_size if self.path.exists() else 0
+		if end_offset is None and size > self._index_end:
+			tail = [e for e in self._iter_entries(offset=self._index_end,
+				stat_names={stat_name for _, stat_name in keys})]
+		
+		if reverse:
+			offsets.reverse()
+			tail.reverse()
+			yield from tail
+		yield from self._read_entries_at(offsets, reverse)
+		if not reverse:
+			yield from tail
+	
+	def get_last_online(self, before_moment):
+		if not self.is_ordered():
+			return super().get_last_online(before_moment)
+		self._load_sessions()
+		return self.sessions.get_last_online(before_moment)
+	
+	def get_sess_start(self, before_moment):
+		if not self.is_ordered():
+			return super().get_sess_start(before_moment)
+		self._load_sessions()
+		return self.sessions.get_sess_start(before_moment)
+	
+	def _load_sessions(self):
+		"""
+		Session index is only trusted if its last transition matches current
+		is_online value, otherwise it's rebuilt from the timeline
+		"""
+		if self._sessions_loaded:
+			return
+		
+		is_online = self.get_end_stat().get(("_", "is_online"))
+		is_loaded = self.sessions.load()
+		if not is_loaded or self.sessions.last_value != is_online:
+			if is_loaded:
+				log(f"Rebuilding outdated {self.sessions.path.name} index")
+			self.sessions.reset()
+			for entry in self.iter(stat_names=("is_online",)):
+				if entry.legend == "_":
+					self.sessions.add(entry.timestamp, entry.stat_value)
+			self.sessions.flush()
+		self._sessions_loaded = True
+	
+	def _get_archived_stat_until(self, moment, inclusive):
+		"""
+		Replays the latest archived segment started before the moment (or the
+		last one if moment is None). Every segment but the first one starts
+		with a checkpoint, so there is no need to look any further back
+		"""
+		segments = [s for s in self.archive.get_segments() if moment is None \
+			or s["start"] < moment or (inclusive and s["start"] == moment)]
+		if not segments:
+			return {}
+		
+		records = self.archive.iter_segment(segments[-1], with_checkpoints=True)
+		return self._replay(records, {}, moment, inclusive)
+	
+	def _replay(self, records, stat, moment, inclusive):
+		for record in records:
+			if isinstance(record, TimelineCheckpoint):
+				stat = record.stat.copy()
+				continue
+			if moment is not None and (record.timestamp > moment or \
+			(not inclusive and record.timestamp == moment)):
+				break
+			stat[(record.legend, record.stat_name)] = record.stat_value
+		
+		return stat
+	
+	def _get_stat_backwards(self, moment, inclusive):
+		"""
+		Reads entries since the moment and the latest previous values of the
+		stats changed since then, reverting them in the stat of the first
+		checkpoint after the moment (or the end stat without checkpoints).
+		As there is no checkpoint before the moment, the walk never goes
+		further back than the first checkpoint
+		"""
+		stat, offset = self.get_end_stat(), None
+		if self.index.checkpoint_offsets:
+			offset = self.index.checkpoint_offsets[0]
+			records = self._iter_entries(offset=offset, with_checkpoints=True)
+			stat = next(records).stat
+			records.close()
+		stat = stat.copy()
+		changed = set()
+		
+		for entry in self._iter_entries(reverse=True, offset=offset):
+			key = (entry.legend, entry.stat_name)
+			if entry.timestamp > moment or \
+			(not inclusive and entry.timestamp == moment):
+				changed.add(key)
+			elif key in changed:
+				stat[key] = entry.stat_value
+				changed.remove(key)
+				if not changed:
+					break
+		
+		for key in changed: # stats which did not exist before the moment
+			stat.pop(key)
+		return stat
+	
+	def _load_index(self):
+		"""
+		Loads the index and brings it up to date with the timeline file,
+		rebuilding it if it doesn't match the file
+		"""
+		if self._index_end is not None:
+			return
+		
+		size = self.path.stat().st_size if self.path.exists() else 0
+		is_loaded = self.index.load()
+		if is_loaded and self.index.posted_stats != TIMELINE_POSTINGS_STATS:
+			log(f"Rebuilding {self.index.path.name} index for new postings")
+			self.index.reset()
+		elif is_loaded and self.index.offsets:
+			last_offset = self.index.offsets[-1]
+			if last_offset > size or not self._is_entry_boundary(last_offset):
+				log(f"Rebuilding outdated {self.index.path.name} index")
+				self.index.reset()
+		
+		offset, self._last_timestamp = 0, None
+		if self.index.offsets:
+			offset = self.index.offsets[-1]
+			self._last_timestamp = self.index.timestamps[-1]
+		
+		block_offset = offset
+		for record_offset, record in self._iter_entries(offset=offset,
+				with_offsets=True, with_checkpoints=True):
+			if record_offset is not None:
+				block_offset = record_offset
+			if not isinstance(record, TimelineCheckpoint):
+				self._index_entry(record_offset, record)
+				self._post_entry(block_offset, record)
+			elif not self.index.checkpoint_offsets or \
+			record_offset > self.index.checkpoint_offsets[-1]:
+				self.index.add_checkpoint(record.timestamp, record_offset)
+		
+		self._index_end = size
+		self.index.flush()
+	
+	def _is_checkpoint_due(self, entry):
+		# checkpoints are written between timestamps, not inside of them
+		if self._last_timestamp is None or \
+		entry.timestamp <= self._last_timestamp:
+			return False
+		
+		last_offset = 0
+		if self.index.checkpoint_offsets:
+			last_offset = self.index.checkpoint_offsets[-1]
+		return self._index_end - last_offset >= TIMELINE_CHECKPOINT_INTERVAL
+	
+	def _is_rotation_due(self, entry):
+		if not TIMELINE_SEGMENT_PERIOD or not self.index.timestamps:
+			return False
+		if entry.timestamp <= self._last_timestamp:
+			return False
+		
+		seg_start = self.index.timestamps[0] # first entry of the segment
+		return get_segment_period(entry.timestamp) != \
+			get_segment_period(seg_start)
+	
+	def rotate(self):
+		"""
+		Moves the active segment into the archive and starts a new one with
+		a checkpoint of the current stat
+		"""
+		self._load_index()
+		if not self.index.timestamps:
+			return
+		
+		self.get_end_stat()
+		filepool.singleton.close(self.path)
+		self.archive.add(self.path, self.index.timestamps[0],
+			self._last_timestamp, self.index.is_ordered)
+		log(f"Archived {self.path.name} timeline segment")
+		
+		self.index.reset()
+		self._index_end = 0
+		self._reset_file()
+		self.write_checkpoint()
+		self.save_snapshot()
+	
+	def write_checkpoint(self):
+		"Writes full end stat into the timeline for time travel reads"
+		self._load_index()
+		checkpoint = TimelineCheckpoint(self._last_timestamp or 0,
+			self.get_end_stat())
+		
+		offset = self._index_end
+		self._index_end = self._write_checkpoint(checkpoint)
+		self.index.add_checkpoint(checkpoint.timestamp, offset)
+		self.index.flush()
+		
+		if self._end_stat is not None:
+			self._end_offset = self._index_end
+	
+	def _index_entry(self, offset, entry):
+		# index points are only placed where a new timestamp starts, so that
+		# everything before the point is guaranteed to be older
+		is_new_ts = self._last_timestamp is None or \
+			entry.timestamp > self._last_timestamp
+		if not is_new_ts and entry.timestamp < self._last_timestamp:
+			self.index.set_unordered()
+		self._last_timestamp = entry.timestamp
+		
+		if offset is None or not is_new_ts:
+			return
+		if self.index.offsets and \
+		offset - self.index.offsets[-1] < TIMELINE_INDEX_STEP:
+			return
+		self.index.add(entry.timestamp, offset)
+	
+	def _post_entry(self, offset, entry):
+		if entry.stat_name in self.index.posted_stats:
+			self.index.add_posting(entry.legend, entry.stat_name, offset)
+	
+	def _get_entry_offsets(self, offset, entries):
+		"Offsets of the entries written by _write_entries at the offset"
+		offsets = []
+		for entry in entries:
+			offsets.append(offset)
+			offset += len(entry.serialize().encode("utf-8")) + 1
+		return offsets
+	
+	def _read_entries_at(self, offsets, reverse=False):
+		with self.path.open("rb") as fh:
+			for offset in offsets:
+				fh.seek(offset)
+				entry = self._parse_line(fh.readline())
+				if entry:
+					yield entry
+	
+	def _write_entries(self, entries):
+		"Appends entries to the file, returns file size after writing"
+		data = b"".join(
+			[e.serialize().encode("utf-8") + b"\n" for e in entries])
+		return filepool.singleton.append(self.path, data)
+	
+	def _write_checkpoint(self, checkpoint):
+		return self._write_entries([checkpoint])
+	
+	def _reset_file(self):
+		"Called after the active segment file is moved away"
+		pass
+	
+	def _iter_entries(self, reverse=False, offset=None, with_offsets=False,
+			with_checkpoints=False, stat_names=None):
+		"""
+		Reads entries starting from the offset, or ending at it if reversed.
+		with_offsets yields (offset, entry) pairs for forward reading, where
+		offset is None for entries which can't be read from directly.
+		with_checkpoints also yields TimelineCheckpoint records
+		"""
+		if not self.path.exists():
+			return
+		
+		if reverse:
+			yield from iter_text_lines_reverse(self.path, self.path.name,
+				size=offset, stat_names=stat_names)
+			return
+		
+		with self.path.open("rb") as fh:
+			fh.seek(offset or 0)
+			if not with_offsets:
+				for record in iter_text_chunks(fh, self.path.name,
+						with_checkpoints):
+					if not (stat_names and \
+					(isinstance(record, TimelineCheckpoint) or \
+					record.stat_name not in stat_names)):
+						yield record
+				return
+			
+			line_offset = offset or 0
+			for line in fh:
+				record = self._parse_line(line, with_checkpoints)
+				if record and not (stat_names and \
+				(isinstance(record, TimelineCheckpoint) or \
+				record.stat_name not in stat_names)):
+					yield (line_offset, record) if with_offsets else record
+				line_offset += len(line)
+	
+	def _parse_line(self, line, with_checkpoints=False):
+		return parse_timeline_line(line, self.path.name, with_checkpoints)
+	
+	def _is_entry_boundary(self, offset):
+		if offset == 0:
+			return True
+		with self.path.open("rb") as fh:
+			fh.seek(offset - 1)
+			return fh.read(1) == b"\n"
+
+class BinaryStoredTimeline(StoredTimeline):
+	"StoredTimeline kept in the compact binary format (see binarytimeline)"
+	def __init__(self, path, **kwargs):
+		super().__init__(path, **kwargs)
+		self.file = binarytimeline.BinaryTimelineFile(self.path)
+	
+	def _write_entries(self, entries):
+		return self.file.append([(e.timestamp, e.legend, e.stat_name,
+			e.stat_value) for e in entries])
+	
+	def _write_checkpoint(self, checkpoint):
+		return self.file.append_checkpoint(checkpoint.timestamp,
+			checkpoint.stat)
+	
+	def _reset_file(self):
+		self.file = binarytimeline.BinaryTimelineFile(self.path)
+	
+	def _get_entry_offsets(self, offset, entries):
+		# entries are located by the start of their block
+		return [offset] * len(entries)
+	
+	def _read_entries_at(self, offsets, reverse=False):
+		for record in self.file.iter_at(offsets, reverse=reverse):
+			yield from_binary_record(record)
+	
+	def _iter_entries(self, reverse=False, offset=None, with_offsets=False,
+			with_checkpoints=False, stat_names=None):
+		for record_offset, record in self.file.iter(reverse=reverse,
+				offset=offset, with_offsets=True,
+				with_checkpoints=with_checkpoints):
+			record = from_binary_record(record)
+			if stat_names and (isinstance(record, TimelineCheckpoint) or \
+			record.stat_name not in stat_names):
+				continue
+			yield (record_offset, record) if with_offsets else record
+	
+	def _is_entry_boundary(self, offset):
+		return self.file.is_block_end(offset)
+
+class SqliteTimeline(TimelineBackend):
+	"Timeline kept in SQLite database (see sqlitetimeline)"
+	def __init__(self, path, **kwargs):
+		kwargs["start_stat"] = {}
+		super().__init__(rollups_path=f"{path}.rollups", **kwargs)
+		self.path = Path(path)
+		synchronous = "NORMAL"
+		if TIMELINE_FSYNC_INTERVAL == 0:
+			synchronous = "FULL"
+		elif TIMELINE_FSYNC_INTERVAL < 0:
+			synchronous = "OFF"
+		self.db = sqlitetimeline.SqliteTimelineDb(self.path, synchronous)
+		self._end_stat = None
+	
+	def add_entry(self, entry):
+		self.add_entries([entry])
+	
+	def add_entries(self, entries):
+		"The whole batch is inserted in a single transaction"
+		entries = list(entries)
+		if not entries:
+			return
+		self.clear_cache()
+		self._load_rollups()
+		
+		records = [(int(e.timestamp), str(e.legend), str(e.stat_name),
+			str(e.stat_value)) for e in entries]
+		self.db.append(records)
+		
+		if self._end_stat is not None:
+			for _, legend, stat_name, value in records:
+				self._end_stat[(legend, stat_name)] = value
+			self._index_trackers(entries)
+		self.rollups.add_entries(entries)
+		self.rollups.flush()
+	
+	def get_end_stat(self):
+		if self._end_stat is None:
+			self._end_stat = self.db.get_end_stat()
+		return self._end_stat
+	
+	def iter(self, reverse=False, start=None, end=None, stat_names=None,
+			keys=None):
+		if keys is not None:
+			keys = [tuple(k) for k in keys]
+		for record in self.db.iter(reverse, start, end, stat_names, keys):
+			yield TimelineEntry(*record)
+	
+	def close(self):
+		self.db.close()
+	
+	def get_stat_at(self, moment):
+		return self.db.get_stat_until(moment, inclusive=True)
+	
+	def get_stat_before(self, moment):
+		return self.db.get_stat_until(moment, inclusive=False)
+
+class MemoryTimeline(TimelineBackend):
+	"Timeline backend which is not persisted, for tests and benchmarks"
+	def __init__(self, path=None, **kwargs):
+		super().__init__(**kwargs)
+		self.path = path
+	
+	def add_entries(self, entries):
+		# values are kept the same way persistent backends read them back
+		entries = [TimelineEntry(int(e.timestamp), str(e.legend),
+			str(e.stat_name), str(e.stat_value)) for e in entries]
+		self._load_rollups()
+		super().add_entries(entries)
+		self.rollups.add_entries(entries)
+
+class TimelineArchive():
+	"""
+	Closed time-bounded segments of a stored timeline. Segments are
+	compressed and kept in a directory along with a manifest of their time
+	bounds, so that reads can skip the segments out of the requested range
+	"""
+	def __init__(self, path):
+		self.dir = Path(path)
+		self.manifest_path = self.dir / "manifest.json"
+		self._segments = None
+	
+	def get_segments(self, start=None, end=None):
+		"Returns segments overlapping the time range, oldest first"
+		if self._segments is None:
+			self._load()
+		
+		return [s for s in self._segments if \
+			(start is None or s["end"] >= start) and \
+			(end is None or s["start"] <= end)]
+	
+	def add(self, path, start, end, is_ordered=True):
+		"""
+		Moves closed segment file into the archive and compresses it.
+		Segments with decreasing timestamps are marked as not ordered
+		"""
+		self.get_segments()
+		self.dir.mkdir(parents=True, exist_ok=True)
+		
+		name = get_segment_period(start)
+		seg_path = self.dir / f"{name}{path.suffix}"
+		while list(self.dir.glob(f"{seg_path.name}*")):
+			name += "+"
+			seg_path = self.dir / f"{name}{path.suffix}"
+		
+		path.replace(seg_path)
+		segment = {"name": seg_path.name, "start": start, "end": end}
+		if not is_ordered:
+			segment["ordered"] = False
+		self._segments.append(segment)
+		self._save()
+		
+		segment["name"] = self._compress(seg_path).name
+		self._save()
+		seg_path.unlink()
+	
+	def iter_segment(self, segment, reverse=False, with_checkpoints=False,
+			stat_names=None):
+		"""
+		Streams records of the segment. Reverse and binary reads need random
+		access, so compressed segments are decompressed into a temporary file
+		for them instead of memory. The copy is a .tmp one in the archive
+		directory, so it is never taken for a segment
+		"""
+		path = self.dir / segment["name"]
+		def _is_wanted(record):
+			return not (stat_names and (isinstance(record, TimelineCheckpoint) \
+				or record.stat_name not in stat_names))
+		
+		with self._open(path) as fh:
+			magic = binarytimeline.MAGIC
+			is_binary = fh.read(len(magic)) == magic
+			if not is_binary and not reverse:
+				fh.seek(0)
+				yield from filter(_is_wanted,
+					iter_text_chunks(fh, path.name, with_checkpoints))
+				return
+		
+		with tempfile.TemporaryDirectory(suffix=".tmp",
+				dir=self.dir) as work_dir:
+			if path.suffix in (".xz", ".gz"):
+				plain_path = Path(work_dir) / path.stem
+				with self._open(path) as src, plain_path.open("wb") as dest:
+					shutil.copyfileobj(src, dest)
+			else:
+				plain_path = path
+			
+			if is_binary:
+				records = binarytimeline.BinaryTimelineFile(plain_path).iter(
+					reverse=reverse, with_checkpoints=with_checkpoints)
+				yield from filter(_is_wanted, map(from_binary_record, records))
+			else:
+				yield from iter_text_lines_reverse(plain_path, path.name,
+					stat_names=stat_names, with_checkpoints=with_checkpoints)
+	
+	def _load(self):
+		"""
+		Reads the manifest making sure it matches segment files. Files left
+		by interrupted archiving are cleaned up, unknown ones are scanned
+		"""
+		segments = []
+		if self.manifest_path.exists():
+			try:
+				manifest_raw = self.manifest_path.read_text(encoding="utf-8")
+				segments = json.loads(manifest_raw)["segments"]
+			except (ValueError, KeyError):
+				log(f"Rebuilding broken {self.dir.name} manifest", err=True)
+		
+		files = set()
+		if self.dir.exists():
+			files = {p.name for p in self.dir.iterdir() if \
+				p != self.manifest_path and p.suffix != ".tmp"}
+		
+		self._segments = [s for s in segments if s["name"] in files]
+		known = {s["name"]: s for s in self._segments}
+		changed = len(self._segments) != len(segments)
+		
+		for name in sorted(files - set(known)):
+			changed = True
+			base_name = name.rsplit(".", 1)[0]
+			if base_name in known: # compressed, but not recorded yet
+				known[base_name]["name"] = name
+				(self.dir / base_name).unlink()
+				continue
+			if [n for n in known if n.startswith(f"{name}.")]:
+				(self.dir / name).unlink() # already compressed
+				continue
+			
+			log(f"Adding unknown {self.dir.name}/{name} segment to manifest")
+			segment = {"name": name, "start": None, "end": None}
+			for record in self.iter_segment(segment):
+				if segment["start"] is None:
+					segment["start"] = record.timestamp
+				elif record.timestamp < segment["end"]:
+					segment["ordered"] = False
+				segment["end"] = record.timestamp
+			if segment["start"] is not None:
+				self._segments.append(segment)
+				known[name] = segment
+		
+		self._segments.sort(key=lambda s: s["start"])
+		if changed:
+			self._save()
+	
+	def _save(self):
+		tmp_path = self.manifest_path.with_suffix(".tmp")
+		tmp_path.write_text(json.dumps({"segments": self._segments},
+			indent="\t"), encoding="utf-8")
+		tmp_path.replace(self.manifest_path)
+	
+	def _compress(self, path):
+		if TIMELINE_ARCHIVE_COMPRESSION == "lzma":
+			dest, opener = Path(f"{path}.xz"), lzma.open
+		else:
+			dest, opener = Path(f"{path}.gz"), gzip.open
+		
+		tmp_path = Path(f"{dest}.tmp")
+		with path.open("rb") as src, opener(tmp_path, "wb") as dest_fh:
+			shutil.copyfileobj(src, dest_fh)
+		tmp_path.replace(dest)
+		return dest
+	
+	def _open(self, path):
+		if path.suffix == ".xz":
+			return lzma.open(path, "rb")
+		if path.suffix == ".gz":
+			return gzip.open(path, "rb")
+		return path.open("rb")
+
+class SessionIndex():
+	"""
+	is_online transitions of a stored timeline, kept in a sidecar file of
+	"timestamp value" lines. Sessions separated by breaks not longer than
+	SESS_MAX_BREAK are merged on load, so the setting can be changed freely
+	"""
+	def __init__(self, path):
+		self.path = Path(path)
+		self.reset()
+		self._rewrite = False
+	
+	def load(self):
+		self.reset()
+		self._rewrite = False
+		if not self.path.exists():
+			return False
+		
+		try:
+			for line in self.path.read_text(encoding="utf-8").splitlines():
+				timestamp, value = line.split(" ")
+				self._add(int(timestamp), value)
+		except ValueError:
+			log(f"Rebuilding broken {self.path.name} session index")
+			self.reset()
+			return False
+		
+		return True
+	
+	def reset(self):
+		self.online_timestamps = array("q")
+		self.offline_timestamps = array("q")
+		self.sess_starts = array("q") # merged session start of each online
+		self.last_value = None
+		self._pending, self._rewrite = [], True
+	
+	def add(self, timestamp, value):
+		self._add(int(timestamp), str(value))
+		self._pending.append(f"{int(timestamp)} {value}\n")
+	
+	def _add(self, timestamp, value):
+		self.last_value = value
+		if value == "0":
+			self.offline_timestamps.append(timestamp)
+			return
+		if value != "1":
+			return
+		
+		sess_start = timestamp
+		if self.offline_timestamps and \
+		self.offline_timestamps[-1] >= timestamp - SESS_MAX_BREAK:
+			# just a break, -1 if there was no session before
+			sess_start = self.sess_starts[-1] if self.sess_starts else -1
+		self.online_timestamps.append(timestamp)
+		self.sess_starts.append(sess_start)
+	
+	def flush(self):
+		if not self._pending and not self._rewrite:
+			return
+		
+		with self.path.open("w" if self._rewrite else "a",
+				encoding="utf-8") as fh:
+			fh.write("".join(self._pending))
+		self._pending, self._rewrite = [], False
+	
+	def get_last_online(self, before_moment):
+		idx = bisect_right(self.offline_timestamps, before_moment) - 1
+		return self.offline_timestamps[idx] if idx >= 0 else None
+	
+	def get_sess_start(self, before_moment):
+		idx = bisect_right(self.online_timestamps, before_moment) - 1
+		if idx < 0 or self.sess_starts[idx] < 0:
+			return None
+		return self.sess_starts[idx]
+
+class RollupTable():
+	"""
+	Hourly and daily (UTC) rollups of a stored timeline: time online and
+	in match, matches by type and tracker deltas per legend, in rows like
+	{"online": 3600, "match": 1200, "matches": {"inPublicMatch": 2},
+	"trackers": {"Wraith": {"kills": 3}}}. Rows are appended to a sidecar
+	file as the buckets close, followed by the state of the sweep, so only
+	the entries after the last state are replayed on load. Entries of the
+	newest timestamp are held until a newer one comes, as more of them may
+	still be added, so time is counted up to the timestamp before it.
+	Matches are counted in the hour their type becomes known. Without path
+	the rollups are kept in memory only
+	"""
+	_RANK_KEY = ("_", "br_rank_score") # the only diff of segments needed
+	
+	def __init__(self, path=None):
+		self.path = Path(path) if path else None
+		self.reset()
+		self._rewrite = False
+	
+	def load(self):
+		"Returns False if there is no saved state to continue from"
+		self.reset()
+		self._rewrite = False
+		if not self.path or not self.path.exists():
+			return False
+		
+		state, states_count = None, 0
+		try:
+			for line in self.path.read_text(encoding="utf-8").splitlines():
+				kind, data = line.split(" ", 1)
+				if kind == "s":
+					state, states_count = json.loads(data), states_count + 1
+					continue
+				bucket, row = data.split(" ", 1)
+				rows = self.hours if kind == "h" else self.days
+				rows[int(bucket)] = json.loads(row)
+			if state:
+				self._set_state(state)
+		except (ValueError, KeyError, TypeError):
+			log(f"Rebuilding broken {self.path.name} rollups")
+			self.reset()
+			return False
+		
+		if not state or state["last_timestamp"] is None:
+			self.reset()
+			return False
+		
+		self._rewrite = states_count > 1 # dropping the outdated states
+		return True
+	
+	def reset(self):
+		self.hours, self.days = {}, {} # bucket start -> row
+		self.last_timestamp = None # of the held entries
+		self._held = {} # (legend, stat_name) -> value of the held entries
+		self._counted_timestamp = None
+		self._values = {} # is_online, is_in_match, br_rank_score
+		self._trackers = {} # (legend, stat_name) -> last number
+		# state segments, the ones before the last two are counted
+		self._segments = SessionAnalyzer(diff_keys={self._RANK_KEY})
+		self._segments.start_segment(False, {})
+		self._open_hours, self._open_days = set(), set()
+		self._pending, self._state_changed, self._rewrite = [], False, True
+	
+	def add_entries(self, entries):
+		"""
+		Entries must go in timeline order, older ones than held are skipped.
+		Entries of the held timestamp may be added again
+		"""
+		for entry in entries:
+			timestamp = int(entry.timestamp)
+			if timestamp != self.last_timestamp:
+				if self.last_timestamp is not None:
+					if timestamp < self.last_timestamp:
+						continue
+					self._add_timestamp(self.last_timestamp, self._held)
+				self.last_timestamp, self._held = timestamp, {}
+			# values are kept the same way they are read back from the file
+			key = (str(entry.legend), str(entry.stat_name))
+			self._held[key] = str(entry.stat_value)
+	
+	def _add_timestamp(self, timestamp, values):
+		if self._counted_timestamp is not None:
+			if self._values.get("is_online") == "1":
+				self._add_time("online", self._counted_timestamp, timestamp)
+			if self._values.get("is_in_match") == "1":
+				self._add_time("match", self._counted_timestamp, timestamp)
+			self._close_buckets(timestamp)
+		self._counted_timestamp = timestamp
+		
+		self._add_trackers(timestamp, values)
+		self._add_segments(timestamp, values)
+		for stat_name in ("is_online", "is_in_match", "br_rank_score"):
+			if ("_", stat_name) in values:
+				self._values[stat_name] = values[("_", stat_name)]
+	
+	def _add_time(self, field, start, end):
+		while start < end:
+			hour = start - start % 3600
+			until = min(end, hour + 3600)
+			row = self._get_hour_row(hour)
+			row[field] = row.get(field, 0) + until - start
+			start = until
+	
+	def _add_trackers(self, timestamp, values):
+		for key, value in values.items():
+			if not key[1].startswith("tracker_"):
+				continue
+			value = util.to_num(value)
+			if value is None:
+				continue
+			
+			prev = self._trackers.get(key)
+			self._trackers[key] = value
+			if prev is None or prev == value:
+				continue
+			trackers = self._get_hour_row(timestamp).setdefault("trackers", {})
+			legend_trackers = trackers.setdefault(key[0], {})
+			legend_trackers[key[1][8:]] = \
+				legend_trackers.get(key[1][8:], 0) + value - prev
+	
+	def _add_segments(self, timestamp, values):
+		sweep_stat = {self._RANK_KEY: self._values.get("br_rank_score",
+			"$null")}
+		segs = self._segments.segments
+		if self._segments.add_timestamp(timestamp, list(values.items()),
+				values, sweep_stat) and len(segs) > 2:
+			# segment before the previous one can't get the result anymore
+			self._count_match(segs.pop(0), timestamp)
+	
+	def _count_match(self, seg, timestamp):
+		if seg.is_match and seg.is_ended:
+			matches = self._get_hour_row(timestamp).setdefault("matches", {})
+			match_type = seg.get_type()
+			matches[match_type] = matches.get(match_type, 0) + 1
+	
+	def _dump_segment(self, seg):
+		return {
+			"match": seg.is_match,
+			"rank": seg.get_diff_values(self._RANK_KEY),
+			"result": seg.has_result,
+			"ended": seg.is_ended
+		}
+	
+	def _load_segment(self, data):
+		seg = TimelineSummary(None, {self._RANK_KEY: None},
+			bool(data and data["match"]), {self._RANK_KEY})
+		if data:
+			seg.has_result, seg.is_ended = data["result"], data["ended"]
+			if data["rank"]:
+				seg.set_diff_values(self._RANK_KEY, data["rank"])
+		return seg
+	
+	def _get_hour_row(self, timestamp):
+		hour = timestamp - timestamp % 3600
+		if hour not in self.hours:
+			self.hours[hour] = {}
+			self._open_hours.add(hour)
+		return self.hours[hour]
+	
+	def _close_buckets(self, timestamp):
+		"Closes the buckets before the one of timestamp"
+		for hour in sorted(self._open_hours):
+			if hour + 3600 > timestamp:
+				continue
+			self._open_hours.remove(hour)
+			day = hour - hour % 86400
+			if day not in self.days:
+				self.days[day] = {}
+				self._open_days.add(day)
+			add_rollup_row(self.days[day], self.hours[hour])
+			row = dump_rollup_row(self.hours[hour])
+			self._pending.append(f"h {hour} {row}")
+			self._state_changed = True
+		
+		for day in sorted(self._open_days):
+			if day + 86400 > timestamp:
+				continue
+			self._open_days.remove(day)
+			self._pending.append(f"d {day} {dump_rollup_row(self.days[day])}")
+	
+	def _get_state(self):
+		return {
+			"last_timestamp": self.last_timestamp,
+			"held": [[legend, stat_name, value] for \
+				(legend, stat_name), value in self._held.items()],
+			"counted_timestamp": self._counted_timestamp,
+			"values": self._values,
+			"trackers": [[legend, stat_name, value] for \
+				(legend, stat_name), value in self._trackers.items()],
+			"segs": [self._dump_segment(seg) for seg in \
+				self._segments.segments[::-1]], # current one first
+			"open_hours": {h: self.hours[h] for h in self._open_hours},
+			"open_days": {d: self.days[d] for d in self._open_days}
+		}
+	
+	def _set_state(self, state):
+		self.last_timestamp = state["last_timestamp"]
+		self._held = {(legend, stat_name): value for \
+			legend, stat_name, value in state["held"]}
+		self._counted_timestamp = state["counted_timestamp"]
+		self._values = state["values"]
+		self._trackers = {(legend, stat_name): value for \
+			legend, stat_name, value in state["trackers"]}
+		self._segments.segments = [self._load_segment(data) for data in \
+			state["segs"][::-1]]
+		for rows, open_buckets, field in (
+				(self.hours, self._open_hours, "open_hours"),
+				(self.days, self._open_days, "open_days")):
+			for bucket, row in state[field].items():
+				rows[int(bucket)] = row
+				open_buckets.add(int(bucket))
+	
+	def flush(self):
+		"Rows of the closed buckets are written along with the current state"
+		if not self.path:
+			self._pending, self._state_changed = [], False
+			return
+		
+		if self._rewrite:
+			self._pending = \
+				[f"h {h} {dump_rollup_row(r)}" for h, r in \
+					sorted(self.hours.items()) if h not in self._open_hours] + \
+				[f"d {d} {dump_rollup_row(r)}" for d, r in \
+					sorted(self.days.items()) if d not in self._open_days]
+		elif not self._state_changed:
+			return
+		
+		self._pending.append(f"s {dump_rollup_row(self._get_state())}")
+		with self.path.open("w" if self._rewrite else "a",
+				encoding="utf-8") as fh:
+			fh.write("".join([line + "\n" for line in self._pending]))
+		self._pending, self._state_changed, self._rewrite = [], False, False
+	
+	def get_rows(self, period="hour", start=None, end=None):
+		"Returns [(bucket start, row)] of buckets starting within the range"
+		if period not in ("hour", "day"):
+			raise ValueError(f"Unknown rollup period: {period}")
+		
+		def _is_in_range(bucket):
+			return (start is None or bucket >= start) and \
+				(end is None or bucket <= end)
+		
+		# rows are deep copies, so that neither the caller nor adding open
+		# hours to them changes the nested counters of the table
+		rows = {bucket: deepcopy(row) for bucket, row in \
+			(self.hours if period == "hour" else self.days).items() if \
+			_is_in_range(bucket)}
+		if period == "day": # open hours are not a part of the daily rows yet
+			for hour in self._open_hours:
+				day = hour - hour % 86400
+				if _is_in_range(day):
+					add_rollup_row(rows.setdefault(day, {}), self.hours[hour])
+		
+		return sorted(rows.items(), key=lambda item: item[0])
+	
+	def get_summary(self, start, end):
+		"Sums the rows of [start, end), reading whole days from daily rows"
+		summary = {}
+		days_start = start + (-start) % 86400
+		days_end = end - end % 86400
+		if days_start < days_end:
+			hour_ranges = [(start, days_start), (days_end, end)]
+			for _, row in self.get_rows("day", days_start, days_end - 1):
+				add_rollup_row(summary, row)
+		else:
+			hour_ranges = [(start, end)]
+		
+		for range_start, range_end in hour_ranges:
+			if range_start >= range_end:
+				continue
+			for _, row in self.get_rows("hour",
+					range_start - range_start % 3600, range_end - 1):
+				add_rollup_row(summary, row)
+		return summary
+
+class TimelineIndex():
+	"""
+	Sparse timestamp -> offset index of a stored timeline, kept in a sidecar
+	file of "timestamp offset" lines. Each point marks the offset where
+	entries of a new timestamp start. Entries of TIMELINE_POSTINGS_STATS
+	also have their offsets listed per (legend, stat_name) key
+	"""
+	def __init__(self, path):
+		self.path = Path(path)
+		self.reset()
+		self._rewrite = False
+	
+	def load(self):
+		self.reset()
+		self._rewrite = False
+		if not self.path.exists():
+			return False
+		
+		self._pending, self.posted_stats = [], []
+		try:
+			for line in self.path.read_text(encoding="utf-8").splitlines():
+				if line.startswith("c "): # checkpoint
+					_, timestamp, offset = line.split(" ")
+					self.checkpoint_timestamps.append(int(timestamp))
+					self.checkpoint_offsets.append(int(offset))
+					continue
+				if line.startswith("p "): # posting
+					_, legend, stat_name, offset = line.split(" ")
+					self._add_posting(util.semiurldecode(legend),
+						util.semiurldecode(stat_name), int(offset))
+					continue
+				if line.startswith("s "): # posted stats
+					self.posted_stats = line.split(" ")[1:]
+					continue
+				if line == "u": # timestamps decrease somewhere
+					self.is_ordered = False
+					continue
+				timestamp, offset = line.split(" ")
+				self.timestamps.append(int(timestamp))
+				self.offsets.append(int(offset))
+		except ValueError:
+			log(f"Rebuilding broken {self.path.name} index")
+			self.reset()
+			return False
+		
+		return True
+	
+	def reset(self):
+		self.timestamps, self.offsets = array("q"), array("q")
+		self.checkpoint_timestamps = array("q")
+		self.checkpoint_offsets = array("q")
+		self.postings = {} # (legend, stat_name) -> offsets
+		self.posted_stats = list(TIMELINE_POSTINGS_STATS)
+		self.is_ordered = True
+		self._pending, self._rewrite = [], True
+		if self.posted_stats:
+			self._pending.append(" ".join(["s"] + self.posted_stats) + "\n")
+	
+	def add(self, timestamp, offset):
+		self.timestamps.append(int(timestamp))
+		self.offsets.append(offset)
+		self._pending.append(f"{int(timestamp)} {offset}\n")
+	
+	def set_unordered(self):
+		if self.is_ordered:
+			self.is_ordered = False
+			self._pending.append("u\n")
+	
+	def add_checkpoint(self, timestamp, offset):
+		self.checkpoint_timestamps.append(int(timestamp))
+		self.checkpoint_offsets.append(offset)
+		self._pending.append(f"c {int(timestamp)} {offset}\n")
+	
+	def add_posting(self, legend, stat_name, offset):
+		if self._add_posting(str(legend), str(stat_name), offset):
+			self._pending.append(f"p {util.semiurlencode(str(legend))} "
+				f"{util.semiurlencode(str(stat_name))} {offset}\n")
+	
+	def _add_posting(self, legend, stat_name, offset):
+		offsets = self.postings.setdefault((legend, stat_name), array("q"))
+		if offsets and offsets[-1] >= offset:
+			return False # already there (e.g. entry of the same block)
+		offsets.append(offset)
+		return True
+	
+	def flush(self):
+		if not self._pending and not self._rewrite:
+			return
+		
+		with self.path.open("w" if self._rewrite else "a",
+				encoding="utf-8") as fh:
+			fh.write("".join(self._pending))
+		self._pending, self._rewrite = [], False
+	
+	def find_start_offset(self, moment):
+		"Offset after which all entries since the moment are located"
+		idx = bisect_right(self.timestamps, moment) - 1
+		return self.offsets[idx] if idx >= 0 else None
+	
+	def find_end_offset(self, moment):
+		"Offset before which all entries up to the moment are located"
+		idx = bisect_right(self.timestamps, moment)
+		return self.offsets[idx] if idx < len(self.offsets) else None
+	
+	def find_postings(self, keys, start_offset=None, end_offset=None):
+		"Sorted offsets of the keys entries in [start_offset, end_offset)"
+		offsets = set()
+		for key in keys:
+			key_offsets = self.postings.get(key, [])
+			lo = bisect_left(key_offsets, start_offset or 0)
+			hi = len(key_offsets)
+			if end_offset is not None:
+				hi = bisect_left(key_offsets, end_offset)
+			offsets.update(key_offsets[lo:hi])
+		return sorted(offsets)
+	
+	def find_checkpoint_offset(self, moment, inclusive=True):
+		"Offset of the latest checkpoint not containing entries past moment"
+		if inclusive:
+			idx = bisect_right(self.checkpoint_timestamps, moment) - 1
+		else:
+			idx = bisect_left(self.checkpoint_timestamps, moment) - 1
+		return self.checkpoint_offsets[idx] if idx >= 0 else None
+
+class TimelineCheckpoint():
+	"""
+	Full stat written into a stored timeline, so that stat at any moment can
+	be restored by replaying only the entries after the nearest checkpoint.
+	Timestamp is the one of the last entry written before the checkpoint
+	"""
+	PREFIX = "#checkpoint "
+	
+	def __init__(self, timestamp, stat):
+		self.timestamp = timestamp
+		self.stat = stat
+	
+	@classmethod
+	def parse(cls, line):
+		try:
+			_, timestamp, stat_raw = line.strip(" \r\n").split(" ", 2)
+			stat = {(l, n): v for l, n, v in json.loads(stat_raw)}
+			return cls(int(timestamp), stat)
+		except (ValueError, TypeError):
+			raise TimelineEntryError("Invalid checkpoint")
+	
+	def serialize(self):
+		stat_raw = json.dumps([[*key, value] for key, value in \
+			self.stat.items()], separators=(",", ":"))
+		return f"{self.PREFIX}{self.timestamp} {stat_raw}"
+
+class TimelineColumns():
+	"""
+	Entries of in-memory timelines kept column by column, with the keys
+	being ids in the shared timeline_keys table
+	"""
+	def __init__(self):
+		self.timestamps = array("q")
+		self.key_ids = array("l")
+		self.values = []
+		self.is_sorted = True # timestamps never decrease
+	
+	def append(self, entry):
+		timestamp = int(entry.timestamp)
+		if self.timestamps and timestamp < self.timestamps[-1]:
+			self.is_sorted = False
+		self.timestamps.append(timestamp)
+		self.key_ids.append(
+			timeline_keys.get_id((entry.legend, entry.stat_name)))
+		self.values.append(entry.stat_value)
+	
+	def copy(self, lo, hi):
+		columns = TimelineColumns()
+		columns.timestamps = self.timestamps[lo:hi]
+		columns.key_ids = self.key_ids[lo:hi]
+		columns.values = self.values[lo:hi]
+		columns.is_sorted = self.is_sorted
+		return columns
+
+class TimelineKeys():
+	"Interned (legend, stat_name) keys of in-memory timelines"
+	def __init__(self):
+		self.keys = []
+		self.ids = {}
+		self.lock = threading.Lock()
+	
+	def get_id(self, key):
+		key_id = self.ids.get(key)
+		if key_id is None:
+			with self.lock:
+				key_id = self.ids.get(key)
+				if key_id is None: # key is listed before its id is exposed
+					self.keys.append(key)
+					key_id = self.ids[key] = len(self.keys) - 1
+		return key_id
+
+timeline_keys = TimelineKeys()
+
+class SessionAnalyzer():
+	"""
+	Sweeps the timeline once, summarizing it along with the state segments
+	split_by_states would make of it, so that formatting does not iterate
+	the segments over and over. Without timeline the timestamps are added
+	by the caller, as rollups do, and diff is tracked for diff_keys only
+	"""
+	def __init__(self, timeline=None, with_segments=True, diff_keys=None):
+		self.summary = None
+		self.segments = []
+		self.diff_keys = diff_keys
+		if timeline is None:
+			return
+		if with_segments:
+			self._analyze(timeline)
+		else:
+			self._analyze_summary(timeline)
+	
+	def _analyze_summary(self, timeline):
+		# stat before the first entry of a key is still the start stat
+		start_stat = timeline.start_stat
+		self.summary = TimelineSummary(start_stat.get(("_", "legend")),
+			start_stat)
+		for timestamp, items in timeline.iter_timestamp_items():
+			self.summary.add(timestamp, items, dict(items), start_stat)
+	
+	def _analyze(self, timeline):
+		sweep_stat = timeline.start_stat.copy()
+		self.summary = TimelineSummary(sweep_stat.get(("_", "legend")),
+			sweep_stat)
+		self.start_segment(sweep_stat.get(("_", "is_in_match")) == "1",
+			sweep_stat)
+		
+		hi = 0
+		for timestamp, items in timeline.iter_timestamp_items():
+			values = dict(items)
+			lo, hi = hi, hi + len(items) # entries range of the timestamp
+			self.summary.add(timestamp, items, values, sweep_stat)
+			self.add_timestamp(timestamp, items, values, sweep_stat, lo, hi)
+			sweep_stat.update(values)
+	
+	def start_segment(self, is_match, sweep_stat, lo=0):
+		start_stat = sweep_stat.copy()
+		seg = TimelineSummary(start_stat.get(("_", "legend")), start_stat,
+			is_match, self.diff_keys)
+		seg.start_stat, seg.lo, seg.hi = start_stat, lo, lo
+		self.segments.append(seg)
+		return seg
+	
+	def add_timestamp(self, timestamp, items, values, sweep_stat, lo=0,
+			hi=0):
+		"""
+		Adds timestamp entries to the segments, sweep_stat is the stat before
+		them. Returns True if the timestamp starts a new segment, which
+		belongs to both of them
+		"""
+		segs = self.segments
+		segs[-1].add(timestamp, items, values, sweep_stat)
+		segs[-1].hi = hi
+		
+		if values.get(("_", "level")):
+			for seg in segs[-2:]:
+				if seg.is_match:
+					seg.has_result, seg.result_range = True, (lo, hi)
+		
+		if not values.get(("_", "is_online")) and \
+		not values.get(("_", "is_in_match")):
+			return False
+		seg = self.start_segment(values.get(("_", "is_in_match")) == "1",
+			sweep_stat, lo)
+		seg.add(timestamp, items, values, sweep_stat)
+		seg.hi = hi
+		return True
+
+class TimelineSummary():
+	"Bounds, state, legend and diff of a timeline or of its state segment"
+	def __init__(self, start_legend, keys_order, is_match=False,
+			diff_keys=None):
+		self.is_match = is_match
+		self.is_ended = False
+		self.has_result = False # see MatchTimeline.result_stamp
+		self.result_range = None
+		# of state segments: stat and entries range in the timeline
+		self.start_stat, self.lo, self.hi = None, None, None
+		self.start = self.end = None
+		self.first_values = None
+		# legend change at the end belongs to the next state
+		self.legend = self._legend = start_legend
+		# diff keys coming from the start stat go first, in its order
+		self._keys_order = keys_order
+		self._diff_start = {}
+		self._diff_end = {}
+		self._from_start_stat = set()
+		self._diff = None
+		self._diff_keys = diff_keys
+	
+	def add(self, timestamp, items, values, sweep_stat):
+		"Adds timestamp entries, sweep_stat is the stat before them"
+		if self.start is None:
+			self.start, self.first_values = timestamp, values
+		self.end = timestamp
+		self.legend = self._legend
+		self._legend = values.get(("_", "legend")) or self._legend
+		self._diff = None
+		
+		if ("_", "is_online") in values or \
+		values.get(("_", "is_in_match")) == "0":
+			self.is_ended = True
+		
+		diff_start, diff_end = self._diff_start, self._diff_end
+		diff_keys = self._diff_keys
+		for key, value in items:
+			if diff_keys is not None and key not in diff_keys:
+				continue
+			if key in diff_start:
+				if value != "$null":
+					diff_end[key] = value
+				continue
+			
+			start_value = sweep_stat.get(key, "$null")
+			if start_value == "$null":
+				diff_start[key] = diff_end[key] = value
+				continue
+			diff_start[key] = start_value
+			diff_end[key] = start_value if value == "$null" else value
+			self._from_start_stat.add(key)
+	
+	def get_diff_values(self, key):
+		"Returns [start, end] values of the key, even if they are equal"
+		if key not in self._diff_start:
+			return None
+		return [self._diff_start[key], self._diff_end[key]]
+	
+	def set_diff_values(self, key, values):
+		"Restores the values of get_diff_values, e.g. of a saved state"
+		self._diff_start[key], self._diff_end[key] = values
+		self._from_start_stat.add(key)
+		self._diff = None
+	
+	def get_diff(self):
+		if self._diff is not None:
+			return self._diff
+		
+		keys = []
+		if self._from_start_stat:
+			keys = [k for k in self._keys_order if k in self._from_start_stat]
+		keys += [k for k in self._diff_start if k not in self._from_start_stat]
+		
+		self._diff = {}
+		for key in keys:
+			if self._diff_start[key] != self._diff_end[key]:
+				self._diff[key] = (self._diff_start[key], self._diff_end[key])
+		return self._diff
+	
+	def get_state(self):
+		if self.is_match:
+			if self.is_ended and not self.has_result:
+				return "inFiringRange"
+			return "inMatch"
+		
+		if self.first_values is None:
+			return None
+		if self.first_values.get(("_", "is_in_match")) == "1":
+			return "inMatch"
+		if self.first_values.get(("_", "is_online")) == "0":
+			return "offline"
+		return "inLobby"
+	
+	def get_type(self):
+		if not self.has_result:
+			return "inFiringRange"
+		elif ("_", "br_rank_score") in self.get_diff():
+			return "inRankedBrMatch"
+		else:
+			return "inPublicMatch"
+	
+	def get_duration(self):
+		end = self.end
+		if self.is_match and not self.is_ended:
+			end = int(time.time())
+		if None in [self.start, end]:
+			return 0
+		return end - self.start
+	
+	def is_real(self):
+		return self.has_result
+
+class TimestampStat():
+	def __init__(self, timestamp):
+		self.timestamp = int(timestamp)
+		self.data = {}
+	
+	def add_entry(self, entry):
+		if not entry.timestamp == self.timestamp:
+			raise ValueError
 		
 		key = (entry.legend, entry.stat_name)
 		self.data[key] = entry
@@ -1499,13 +3534,27 @@ class TimestampStat():
 
 
 class TimelineEntry():
+	__slots__ = ("timestamp", "legend", "stat_name", "stat_value",
+		"_stat_value_num")
+	
 	def __init__(self, timestamp, legend, stat_name, stat_value):
 		self.timestamp = timestamp
 		self.legend = legend
 		self.stat_name = stat_name
 		self.stat_value = stat_value
-		self.stat_value_num = util.to_num(self.stat_value)
-		self.isnull = self.stat_value == "$null"
+	
+	@property
+	def stat_value_num(self):
+		# most of the entries are never used as numbers
+		try:
+			return self._stat_value_num
+		except AttributeError:
+			self._stat_value_num = util.to_num(self.stat_value)
+			return self._stat_value_num
+	
+	@property
+	def isnull(self):
+		return self.stat_value == "$null"
 	
 	@classmethod
 	def parse(cls, entry_line):
@@ -1515,10 +3564,14 @@ class TimelineEntry():
 		if len(entry_split) != 4:
 			raise TimelineEntryError("Invalid number of entry chunks")
 		
-		entry_split[0] = util.to_num(entry_split[0])
-		entry_split[1] = util.semiurldecode(str(entry_split[1]))
-		entry_split[2] = util.semiurldecode(str(entry_split[2]))
-		entry_split[3] = util.semiurldecode(str(entry_split[3]))
+		try:
+			entry_split[0] = int(entry_split[0])
+		except ValueError:
+			entry_split[0] = util.to_num(entry_split[0])
+		if "%" in entry:
+			entry_split[1] = util.semiurldecode(entry_split[1])
+			entry_split[2] = util.semiurldecode(entry_split[2])
+			entry_split[3] = util.semiurldecode(entry_split[3])
 		
 		if entry_split[0] == None:
 			raise TimelineEntryError("Invalid entry timestamp")
@@ -1717,6 +3770,287 @@ def format_map_rotation():
 		format_map("Мікстейп",  maps["mixtape"])
 	))
 
+def get_als_stat_fingerprint(player_stat):
+	"Values of player stat which Timeline.consume_als_stat reads"
+	_global = player_stat["global"]
+	_realtime = player_stat["realtime"]
+	selected = player_stat["legends"]["selected"]
+	return (
+		_global["level"], _global["toNextLevelPercent"],
+		_global.get("levelPrestige", 0), _global.get("internalUpdateCount", 0),
+		_realtime["currentState"], _realtime["isInGame"],
+		_realtime["isOnline"], _realtime["partyFull"],
+		_global["bans"]["isActive"], _global["bans"]["last_banReason"],
+		_global["bans"]["remainingSeconds"],
+		_global["rank"]["rankScore"], _global["rank"]["rankDiv"],
+		_global["rank"]["ladderPosPlatform"], _global["rank"]["rankName"],
+		_global["name"], selected["LegendName"],
+		tuple([(tracker["key"], tracker["value"], tracker["global"]) for \
+			tracker in selected["data"]])
+	)
+
+def get_timeline_backends():
+	"Timeline format -> (backend class, file suffix)"
+	return {
+		"text": (StoredTimeline, ".txt"),
+		"binary": (BinaryStoredTimeline, ".ptl"),
+		"sqlite": (SqliteTimeline, ".sqlite")
+	}
+
+def open_stored_timeline(uid, timeline_format=TIMELINE_FORMAT):
+	"""
+	Opens player timeline in the timeline_format, falling back to another
+	format if the player only has a timeline of that one
+	"""
+	if timeline_format == "memory":
+		return MemoryTimeline()
+	
+	backends = get_timeline_backends()
+	paths = {fmt: TIMELINE_DIR / f"{uid}{suffix}" for \
+		fmt, (_, suffix) in backends.items()}
+	if not paths[timeline_format].exists():
+		existing = [fmt for fmt, path in paths.items() if path.exists()]
+		if existing:
+			timeline_format = existing[0]
+	
+	return backends[timeline_format][0](paths[timeline_format])
+
+def migrate_timeline(source, target, batch_size=10000):
+	"""
+	Copies entries of the source timeline into an empty target one in
+	batches and checks both to contain the same entries. Source is kept
+	"""
+	if next(target.iter(), None):
+		raise FileExistsError(f"{target.path} is not empty")
+	
+	batch = []
+	for entry in source.iter():
+		if len(batch) >= batch_size and batch[-1].timestamp != entry.timestamp:
+			target.add_entries(batch)
+			batch = []
+		batch.append(entry)
+	if batch:
+		target.add_entries(batch)
+	
+	for source_entry, target_entry in zip_longest(
+			source.iter(), target.iter()):
+		if str(source_entry) != str(target_entry):
+			raise TimelineEntryError(f"Migrated {target.path} mismatch: "
+				f"{source_entry} != {target_entry}")
+
+def benchmark_timeline_backends(source, work_dir, appends=500):
+	"""
+	Copies the source timeline into every backend, timing bulk load,
+	appends of the last timestamps one by one (as consume_als_stat makes
+	them), reopening with end stat read and the common reads
+	"""
+	timestamps = list(source.iter_timestamp_items())
+	if len(timestamps) <= appends:
+		raise ValueError("Timeline is too short to benchmark")
+	first, last = timestamps[0][0], timestamps[-1][0]
+	
+	def _entries(items_list):
+		for timestamp, items in items_list:
+			for (legend, stat_name), value in items:
+				yield TimelineEntry(timestamp, legend, stat_name, value)
+	
+	def _time(func):
+		start = time.perf_counter()
+		func()
+		return time.perf_counter() - start
+	
+	def _drain(entries):
+		for _ in entries:
+			pass
+	
+	backends = {"memory": (MemoryTimeline, "")}
+	backends.update(get_timeline_backends())
+	results = []
+	for fmt, (backend_cls, suffix) in backends.items():
+		path = Path(work_dir) / f"benchmark{suffix}"
+		timeline = backend_cls(path)
+		
+		result = {"format": fmt}
+		result["bulk load"] = _time(lambda: timeline.add_entries(
+			_entries(timestamps[:-appends])))
+		result["append avg"] = _time(lambda: [timeline.add_entries(
+			_entries([ts])) for ts in timestamps[-appends:]]) / appends
+		if fmt != "memory":
+			timeline.close()
+			timeline = backend_cls(path)
+		result["open + end stat"] = _time(timeline.get_end_stat)
+		result["iter"] = _time(lambda: _drain(timeline.iter()))
+		result["reverse is_online"] = _time(lambda: _drain(
+			timeline.iter(reverse=True, keys=[("_", "is_online")])))
+		result["last week"] = _time(lambda: _drain(
+			timeline.iter(start=last - 7 * 86400)))
+		result["stat before"] = _time(
+			lambda: timeline.get_stat_before((first + last) // 2))
+		
+		timeline.close()
+		if fmt != "memory":
+			result["size, KB"] = sum([p.stat().st_size for p in \
+				Path(work_dir).glob("benchmark*") if p.is_file()]) // 1024
+		results.append(result)
+		for file_path in Path(work_dir).glob("benchmark*"):
+			if file_path.is_dir():
+				shutil.rmtree(file_path)
+			else:
+				file_path.unlink()
+	
+	text = f"{len(timestamps)} timestamps, timings in ms\n"
+	for result in results:
+		text += f"{result.pop('format')}:\n"
+		for name, value in result.items():
+			if name != "size, KB":
+				value = f"{value * 1000:.2f}"
+			text += f"  {name}: {value}\n"
+	return text.strip()
+
+def get_segment_period(timestamp):
+	"Timeline segments are rotated when this value changes"
+	return time.strftime(TIMELINE_SEGMENT_PERIOD, time.gmtime(timestamp))
+
+def parse_timeline_line(line, source_name, with_checkpoints=False):
+	"Parses text timeline line, returns None for invalid or skipped ones"
+	if isinstance(line, bytes):
+		line = line.decode("utf-8")
+	
+	try:
+		if line.startswith(TimelineCheckpoint.PREFIX):
+			if with_checkpoints:
+				return TimelineCheckpoint.parse(line)
+			return None
+		return TimelineEntry.parse(line)
+	except TimelineEntryError:
+		if line.strip(): # do not report empty lines
+			log(f"Skipping invalid entry in"
+				f" {source_name} timeline: '{line}'\n"
+				f"Traceback:\n{get_err()}")
+
+def parse_timeline_chunk(data, source_name, with_checkpoints=False):
+	"""
+	Parses bytes of whole text timeline lines at once. Well-formed lines
+	with integer timestamps (which is almost all of them) are parsed right
+	away, the rest goes through parse_timeline_line
+	"""
+	records = []
+	for line in data.decode("utf-8").split("\n"):
+		chunks = line.split(" ")
+		if len(chunks) == 4 and line[-1] != "\r" and chunks[0].isdigit():
+			if "%" in line:
+				chunks = [chunks[0]] + \
+					[util.semiurldecode(c) for c in chunks[1:]]
+			records.append(TimelineEntry(int(chunks[0]),
+				chunks[1], chunks[2], chunks[3]))
+			continue
+		
+		record = parse_timeline_line(line, source_name, with_checkpoints)
+		if record:
+			records.append(record)
+	
+	return records
+
+def iter_text_chunks(fh, source_name, with_checkpoints=False,
+		chunk_size=1024 * 1024):
+	"Parses text timeline file from its current position chunk by chunk"
+	rest = b""
+	while True:
+		data = fh.read(chunk_size)
+		if not data:
+			break
+		
+		data = rest + data
+		cut = data.rfind(b"\n") + 1
+		rest = data[cut:]
+		if cut:
+			yield from parse_timeline_chunk(data[:cut], source_name,
+				with_checkpoints)
+	
+	if rest:
+		yield from parse_timeline_chunk(rest, source_name, with_checkpoints)
+
+def iter_text_lines_reverse(source, source_name, size=None, stat_names=None,
+		with_checkpoints=False):
+	"""
+	Parses text timeline entries of a file or bytes in reverse order.
+	With stat_names, only the lines having one of them are parsed
+	"""
+	needles = None
+	if stat_names:
+		needles = [f" {util.semiurlencode(name)} ".encode("utf-8") for \
+			name in stat_names]
+	
+	checkpoint_prefix = TimelineCheckpoint.PREFIX.encode("utf-8")
+	for line in util.reverse_readline(source, size=size, contains=needles):
+		if line.startswith(checkpoint_prefix):
+			if with_checkpoints:
+				checkpoint = parse_timeline_line(line, source_name, True)
+				if checkpoint: yield checkpoint
+			continue
+		entry = parse_timeline_line(line, source_name)
+		if entry and (not stat_names or entry.stat_name in stat_names):
+			yield entry
+
+def from_binary_record(record):
+	if isinstance(record, binarytimeline.Checkpoint):
+		return TimelineCheckpoint(record.timestamp, record.stat)
+	return TimelineEntry(*record)
+
+def convert_timeline(text_path, binary_path):
+	"""
+	Streams text timeline into a new binary one. Source file is removed
+	only after both files are checked to contain the same entries
+	"""
+	text_path, binary_path = Path(text_path), Path(binary_path)
+	if binary_path.exists():
+		raise FileExistsError(f"{binary_path.name} already exists")
+	
+	# only the active segment is converted, archived ones stay as they are
+	def _tuples(timeline, with_checkpoints=False):
+		for record in timeline._iter_entries(with_checkpoints=with_checkpoints):
+			if isinstance(record, TimelineCheckpoint):
+				yield binarytimeline.Checkpoint(record.timestamp, record.stat)
+				continue
+			yield (int(record.timestamp), str(record.legend),
+				str(record.stat_name), str(record.stat_value))
+	
+	text_timeline = StoredTimeline(text_path)
+	tmp_path = binary_path.with_suffix(".tmp")
+	tmp_path.unlink(missing_ok=True)
+	
+	try:
+		binarytimeline.write_file(tmp_path, _tuples(text_timeline, True),
+			checkpoint_interval=TIMELINE_CHECKPOINT_INTERVAL)
+		tmp_timeline = BinaryStoredTimeline(tmp_path)
+		for text_entry, bin_entry in zip_longest(
+				_tuples(text_timeline), _tuples(tmp_timeline)):
+			if text_entry != bin_entry:
+				raise TimelineEntryError(f"Converted {text_path.name} "
+					f"mismatch: {text_entry} != {bin_entry}")
+	except Exception:
+		tmp_path.unlink(missing_ok=True)
+		raise
+	
+	filepool.singleton.close(binary_path)
+	tmp_path.replace(binary_path)
+	filepool.singleton.close(text_path)
+	text_path.unlink()
+	for suffix in (".snapshot.json", ".idx", ".sessions", ".rollups"):
+		Path(f"{text_path}{suffix}").unlink(missing_ok=True)
+
+def add_rollup_row(row, other):
+	"Adds counters of the other rollup row to the row, returns the row"
+	for field, value in other.items():
+		if isinstance(value, dict):
+			add_rollup_row(row.setdefault(field, {}), value)
+		else:
+			row[field] = row.get(field, 0) + value
+	return row
+
+def dump_rollup_row(row):
+	return json.dumps(row, ensure_ascii=False, separators=(",", ":"))
+
 def parse_timeline_key(*args):
 	if len(args) == 1:
 		if isinstance(args[0], tuple):
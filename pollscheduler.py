@@ -0,0 +1,99 @@
+import heapq, threading, time
+
+class PollScheduler():
+	"""
+	Keeps players ordered by the time their next poll is due in a heap.
+	Polled player is in flight until done (rescheduled by its own poll
+	interval), retried (put back in its previous place, which puts it
+	ahead of the players which got due after it) or failed (put back
+	retry_delay later, doubling with every failure in a row up to
+	max_retry_delay)
+	"""
+	def __init__(self, retry_delay=5, max_retry_delay=5 * 60):
+		self.retry_delay = retry_delay
+		self.max_retry_delay = max_retry_delay
+		self.lock = threading.Lock()
+		self._heap = [] # (due time, seq, uid), outdated items are skipped
+		self._due = {} # uid -> (due time, seq) of the scheduled players
+		self._in_flight = {} # uid -> (due time, seq) it was polled at
+		self._failures = {} # uid -> failed polls in a row
+		self._seq = 0 # keeps players of the same due time in FIFO order
+	
+	def sync(self, uids, now=None):
+		"New players are due right away, removed ones are forgotten"
+		now = time.time() if now is None else now
+		uids = list(uids)
+		known_uids = set(uids)
+		with self.lock:
+			for uid in list(self._due):
+				if uid not in known_uids:
+					self._due.pop(uid)
+			for uid in list(self._in_flight):
+				if uid not in known_uids:
+					self._in_flight.pop(uid)
+			for uid in list(self._failures):
+				if uid not in known_uids:
+					self._failures.pop(uid)
+			for uid in uids:
+				if uid not in self._due and uid not in self._in_flight:
+					self._push(uid, now)
+	
+	def pop(self, now=None):
+		"Returns uid of the most overdue player, which is now in flight"
+		now = time.time() if now is None else now
+		with self.lock:
+			while self._heap:
+				due, seq, uid = self._heap[0]
+				if self._due.get(uid) != (due, seq):
+					heapq.heappop(self._heap) # rescheduled or removed
+					continue
+				if due > now:
+					return None
+				
+				heapq.heappop(self._heap)
+				self._in_flight[uid] = self._due.pop(uid)
+				return uid
+	
+	def done(self, uid, due):
+		with self.lock:
+			self._failures.pop(uid, None)
+			if self._in_flight.pop(uid, None) is not None:
+				self._push(uid, due)
+	
+	def retry(self, uid):
+		"Puts player in flight back in its previous place"
+		with self.lock:
+			due_seq = self._in_flight.pop(uid, None)
+			if due_seq is not None:
+				self._due[uid] = due_seq
+				heapq.heappush(self._heap, (*due_seq, uid))
+	
+	def fail(self, uid, now=None):
+		"Puts player in flight back with a backoff from its previous place"
+		now = time.time() if now is None else now
+		with self.lock:
+			due_seq = self._in_flight.pop(uid, None)
+			if due_seq is None:
+				return
+			failures = self._failures.get(uid, 0)
+			self._failures[uid] = failures + 1
+			self._push(uid, max(due_seq[0], now) + \
+				min(2 ** failures * self.retry_delay, self.max_retry_delay))
+	
+	def get_lag(self, now=None):
+		"Returns (overdue players count, seconds the oldest one is overdue)"
+		now = time.time() if now is None else now
+		with self.lock:
+			overdue = [due for due, _ in self._due.values() if due <= now]
+			return len(overdue), now - min(overdue) if overdue else 0
+	
+	def _push(self, uid, due):
+		self._seq += 1
+		self._due[uid] = (due, self._seq)
+		heapq.heappush(self._heap, (due, self._seq, uid))
+		
+		# outdated items are dropped once they take most of the heap
+		if len(self._heap) > 2 * len(self._due) + 64:
+			self._heap = [(d, seq, u) for d, seq, u in self._heap if \
+				self._due.get(u) == (d, seq)]
+			heapq.heapify(self._heap)
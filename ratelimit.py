@@ -0,0 +1,128 @@
+import threading, time
+from const import *
+
+class TokenBucket():
+	"""
+	Lets through rate requests per second on average and up to burst of
+	them at once. Callers reserve their tokens under the lock and wait
+	outside of it, so waiting callers are let through in order of calling.
+	Throttling reported by the server pauses the bucket for its retry
+	after time and halves the rate, which then grows back by a tenth of
+	the configured rate per request let through without throttling
+	"""
+	def __init__(self, name, rate, burst=1, min_rate_share=0.1):
+		self.name = name
+		self.max_rate = self.rate = float(rate)
+		self.min_rate = self.max_rate * min_rate_share
+		self.burst = max(1, burst)
+		self.lock = threading.Lock()
+		
+		self._tokens = float(self.burst)
+		self._refill_time = time.time()
+		self._paused_until = 0
+		
+		self.acquired = 0
+		self.rejected = 0
+		self.throttled = 0
+		self.waited = 0 # requests which had to wait
+		self.wait_time = 0
+		self.max_wait_time = 0
+	
+	def acquire(self, tokens=1, block=True, timeout=None):
+		"""
+		Takes the tokens, waiting for them if block is set, returns whether
+		they were taken. Tokens are not taken if the wait would exceed the
+		timeout
+		"""
+		with self.lock:
+			now = time.time()
+			self._refill(now)
+			wait = max(0, (tokens - self._tokens) / self.rate,
+				self._paused_until - now)
+			if wait and (not block or (timeout is not None and \
+			wait > timeout)):
+				self.rejected += 1
+				return False
+			
+			self._tokens -= tokens # goes below zero for the waiting callers
+			self.acquired += 1
+			if wait:
+				self.waited += 1
+				self.wait_time += wait
+				self.max_wait_time = max(self.max_wait_time, wait)
+		
+		if wait:
+			time.sleep(wait)
+		return True
+	
+	def report_throttled(self, retry_after=None):
+		"Server refused the request for exceeding its rate limit"
+		with self.lock:
+			now = time.time()
+			self._refill(now)
+			self.throttled += 1
+			self.rate = max(self.min_rate, self.rate / 2)
+			self._paused_until = max(self._paused_until,
+				now + (retry_after if retry_after else 1 / self.rate))
+			self._tokens = min(self._tokens, 0)
+	
+	def report_success(self):
+		with self.lock:
+			if self.rate < self.max_rate:
+				self._refill(time.time())
+				self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+	
+	def get_stats(self):
+		with self.lock:
+			return {
+				"rate": round(self.rate, 3),
+				"max_rate": self.max_rate,
+				"burst": self.burst,
+				"acquired": self.acquired,
+				"rejected": self.rejected,
+				"throttled": self.throttled,
+				"waited": self.waited,
+				"avg_wait_time": round(self.wait_time / self.waited, 3) \
+					if self.waited else 0,
+				"max_wait_time": round(self.max_wait_time, 3)
+			}
+	
+	def _refill(self, now):
+		self._tokens = min(self.burst,
+			self._tokens + (now - self._refill_time) * self.rate)
+		self._refill_time = now
+
+class RateLimiter():
+	"Named token buckets, see TokenBucket"
+	def __init__(self, buckets):
+		self.buckets = {}
+		for name, (rate, burst) in buckets.items():
+			self.add_bucket(name, rate, burst)
+	
+	def add_bucket(self, name, rate, burst=1):
+		self.buckets[name] = TokenBucket(name, rate, burst)
+		return self.buckets[name]
+	
+	def acquire(self, name, tokens=1, block=True, timeout=None):
+		return self.buckets[name].acquire(tokens, block, timeout)
+	
+	def report_throttled(self, name, retry_after=None):
+		self.buckets[name].report_throttled(retry_after)
+	
+	def report_success(self, name):
+		self.buckets[name].report_success()
+	
+	def get_stats(self):
+		return {name: b.get_stats() for name, b in self.buckets.items()}
+
+def parse_retry_after(value):
+	"Seconds of Retry-After header value, None if it's missing or a date"
+	try:
+		return max(0, float(value))
+	except (TypeError, ValueError):
+		return None
+
+singleton = RateLimiter({
+	"als_api": (ALS_RATE_LIMIT, ALS_RATE_BURST),
+	"tg_api": (TG_RATE_LIMIT, TG_RATE_BURST)
+})
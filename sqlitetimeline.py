@@ -0,0 +1,177 @@
+"""
+SQLite timeline storage
+
+Entries are kept in insertion order (rowid), which is the timeline order,
+and refer to the keys table by id. Keys table also holds the last value of
+each key, so end stat is read without scanning the entries, and stat before
+any moment takes one index lookup per key. Database runs in WAL mode and
+every iteration reads through its own connection, so reads neither block
+appends nor see half-written batches
+"""
+
+import sqlite3, threading
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+	id INTEGER PRIMARY KEY,
+	legend TEXT NOT NULL,
+	stat_name TEXT NOT NULL,
+	end_value TEXT,
+	UNIQUE (legend, stat_name)
+);
+CREATE TABLE IF NOT EXISTS entries (
+	timestamp INTEGER NOT NULL,
+	key_id INTEGER NOT NULL,
+	value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp);
+CREATE INDEX IF NOT EXISTS entries_key ON entries (key_id, timestamp);
+"""
+
+class SqliteTimelineDb():
+	"""
+	Appends and reads (timestamp, legend, stat_name, value) records.
+	synchronous is SQLite PRAGMA synchronous value for the appends
+	"""
+	def __init__(self, path, synchronous="NORMAL", fetch_size=1024):
+		self.path = Path(path)
+		self.synchronous = synchronous
+		self.fetch_size = fetch_size
+		self.lock = threading.Lock()
+		self._conn = None # appends connection
+		self._key_ids = None # (legend, stat_name) -> key id
+	
+	def append(self, records):
+		"Appends the records in a single transaction"
+		with self.lock:
+			conn = self._get_conn()
+			try:
+				with conn:
+					self._append(conn, records)
+			except Exception:
+				self._key_ids = None # ids of the rolled back keys
+				raise
+	
+	def _append(self, conn, records):
+		if self._key_ids is None:
+			self._key_ids = {(legend, stat_name): key_id for \
+				key_id, legend, stat_name in conn.execute(
+					"SELECT id, legend, stat_name FROM keys")}
+		
+		rows, end_values = [], {}
+		for timestamp, legend, stat_name, value in records:
+			key_id = self._key_ids.get((legend, stat_name))
+			if key_id is None:
+				key_id = conn.execute(
+					"INSERT INTO keys (legend, stat_name) VALUES (?, ?)",
+					(legend, stat_name)).lastrowid
+				self._key_ids[(legend, stat_name)] = key_id
+			rows.append((timestamp, key_id, value))
+			end_values[key_id] = value
+		
+		conn.executemany("INSERT INTO entries VALUES (?, ?, ?)", rows)
+		conn.executemany("UPDATE keys SET end_value = ? WHERE id = ?",
+			[(value, key_id) for key_id, value in end_values.items()])
+	
+	def iter(self, reverse=False, start=None, end=None, stat_names=None,
+			keys=None):
+		"""
+		Entries in insertion order, as text and binary timelines read them
+		even if the clock went back. keys filter is a list of (legend,
+		stat_name) tuples, empty stat_names do not filter, as in Timeline.iter
+		"""
+		if not self.path.exists():
+			return
+		
+		conn = self._connect()
+		try:
+			conditions, params = [], []
+			if stat_names or keys is not None:
+				key_ids = self._find_key_ids(conn, stat_names, keys)
+				if not key_ids:
+					return
+				conditions.append(
+					f"e.key_id IN ({', '.join('?' * len(key_ids))})")
+				params += key_ids
+			if start is not None:
+				conditions.append("e.timestamp >= ?")
+				params.append(start)
+			if end is not None:
+				conditions.append("e.timestamp <= ?")
+				params.append(end)
+			
+			where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+			order = "DESC" if reverse else "ASC"
+			cursor = conn.execute(
+				"SELECT e.timestamp, k.legend, k.stat_name, e.value "
+				f"FROM entries e JOIN keys k ON k.id = e.key_id {where} "
+				f"ORDER BY e.rowid {order}", params)
+			
+			while True:
+				rows = cursor.fetchmany(self.fetch_size)
+				if not rows:
+					break
+				yield from rows
+		finally:
+			conn.close()
+	
+	def get_end_stat(self):
+		return self._read_stat("SELECT legend, stat_name, end_value "
+			"FROM keys WHERE end_value IS NOT NULL ORDER BY id")
+	
+	def get_stat_until(self, moment, inclusive=True):
+		"Stat as it was right after the moment, or before it if not inclusive"
+		sign = "<=" if inclusive else "<"
+		return self._read_stat("SELECT legend, stat_name, ("
+			"SELECT value FROM entries WHERE key_id = keys.id AND "
+			f"timestamp {sign} ? ORDER BY timestamp DESC, rowid DESC LIMIT 1"
+			") AS value FROM keys WHERE value IS NOT NULL ORDER BY id",
+			(moment,))
+	
+	def get_size(self):
+		"Size of the database along with its WAL file"
+		wal_path = Path(f"{self.path}-wal")
+		return sum([p.stat().st_size for p in (self.path, wal_path) if \
+			p.exists()])
+	
+	def close(self):
+		with self.lock:
+			if self._conn:
+				self._conn.close()
+			self._conn, self._key_ids = None, None
+	
+	def _read_stat(self, query, params=()):
+		if not self.path.exists():
+			return {}
+		
+		conn = self._connect()
+		try:
+			return {(legend, stat_name): value for legend, stat_name, value \
+				in conn.execute(query, params)}
+		finally:
+			conn.close()
+	
+	def _find_key_ids(self, conn, stat_names, keys):
+		key_ids = []
+		for key_id, legend, stat_name in conn.execute(
+				"SELECT id, legend, stat_name FROM keys"):
+			if stat_names and stat_name not in stat_names:
+				continue
+			if keys is not None and (legend, stat_name) not in keys:
+				continue
+			key_ids.append(key_id)
+		return key_ids
+	
+	def _get_conn(self):
+		if self._conn is None:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			self._conn = self._connect()
+			self._conn.executescript(SCHEMA)
+		return self._conn
+	
+	def _connect(self):
+		conn = sqlite3.connect(self.path, check_same_thread=False)
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute(f"PRAGMA synchronous={self.synchronous}")
+		return conn
@@ -0,0 +1,102 @@
+import os, sys, json, random, tempfile
+from pathlib import Path
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# settings required by const, real ones (e.g. from .env) are kept
+for name, value in {
+	"PATHY_DAEMON_AUTHKEY": "test",
+	"PATHY_BOT_TOKEN": "test",
+	"PATHY_BOT_USERNAME": "test",
+	"PATHY_WEBAPI_SECRET": "test",
+	"PATHY_MOZAM_API_KEY": "test",
+	"PATHY_DEBUG_CHAT_ID": "1",
+	"PATHY_ASL_CHAT_ID": "1",
+	"PATHY_DL_PROXY_CHAT_ID": "1",
+	"PATHY_GDRIVE_ASSETS_ID": "test",
+	"PATHY_EXTERNAL_HOST": "localhost"
+}.items():
+	os.environ.setdefault(name, value)
+
+# data written by the tests never gets into the real data dirs
+_data_dir = Path(tempfile.mkdtemp(prefix="pathy_tests_"))
+os.environ["PATHY_TIMELINE_DIR"] = str(_data_dir / "timeline")
+os.environ["PATHY_LOGS_DIR"] = str(_data_dir / "logs")
+os.environ["PATHY_DAEMON_STATE"] = str(_data_dir / "state.json")
+os.environ["PATHY_DAEMON_STATE_COPY"] = str(_data_dir / "state.copy.json")
+os.environ["PATHY_DAEMON_LOCKFILE"] = str(_data_dir / "parent.lock")
+os.environ["PATHY_HASHMAPDB_DIR"] = str(_data_dir / "hashmapdb")
+(_data_dir / "timeline").mkdir()
+
+def _write_service_cred(path):
+	"Fake service account, which gdrive and youtube load on import"
+	key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+	path.write_text(json.dumps({
+		"type": "service_account",
+		"project_id": "test",
+		"private_key_id": "test",
+		"private_key": key.private_bytes(serialization.Encoding.PEM,
+			serialization.PrivateFormat.PKCS8,
+			serialization.NoEncryption()).decode(),
+		"client_email": "test@test.iam.gserviceaccount.com",
+		"client_id": "1",
+		"token_uri": "https://oauth2.googleapis.com/token"
+	}), encoding="utf-8")
+	return path
+
+if not os.environ.get("PATHY_GDRIVE_SERVICE_CRED"):
+	os.environ["PATHY_GDRIVE_SERVICE_CRED"] = \
+		str(_write_service_cred(_data_dir / "gdrive_service_cred.json"))
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+	sys.path.append(str(ROOT_DIR))
+
+import pytest
+import tgapi, filepool
+
+@pytest.fixture(autouse=True)
+def tg_messages(monkeypatch):
+	"Messages which would have been sent to telegram (e.g. error logs)"
+	messages = []
+	monkeypatch.setattr(tgapi, "send_message",
+		lambda chat_id, text="", **kwargs: messages.append(text))
+	return messages
+
+@pytest.fixture(autouse=True)
+def close_files():
+	yield
+	filepool.singleton.close_all()
+
+@pytest.fixture
+def make_records():
+	"""
+	Returns function generating n (timestamp, legend, stat_name, value)
+	records of a simulated player, a few records per timestamp
+	"""
+	def _make(n, seed=1, start=1_600_000_000):
+		rnd = random.Random(seed)
+		legends = ["Wraith", "Bloodhound", "Pathfinder"]
+		timestamp = start
+		records = []
+		is_online = is_in_match = 0
+		while len(records) < n:
+			timestamp += rnd.choice([1, 5, 30, 600, 3600])
+			legend = rnd.choice(legends)
+			if rnd.random() < 0.3:
+				is_online = 1 - is_online
+				records.append((timestamp, "_", "is_online", str(is_online)))
+			if is_online and rnd.random() < 0.5:
+				is_in_match = 1 - is_in_match
+				records.append((timestamp, "_", "is_in_match",
+					str(is_in_match)))
+			records.append((timestamp, "_", "legend", legend))
+			records.append((timestamp, legend, "tracker_kills",
+				str(rnd.randint(0, 5000))))
+			if rnd.random() < 0.1:
+				records.append((timestamp, legend, "tracker_damage", "$null"))
+			if rnd.random() < 0.3:
+				records.append((timestamp, "_", "level",
+					f"{rnd.randint(1, 500)}.{rnd.randint(0, 99):02}"))
+		return records[:n]
+	return _make
@@ -0,0 +1,177 @@
+import copy
+import random
+import pytest
+import pathylib
+from pathylib import TimelineEntry
+
+LEGENDS = ["Wraith", "Bloodhound", "Pathfinder"]
+
+def _als_stats(n, seed=1):
+	"ALS player stats of a player going online, into matches and back"
+	rnd = random.Random(seed)
+	online = in_match = 0
+	level, score, legend = 100.0, 5000, "Wraith"
+	kills = {legend: 100 for legend in LEGENDS}
+	stats = []
+	for i in range(n):
+		r = rnd.random()
+		if not online:
+			online = int(r < 0.3)
+		elif in_match and r < 0.2:
+			in_match, level = 0, level + 0.37
+			kills[legend] += rnd.randint(0, 5)
+			score += rnd.randint(-50, 150)
+		elif not in_match:
+			if r < 0.3: in_match = 1
+			elif r < 0.4: online = 0
+			elif r < 0.5: legend = rnd.choice(LEGENDS)
+		
+		trackers = [{"key": "kills", "value": kills[legend], "global": False}]
+		if legend != "Pathfinder" or rnd.random() < 0.5: # unequipped
+			trackers.append({"key": "damage", "value": kills[legend] * 150,
+				"global": False})
+		if rnd.random() < 0.05:
+			trackers.append({"key": "event_kills", "value": i,
+				"global": True})
+		stats.append({
+			"global": {"level": int(level),
+				"toNextLevelPercent": int(level % 1 * 100),
+				"levelPrestige": 1, "internalUpdateCount": 0,
+				"name": "Some Player",
+				"bans": {"isActive": False, "last_banReason": "NONE",
+					"remainingSeconds": 0},
+				"rank": {"rankScore": score, "rankDiv": score // 250 % 4,
+					"ladderPosPlatform": -1, "rankName": "Gold"}},
+			"realtime": {"currentState": "inMatch" if in_match else \
+				"inLobby" if online else "offline", "isInGame": in_match,
+				"isOnline": online, "partyFull": 0},
+			"legends": {"selected": {"LegendName": legend, "data": trackers}}
+		})
+	return stats
+
+@pytest.fixture
+def clock(monkeypatch):
+	now = [1_600_000_000]
+	monkeypatch.setattr(pathylib.time, "time", lambda: now[0])
+	return now
+
+def test_same_fingerprint_makes_no_diff(clock):
+	timeline = pathylib.MemoryTimeline()
+	prev, same = None, 0
+	for stat in _als_stats(500):
+		clock[0] += 30
+		fingerprint = pathylib.get_als_stat_fingerprint(stat)
+		diff = timeline.consume_als_stat(stat)
+		if fingerprint == prev:
+			same += 1
+			assert diff == {}
+		prev = fingerprint
+	assert same > 100
+
+@pytest.mark.parametrize("path, value", [
+	(["global", "level"], 101),
+	(["global", "toNextLevelPercent"], 99),
+	(["global", "levelPrestige"], 2),
+	(["global", "internalUpdateCount"], 1),
+	(["global", "name"], "Other Player"),
+	(["global", "bans", "isActive"], True),
+	(["global", "bans", "last_banReason"], "CHEATING"),
+	(["global", "bans", "remainingSeconds"], 10),
+	(["global", "rank", "rankScore"], 1),
+	(["global", "rank", "rankDiv"], 9),
+	(["global", "rank", "ladderPosPlatform"], 1),
+	(["global", "rank", "rankName"], "Master"),
+	(["realtime", "currentState"], "inMatch"),
+	(["realtime", "isInGame"], 1),
+	(["realtime", "isOnline"], 1),
+	(["realtime", "partyFull"], 1),
+	(["legends", "selected", "LegendName"], "Octane"),
+	(["legends", "selected", "data", 0, "value"], 1),
+	(["legends", "selected", "data", 0, "key"], "wins"),
+	(["legends", "selected", "data", 0, "global"], True)
+])
+def test_fingerprint_changes_with_read_fields(clock, path, value):
+	stat = _als_stats(1)[0]
+	stat["realtime"].update(currentState="offline", isInGame=0, isOnline=0)
+	changed = copy.deepcopy(stat)
+	target = changed
+	for key in path[:-1]:
+		target = target[key]
+	target[path[-1]] = value
+	assert pathylib.get_als_stat_fingerprint(changed) != \
+		pathylib.get_als_stat_fingerprint(stat)
+	
+	timeline = pathylib.MemoryTimeline()
+	timeline.consume_als_stat(stat)
+	assert timeline.consume_als_stat(changed)
+
+def test_update_skips_unchanged_response(clock, monkeypatch):
+	player = pathylib.TrackedPlayer({"uid": "1"})
+	consumed = []
+	consume_als_stat = pathylib.TimelineBackend.consume_als_stat
+	def _consume_als_stat(timeline, stat):
+		consumed.append(timeline)
+		return consume_als_stat(timeline, stat)
+	monkeypatch.setattr(pathylib.TimelineBackend, "consume_als_stat",
+		_consume_als_stat)
+	
+	stat = _als_stats(1)[0]
+	for _ in range(3):
+		player.update(stat)
+	assert consumed == [player.timeline]
+	
+	changed = copy.deepcopy(stat)
+	changed["global"]["level"] += 1
+	player.update(changed)
+	assert len(consumed) == 2 and player.get_stat("level") == "101.0"
+	
+	player.timeline = pathylib.open_stored_timeline("1") # reopened
+	player.update(changed)
+	assert consumed[-1] is player.timeline
+
+def _tracker_keys(end_stat, legend):
+	return [stat_name for (key_legend, stat_name), value in \
+		end_stat.items() if key_legend == legend and \
+		stat_name.startswith("tracker_") and value != "$null"]
+
+@pytest.mark.parametrize("timeline_format", ["text", "binary", "sqlite",
+	"memory"])
+def test_tracker_index_follows_end_stat(clock, tmp_path, timeline_format):
+	if timeline_format == "memory":
+		open_timeline = lambda: timeline
+		timeline = pathylib.MemoryTimeline()
+	else:
+		timeline_cls, suffix = \
+			pathylib.get_timeline_backends()[timeline_format]
+		open_timeline = lambda: timeline_cls(tmp_path / f"player{suffix}")
+		timeline = open_timeline()
+	
+	for i, stat in enumerate(_als_stats(300)):
+		clock[0] += 30
+		timeline.consume_als_stat(stat)
+		if i % 50 == 0: # the index is made on request, then kept up to date
+			timeline.get_tracker_keys("Wraith")
+		if i % 100 == 99:
+			timeline = open_timeline()
+	
+	end_stat = timeline.get_end_stat()
+	for legend in LEGENDS + ["_"]:
+		assert sorted(timeline.get_tracker_keys(legend)) == \
+			sorted(_tracker_keys(end_stat, legend))
+	assert ("Pathfinder", "tracker_damage") in end_stat
+
+def test_unequipped_tracker_is_nullified_once(clock):
+	timeline = pathylib.MemoryTimeline()
+	stat = _als_stats(1)[0]
+	stat["legends"]["selected"]["LegendName"] = "Pathfinder"
+	timeline.consume_als_stat(stat)
+	assert "tracker_damage" in timeline.get_tracker_keys("Pathfinder")
+	
+	del stat["legends"]["selected"]["data"][1]
+	clock[0] += 30
+	diff = timeline.consume_als_stat(stat)
+	assert diff == {("Pathfinder", "tracker_damage"): (str(100 * 150),
+		"$null")}
+	assert "tracker_damage" not in timeline.get_tracker_keys("Pathfinder")
+	clock[0] += 30
+	assert timeline.consume_als_stat(stat) == {}
@@ -0,0 +1,90 @@
+import pytest
+import alsapi
+from circuitbreaker import CircuitOpenError
+
+class _Bridge():
+	"""
+	Stub of alsapi._send_request, failing batches with any of broken uids and
+	leaving missing uids out of responses of several players
+	"""
+	def __init__(self, broken=(), missing=(), empty=False):
+		self.broken, self.missing = set(broken), set(missing)
+		self.empty = empty
+		self.requests = []
+	
+	def send_request(self, url, validate_fn=None, retries=3):
+		uids = url.split("uid=")[1].split("&")[0].split(",")
+		self.requests.append(uids)
+		if self.broken & set(uids):
+			raise alsapi.AlsApiError("broken player")
+		if self.empty:
+			return []
+		return [{"global": {"uid": int(uid)}, "realtime": {}} \
+			for uid in uids if len(uids) == 1 or uid not in self.missing]
+
+@pytest.fixture
+def bridge(monkeypatch):
+	def _make(**kwargs):
+		bridge = _Bridge(**kwargs)
+		monkeypatch.setattr(alsapi, "_send_request", bridge.send_request)
+		return bridge
+	monkeypatch.setattr(alsapi, "ALS_BATCH_SIZE", 10)
+	monkeypatch.setattr(alsapi, "_batch_disabled_until", 0)
+	monkeypatch.setattr(alsapi, "log", lambda *args, **kwargs: None)
+	return _make
+
+def test_batches(bridge):
+	api = bridge()
+	stats = alsapi.get_players_stat(list(range(25)))
+	assert set(stats) == {str(uid) for uid in range(25)}
+	assert [len(uids) for uids in api.requests] == [10, 10, 5]
+
+def test_failed_batch_is_bisected(bridge):
+	api = bridge(broken={"3"})
+	stats = alsapi.get_players_stat(list(range(10)))
+	assert set(stats) == {str(uid) for uid in range(10)} - {"3"}
+	# 9 requests halving down to "3" instead of 10 more one by one
+	assert api.requests[1:-1] == [["0", "1", "2", "3", "4"], ["0", "1"],
+		["2", "3", "4"], ["2"], ["3", "4"], ["3"], ["4"]]
+	assert len(api.requests) == 9
+	assert alsapi._batch_disabled_until == 0
+
+def test_missing_players_are_refetched_one_by_one(bridge):
+	api = bridge(missing={"1", "7"})
+	stats = alsapi.get_players_stat(list(range(10)))
+	assert set(stats) == {str(uid) for uid in range(10)}
+	assert api.requests[1:] == [["1"], ["7"]]
+
+def test_missing_players_of_bisected_batch_are_refetched(bridge):
+	api = bridge(broken={"3"}, missing={"0", "8"})
+	stats = alsapi.get_players_stat(list(range(10)))
+	assert set(stats) == {str(uid) for uid in range(10)} - {"3"}
+	assert api.requests[-2:] == [["0"], ["8"]]
+
+def test_all_failed_raises(bridge):
+	api = bridge(broken={"0", "1"})
+	with pytest.raises(alsapi.AlsApiError):
+		alsapi.get_players_stat([0, 1])
+	assert api.requests == [["0", "1"], ["0"], ["1"]]
+	assert alsapi._batch_disabled_until == 0
+
+def test_open_circuit_is_not_bisected(bridge, monkeypatch):
+	api = bridge()
+	def _send_request(url, validate_fn=None, retries=3):
+		api.requests.append(url)
+		raise CircuitOpenError("ALS API bridge", 10)
+	monkeypatch.setattr(alsapi, "_send_request", _send_request)
+	with pytest.raises(CircuitOpenError):
+		alsapi.get_players_stat(list(range(10)))
+	assert len(api.requests) == 1
+
+def test_empty_response_disables_batches(bridge):
+	api = bridge(empty=True)
+	assert alsapi.get_players_stat(list(range(4))) == {}
+	assert len(api.requests) == 1
+	assert alsapi._batch_disabled_until > 0
+	
+	api.empty = False
+	stats = alsapi.get_players_stat([1, 2])
+	assert set(stats) == {"1", "2"}
+	assert api.requests[1:] == [["1"], ["2"]]
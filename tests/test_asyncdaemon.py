@@ -0,0 +1,72 @@
+import threading
+import pytest
+import pathylib
+import asyncdaemon
+
+class _Conn():
+	def __init__(self):
+		self.sent = []
+		self.closed = False
+	
+	def send(self, resp):
+		self.sent.append((resp, threading.current_thread().name))
+	
+	def close(self):
+		self.closed = True
+
+@pytest.fixture
+def runtime():
+	daemon = pathylib.PathyDaemon()
+	daemon.main_worker.start()
+	runtime = asyncdaemon.AsyncRuntime(daemon, 2)
+	yield runtime
+	daemon.main_worker.stop(drop_pending=True)
+	runtime.io_executor.shutdown()
+	runtime.loop.close()
+
+def _serve(runtime, msg, args=None):
+	conn = _Conn()
+	runtime.loop.run_until_complete(runtime.serve_cmd(conn, msg, args or {}))
+	assert conn.closed
+	return conn.sent
+
+def test_commands_are_handled_on_main_worker(runtime, monkeypatch):
+	daemon = runtime.daemon
+	monkeypatch.setattr(daemon, "handle_cmd",
+		lambda msg, args: f"{msg} {threading.current_thread().name}")
+	
+	[(resp, sender)] = _serve(runtime, "players")
+	assert resp == "players main"
+	assert sender.startswith("async_io")
+	[(resp, _)] = _serve(runtime, "status")
+	assert resp.startswith("status async_io")
+
+def test_busy_main_worker_times_out(runtime, monkeypatch):
+	daemon = runtime.daemon
+	monkeypatch.setattr(asyncdaemon, "DAEMON_CMD_TIMEOUT", 0.1)
+	handled = []
+	monkeypatch.setattr(daemon, "handle_cmd",
+		lambda msg, args: handled.append(msg))
+	release = threading.Event()
+	daemon.main_worker.task(release.wait).run(5)
+	
+	[(resp, _)] = _serve(runtime, "players")
+	assert resp == "Timed out waiting for the daemon, try again later"
+	release.set()
+	daemon.main_worker.task(lambda: None, sync=True).run()
+	assert not handled # cancelled while queued
+
+def test_direct_commands_do_not_wait_for_main_worker(runtime, monkeypatch):
+	daemon = runtime.daemon
+	monkeypatch.setattr(asyncdaemon, "DAEMON_CMD_TIMEOUT", 0.1)
+	daemon.run_id = "abc"
+	updates = []
+	monkeypatch.setattr(daemon, "handle_tg_upd", updates.append)
+	release = threading.Event()
+	daemon.main_worker.task(release.wait).run(5)
+	
+	assert _serve(runtime, "run_id")[0][0] == "abc"
+	assert _serve(runtime, "tgupd", {"upd_body": "upd"})[0][0] == "DONE"
+	release.set()
+	daemon.main_worker.task(lambda: None, sync=True).run()
+	assert updates == ["upd"] # queued, not dropped
@@ -0,0 +1,118 @@
+import pytest
+import pathylib
+from pathylib import TimelineEntry
+
+@pytest.fixture(params=["text", "binary", "sqlite", "memory"])
+def backend(request, tmp_path, make_records):
+	"Timeline of the format with 1500 records, reopened, and the records"
+	records = make_records(1500)
+	if request.param == "memory":
+		timeline = pathylib.MemoryTimeline()
+		reopen = lambda: timeline
+	else:
+		timeline_cls, suffix = pathylib.get_timeline_backends()[request.param]
+		path = tmp_path / f"player{suffix}"
+		timeline = timeline_cls(path)
+		reopen = lambda: timeline_cls(path)
+	for i in range(0, len(records), 100):
+		timeline.add_entries([TimelineEntry(*r) for r in records[i:i + 100]])
+	yield reopen(), records
+	if request.param == "sqlite":
+		timeline.close()
+
+def _as_records(entries):
+	return [(e.timestamp, e.legend, e.stat_name, e.stat_value) for \
+		e in entries]
+
+def _stat(records):
+	return {(legend, stat_name): value for _, legend, stat_name, value in \
+		records}
+
+@pytest.mark.parametrize("stat_names, keys", [
+	(None, None),
+	([], None),
+	(["is_online", "legend"], None),
+	(["not_a_stat"], None),
+	(None, [("_", "is_online"), ("Wraith", "tracker_kills")]),
+	(None, []),
+	(["legend"], [("_", "is_online"), ("_", "legend")])
+])
+def test_iter_matches_records(backend, stat_names, keys):
+	timeline, records = backend
+	timestamps = sorted({r[0] for r in records})
+	for start, end in [(None, None), (timestamps[100], timestamps[400])]:
+		expected = [r for r in records if \
+			(start is None or r[0] >= start) and \
+			(end is None or r[0] <= end) and \
+			(not stat_names or r[2] in stat_names) and \
+			(keys is None or r[1:3] in keys)]
+		kwargs = dict(start=start, end=end, stat_names=stat_names, keys=keys)
+		assert _as_records(timeline.iter(**kwargs)) == expected
+		assert _as_records(timeline.iter(reverse=True, **kwargs)) == \
+			expected[::-1]
+
+def test_stats_match_records(backend):
+	timeline, records = backend
+	assert timeline.get_end_stat() == _stat(records)
+	for moment in sorted({r[0] for r in records})[::41]:
+		assert timeline.get_stat_at(moment) == \
+			_stat([r for r in records if r[0] <= moment])
+		assert timeline.get_stat_before(moment) == \
+			_stat([r for r in records if r[0] < moment])
+
+def test_sub_timeline_matches_records(backend):
+	timeline, records = backend
+	timestamps = sorted({r[0] for r in records})
+	start, end = timestamps[200], timestamps[300]
+	sub_timeline = timeline.get_sub_timeline(start, end)
+	assert sub_timeline.start_stat == _stat([r for r in records if \
+		r[0] < start])
+	assert _as_records(sub_timeline.iter()) == [r for r in records if \
+		start <= r[0] <= end]
+	assert timeline.get_sub_timeline(timestamps[-1] + 1,
+		timestamps[-1] + 10) is None
+
+@pytest.mark.parametrize("format", ["text", "binary", "sqlite"])
+def test_skewed_timeline_reads_in_insertion_order(tmp_path, make_records,
+		format):
+	records = make_records(1000)
+	records = records[:500] + [(ts - 20000, *rest) for ts, *rest in \
+		records[500:]] # clock went back
+	timeline_cls, suffix = pathylib.get_timeline_backends()[format]
+	timeline = timeline_cls(tmp_path / f"player{suffix}")
+	timeline.add_entries([TimelineEntry(*r) for r in records])
+	
+	timestamps = sorted({r[0] for r in records})
+	n = len(timestamps)
+	start, end = timestamps[n // 5], timestamps[n * 4 // 5]
+	assert _as_records(timeline.iter()) == records
+	assert _as_records(timeline.iter(reverse=True)) == records[::-1]
+	assert _as_records(timeline.iter(start=start, end=end)) == \
+		[r for r in records if start <= r[0] <= end]
+	assert timeline.get_end_stat() == _stat(records)
+	timeline.close()
+
+def test_sqlite_reads_see_whole_batches(tmp_path):
+	timeline = pathylib.SqliteTimeline(tmp_path / "player.sqlite")
+	timeline.add_entries([TimelineEntry(1, "_", "level", "1")])
+	counts, errors = [], []
+	
+	def _read():
+		try:
+			reader = pathylib.SqliteTimeline(timeline.path)
+			for _ in range(50):
+				counts.append(len(list(reader.iter(stat_names=["kills"]))))
+		except Exception as e:
+			errors.append(e)
+	threads = [pathylib.threading.Thread(target=_read) for _ in range(3)]
+	for thread in threads:
+		thread.start()
+	for i in range(100):
+		timeline.add_entries([TimelineEntry(i + 2, legend, "kills", str(i)) \
+			for legend in ("Wraith", "Bloodhound", "Pathfinder")])
+	for thread in threads:
+		thread.join()
+	timeline.close()
+	
+	assert not errors and len(counts) == 150
+	assert all(count % 3 == 0 for count in counts)
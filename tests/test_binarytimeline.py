@@ -0,0 +1,112 @@
+import struct
+import pytest
+import binarytimeline
+from binarytimeline import BinaryTimelineFile, Checkpoint, MAGIC
+
+VALUES = ["0", "-1", "42", "-0", "007", "1.50", "-0.25", "0.0", "-0.0",
+	"1e5", "$null", "", "Bloodhound", "with space", "юнікод", "9" * 30]
+
+def _batches(records):
+	"Splits records into batches of the same timestamp"
+	batches = []
+	for record in records:
+		if batches and batches[-1][0][0] == record[0]:
+			batches[-1].append(record)
+		else:
+			batches.append([record])
+	return batches
+
+def test_values_round_trip(tmp_path):
+	records = [(1000 + i, "_", f"stat_{i % 3}", value) for \
+		i, value in enumerate(VALUES)]
+	file = BinaryTimelineFile(tmp_path / "t.ptl")
+	file.append(records)
+	
+	assert list(BinaryTimelineFile(tmp_path / "t.ptl").iter()) == records
+
+def test_appended_blocks_round_trip(tmp_path, make_records):
+	records = make_records(1000)
+	file = BinaryTimelineFile(tmp_path / "t.ptl")
+	for batch in _batches(records):
+		file.append(batch)
+	
+	reopened = BinaryTimelineFile(tmp_path / "t.ptl")
+	assert list(reopened.iter()) == records
+	assert list(reopened.iter(reverse=True)) == records[::-1]
+
+def test_write_file_round_trip(tmp_path, make_records):
+	records = make_records(1000)
+	count = binarytimeline.write_file(tmp_path / "t.ptl", records,
+		block_entries=16, checkpoint_interval=512)
+	assert count == len(records)
+	
+	file = BinaryTimelineFile(tmp_path / "t.ptl")
+	assert list(file.iter()) == records
+	
+	# every checkpoint has the full stat of the entries before it
+	stat = {}
+	for record in file.iter(with_checkpoints=True):
+		if isinstance(record, Checkpoint):
+			assert record.stat == stat
+			continue
+		stat[(record[1], record[2])] = record[3]
+
+def test_iter_from_block_offsets(tmp_path, make_records):
+	records = make_records(300)
+	file = BinaryTimelineFile(tmp_path / "t.ptl")
+	sizes = [file.append(batch) for batch in _batches(records)]
+	middle = sizes[len(sizes) // 2]
+	
+	forward = list(file.iter(offset=middle))
+	backward = list(file.iter(reverse=True, offset=middle))
+	assert backward[::-1] + forward == records
+	assert file.is_block_end(middle)
+	assert not file.is_block_end(middle - 1)
+
+def test_reverse_iter_from_file_start_is_empty(tmp_path, make_records):
+	file = BinaryTimelineFile(tmp_path / "t.ptl")
+	file.append(make_records(10))
+	
+	assert list(file.iter(reverse=True, offset=0)) == []
+	assert list(file.iter(reverse=True, offset=len(MAGIC))) == []
+	assert len(list(file.iter(reverse=True, offset=None))) == 10
+
+def test_broken_tail_is_skipped_and_cut_off(tmp_path, make_records):
+	records = make_records(200)
+	path = tmp_path / "t.ptl"
+	file = BinaryTimelineFile(path)
+	file.append(records[:100])
+	size = file.append(records[100:150])
+	with path.open("ab") as fh:
+		fh.write(b"E\x05\x01") # interrupted write
+	
+	reopened = BinaryTimelineFile(path)
+	assert list(reopened.iter()) == records[:150]
+	assert list(reopened.iter(reverse=True)) == records[:150][::-1]
+	
+	reopened.append(records[150:])
+	assert path.stat().st_size > size
+	assert list(BinaryTimelineFile(path).iter()) == records
+
+@pytest.mark.parametrize("block_size", [0, 3, 10 ** 6])
+def test_reverse_iter_stops_at_corrupt_block_size(tmp_path, make_records,
+		block_size):
+	records = make_records(100)
+	path = tmp_path / "t.ptl"
+	file = BinaryTimelineFile(path)
+	file.append(records[:50])
+	file.append(records[50:])
+	
+	# trailer of the last block is damaged after the file was scanned
+	with path.open("r+b") as fh:
+		fh.seek(-4, 2)
+		fh.write(struct.pack("<I", block_size))
+	
+	assert list(file.iter(reverse=True)) == []
+
+def test_not_a_binary_timeline(tmp_path):
+	path = tmp_path / "t.ptl"
+	path.write_bytes(b"1600000000 _ level 1\n")
+	
+	with pytest.raises(binarytimeline.BinaryTimelineError):
+		list(BinaryTimelineFile(path).iter())
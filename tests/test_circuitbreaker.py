@@ -0,0 +1,54 @@
+import pytest
+import circuitbreaker
+from circuitbreaker import CircuitBreaker, CircuitOpenError
+
+@pytest.fixture
+def clock(monkeypatch):
+	"Fake time without the delay jitter"
+	now = [1000.0]
+	monkeypatch.setattr(circuitbreaker.time, "time", lambda: now[0])
+	monkeypatch.setattr(circuitbreaker.random, "uniform", lambda a, b: 1)
+	return now
+
+def test_opens_after_failures_in_a_row(clock):
+	breaker = CircuitBreaker("test", failure_threshold=3, min_delay=5)
+	for _ in range(2):
+		breaker.before_request()
+		breaker.record_failure()
+	breaker.record_success() # resets the failures
+	for _ in range(3):
+		breaker.before_request()
+		breaker.record_failure()
+	
+	assert breaker.state == breaker.OPEN and breaker.get_wait() == 5
+	with pytest.raises(CircuitOpenError):
+		breaker.before_request()
+	assert breaker.total_failures == 5 and breaker.total_rejected == 1
+
+def test_half_open_lets_one_trial_through(clock):
+	breaker = CircuitBreaker("test", failure_threshold=1, min_delay=5)
+	breaker.record_failure()
+	clock[0] += 5
+	breaker.before_request()
+	assert breaker.state == breaker.HALF_OPEN
+	with pytest.raises(CircuitOpenError):
+		breaker.before_request()
+	
+	breaker.record_success()
+	assert breaker.state == breaker.CLOSED and breaker.get_wait() == 0
+	breaker.before_request()
+
+def test_failed_trials_double_the_delay(clock):
+	breaker = CircuitBreaker("test", failure_threshold=1, min_delay=5,
+		max_delay=30)
+	delays = []
+	for _ in range(5):
+		breaker.record_failure()
+		delays.append(breaker.get_wait())
+		clock[0] += delays[-1]
+		breaker.before_request() # trial
+	assert delays == [5, 10, 20, 30, 30]
+	
+	breaker.record_success()
+	breaker.record_failure()
+	assert breaker.get_wait() == 5
@@ -0,0 +1,138 @@
+import threading
+import time
+import pytest
+import pathylib
+import alsapi
+
+class _Player():
+	def __init__(self, uid):
+		self.uid = uid
+		self.updates = []
+	
+	def get_poll_interval(self, now):
+		return 100
+	
+	def update(self, stat):
+		self.updates.append((stat, threading.current_thread().name))
+		return {"went_online": False, "went_offline": False}
+
+class _Api():
+	"Stub of alsapi.get_players_stat, blocking the fetches until released"
+	def __init__(self, missing=()):
+		self.missing = set(missing)
+		self.release = threading.Event()
+		self.in_flight, self.max_in_flight = set(), 0
+		self.calls = []
+		self.lock = threading.Lock()
+	
+	def get_players_stat(self, uids):
+		with self.lock:
+			assert not self.in_flight & set(uids), "fetched twice at once"
+			self.in_flight |= set(uids)
+			self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+			self.calls.append(list(uids))
+		self.release.wait(5)
+		with self.lock:
+			self.in_flight -= set(uids)
+		return {uid: {"n": len(self.calls)} for uid in uids if \
+			uid not in self.missing}
+
+@pytest.fixture
+def daemon(monkeypatch):
+	monkeypatch.setattr(pathylib, "ALS_BATCH_SIZE", 2)
+	daemon = pathylib.PathyDaemon()
+	daemon.state = {"tracked_players": [_Player(str(i)) for i in range(20)]}
+	daemon.is_running = True
+	for worker in [daemon.main_worker] + daemon.fetch_workers:
+		worker.start()
+	yield daemon
+	daemon.is_running = False
+	for worker in [daemon.main_worker] + daemon.fetch_workers:
+		worker.stop(drop_pending=True)
+
+def _wait_fetched(daemon):
+	deadline = time.time() + 5
+	while daemon._fetching and time.time() < deadline:
+		time.sleep(0.01)
+	daemon.main_worker.task(lambda: None, sync=True).run()
+	assert not daemon._fetching
+
+def test_fetches_run_on_every_free_worker(daemon, monkeypatch):
+	api = _Api()
+	monkeypatch.setattr(alsapi, "get_players_stat", api.get_players_stat)
+	
+	daemon.do_player_upd()
+	deadline = time.time() + 5
+	while len(api.in_flight) < 8 and time.time() < deadline:
+		time.sleep(0.01)
+	daemon.do_player_upd() # no free workers, nothing is fetched
+	assert len(api.calls) == len(daemon.fetch_workers) == 4
+	assert api.max_in_flight == 8
+	
+	api.release.set()
+	_wait_fetched(daemon)
+	fetched = [p for p in daemon.state["tracked_players"] if p.updates]
+	assert len(fetched) == 8
+	assert all(p.updates[0][1] == "main" for p in fetched)
+	
+	while daemon.main_worker.task(daemon.poll_scheduler.get_lag,
+			sync=True).run()[0]:
+		daemon.do_player_upd()
+		_wait_fetched(daemon)
+	assert all(len(p.updates) == 1 for p in daemon.state["tracked_players"])
+	assert api.max_in_flight == 8
+
+def test_player_is_not_fetched_while_in_flight(daemon, monkeypatch):
+	api = _Api()
+	monkeypatch.setattr(alsapi, "get_players_stat", api.get_players_stat)
+	daemon.state["tracked_players"] = daemon.state["tracked_players"][:2]
+	monkeypatch.setattr(_Player, "get_poll_interval", lambda self, now: 0)
+	
+	for _ in range(5): # due again right away, but still in flight
+		daemon.do_player_upd()
+	assert api.calls == [["0", "1"]]
+	api.release.set()
+	_wait_fetched(daemon)
+	for _ in range(3):
+		daemon.do_player_upd()
+		_wait_fetched(daemon)
+	
+	player = daemon.state["tracked_players"][0]
+	assert [stat["n"] for stat, _ in player.updates] == [1, 2, 3, 4]
+
+def test_players_not_fetched_are_backed_off(daemon, monkeypatch):
+	api = _Api(missing={"0", "1"})
+	monkeypatch.setattr(alsapi, "get_players_stat", api.get_players_stat)
+	daemon.fetch_workers[1:] = [] # one request at a time
+	daemon.state["tracked_players"] = daemon.state["tracked_players"][:4]
+	
+	start = time.time()
+	daemon.do_player_upd()
+	api.release.set()
+	_wait_fetched(daemon)
+	api.missing.clear()
+	daemon.do_player_upd()
+	_wait_fetched(daemon)
+	assert api.calls == [["0", "1"], ["2", "3"]]
+	
+	scheduler = daemon.poll_scheduler
+	assert scheduler.pop(start + pathylib.POLL_RETRY_DELAY - 0.1) is None
+	assert scheduler.pop(time.time() + pathylib.POLL_RETRY_DELAY) == "0"
+
+def test_players_held_by_open_circuit_are_retried_first(daemon, monkeypatch):
+	api = _Api()
+	monkeypatch.setattr(alsapi, "get_players_stat", api.get_players_stat)
+	daemon.fetch_workers[1:] = []
+	api.release.set()
+	def _get_players_stat(uids):
+		api.calls.append(list(uids))
+		raise alsapi.CircuitOpenError("ALS API bridge is open")
+	monkeypatch.setattr(alsapi, "get_players_stat", _get_players_stat)
+	
+	daemon.do_player_upd()
+	_wait_fetched(daemon)
+	monkeypatch.setattr(alsapi, "get_players_stat", api.get_players_stat)
+	daemon.do_player_upd()
+	_wait_fetched(daemon)
+	assert api.calls[:2] == [["0", "1"], ["0", "1"]]
+	assert daemon.state["tracked_players"][0].updates
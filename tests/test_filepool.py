@@ -0,0 +1,47 @@
+import threading
+from filepool import AppendFilePool
+
+def test_append_returns_size_and_reuses_handle(tmp_path):
+	pool = AppendFilePool(max_open=4, fsync_interval=-1)
+	path = tmp_path / "a.txt"
+	assert pool.append(path, b"abc") == 3
+	handle = pool._files[str(path)][0]
+	assert pool.append(path, b"de\n") == 6
+	assert pool._files[str(path)][0] is handle
+	assert path.read_bytes() == b"abcde\n" # flushed right away
+	pool.close_all()
+
+def test_least_recently_used_handles_are_closed(tmp_path):
+	pool = AppendFilePool(max_open=2, fsync_interval=0)
+	paths = [tmp_path / f"{i}.txt" for i in range(3)]
+	pool.append(paths[0], b"0")
+	pool.append(paths[1], b"1")
+	pool.append(paths[0], b"0")
+	pool.append(paths[2], b"2")
+	
+	assert list(pool._files) == [str(paths[0]), str(paths[2])]
+	pool.append(paths[1], b"1")
+	assert [p.read_bytes() for p in paths] == [b"00", b"11", b"2"]
+	pool.close_all()
+	assert not pool._files
+
+def test_concurrent_appends_are_not_interleaved(tmp_path):
+	pool = AppendFilePool(max_open=2, fsync_interval=-1)
+	path = tmp_path / "a.txt"
+	
+	def _write(thread_id):
+		for i in range(200):
+			pool.append(path, f"{thread_id} {i} {'x' * 100}\n".encode())
+			pool.append(tmp_path / f"{thread_id}.txt", b".") # evictions
+	
+	threads = [threading.Thread(target=_write, args=(i,)) for i in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	pool.close_all()
+	
+	lines = path.read_text().splitlines()
+	assert len(lines) == 8 * 200
+	assert all(line.endswith("x" * 100) and len(line.split(" ")) == 3 for \
+		line in lines)
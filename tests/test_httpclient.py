@@ -0,0 +1,78 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from httpclient import HttpClient
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1" # keep-alive
+	
+	def do_GET(self):
+		body = self.path.encode()
+		self.send_response(200)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+	
+	def log_message(self, *args):
+		pass
+
+@pytest.fixture
+def server_url():
+	server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+	server.daemon_threads = True
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	yield f"http://127.0.0.1:{server.server_address[1]}"
+	server.shutdown()
+	server.server_close()
+
+def _in_thread(func):
+	result = []
+	thread = threading.Thread(target=lambda: result.append(func()))
+	thread.start()
+	thread.join()
+	return result[0]
+
+def test_threads_have_own_sessions_sharing_the_pool():
+	client = HttpClient(2, 5)
+	session = client._get_session("example.com")
+	assert client._get_session("example.com") is session
+	other = _in_thread(lambda: client._get_session("example.com"))
+	assert other is not session
+	assert other.adapters["https://"] is session.adapters["https://"]
+	assert client._get_session("example.org") is not session
+
+def test_concurrent_requests_reuse_bounded_pool(server_url):
+	client = HttpClient(2, 5)
+	errors = []
+	def _get(i):
+		try:
+			for j in range(10):
+				resp = client.get(f"{server_url}/{i}/{j}")
+				assert resp.text == f"/{i}/{j}"
+		except Exception as e:
+			errors.append(e)
+	threads = [threading.Thread(target=_get, args=(i,)) for i in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	
+	assert not errors
+	stats = client.get_stats()[server_url.split("//")[1]]
+	assert stats["requests"] == 80
+	assert stats["connections"] <= 2 and stats["reused"] >= 78
+	client.close()
+
+def test_close_renews_sessions(server_url, monkeypatch):
+	client = HttpClient(2, 5)
+	session = client._get_session("example.com")
+	other = _in_thread(lambda: client._get_session("example.org"))
+	closed = []
+	for s in (session, other):
+		monkeypatch.setattr(s, "close", lambda s=s: closed.append(s))
+	client.close()
+	assert len(closed) == 2 and set(closed) == {session, other}
+	assert client.get_stats() == {}
+	assert client._get_session("example.com") is not session
+	assert client.get(f"{server_url}/a").text == "/a"
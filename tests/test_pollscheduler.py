@@ -0,0 +1,139 @@
+import threading
+import pytest
+import pathylib
+from pollscheduler import PollScheduler
+
+def _pop_all(scheduler, now):
+	uids = []
+	while True:
+		uid = scheduler.pop(now)
+		if not uid:
+			return uids
+		uids.append(uid)
+
+def test_players_are_polled_most_overdue_first():
+	scheduler = PollScheduler()
+	scheduler.sync(["a", "b", "c"], now=0)
+	assert _pop_all(scheduler, 0) == ["a", "b", "c"] # FIFO of the same due
+	
+	for uid, due in [("a", 30), ("b", 10), ("c", 20)]:
+		scheduler.done(uid, due)
+	assert scheduler.pop(5) is None
+	assert scheduler.get_lag(25) == (2, 15)
+	assert _pop_all(scheduler, 25) == ["b", "c"]
+	assert _pop_all(scheduler, 100) == ["a"]
+
+def test_retry_keeps_the_place():
+	scheduler = PollScheduler()
+	scheduler.sync(["a", "b"], now=0)
+	assert scheduler.pop(0) == "a"
+	scheduler.sync(["a", "b", "c"], now=5) # c gets due after a
+	scheduler.retry("a")
+	assert _pop_all(scheduler, 10) == ["a", "b", "c"]
+
+def test_failed_poll_is_backed_off():
+	scheduler = PollScheduler(retry_delay=5, max_retry_delay=30)
+	scheduler.sync(["a", "b"], now=0)
+	assert scheduler.pop(0) == "a"
+	scheduler.fail("a", now=0)
+	assert _pop_all(scheduler, 4) == ["b"] # failed one doesn't hold others
+	
+	now = 0
+	for delay in [5, 10, 20, 30, 30]:
+		assert scheduler.pop(now + delay - 1) is None
+		now += delay
+		assert scheduler.pop(now) == "a"
+		scheduler.fail("a", now)
+	
+	scheduler.done("b", 200)
+	assert scheduler.pop(now + 30) == "a"
+	scheduler.done("a", 200) # success resets the backoff
+	assert _pop_all(scheduler, 200) == ["b", "a"]
+	scheduler.fail("a", 210)
+	assert scheduler.pop(214) is None and scheduler.pop(215) == "a"
+
+def test_sync_forgets_removed_players():
+	scheduler = PollScheduler()
+	scheduler.sync(["a", "b", "c"], now=0)
+	assert scheduler.pop(0) == "a"
+	scheduler.sync(["c"], now=0)
+	scheduler.done("a", 0) # removed while in flight
+	scheduler.retry("b")
+	assert _pop_all(scheduler, 10) == ["c"]
+	
+	scheduler.sync(["a", "c"], now=20) # added back, due right away
+	assert _pop_all(scheduler, 20) == ["a"]
+
+def test_in_flight_player_is_not_scheduled_twice():
+	scheduler = PollScheduler()
+	scheduler.sync(["a"], now=0)
+	assert scheduler.pop(0) == "a"
+	scheduler.sync(["a"], now=0)
+	assert scheduler.pop(100) is None
+	scheduler.done("a", 10)
+	scheduler.done("a", 0) # not in flight anymore
+	assert scheduler.pop(5) is None and scheduler.pop(10) == "a"
+
+def test_outdated_heap_items_are_compacted():
+	scheduler = PollScheduler()
+	uids = [str(i) for i in range(10)]
+	scheduler.sync(uids, now=0)
+	for due in range(1, 200):
+		for uid in _pop_all(scheduler, due):
+			scheduler.done(uid, due + 1)
+	assert len(scheduler._heap) <= 2 * len(uids) + 64
+	assert sorted(_pop_all(scheduler, 1000)) == sorted(uids)
+
+def test_concurrent_pops_hand_out_each_player_once():
+	scheduler = PollScheduler()
+	uids = [str(i) for i in range(2000)]
+	scheduler.sync(uids, now=0)
+	popped = []
+	
+	def _pop():
+		while True:
+			uid = scheduler.pop(0)
+			if not uid:
+				return
+			popped.append(uid)
+			scheduler.done(uid, 10)
+	threads = [threading.Thread(target=_pop) for _ in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	
+	assert sorted(popped) == sorted(uids)
+	assert len(_pop_all(scheduler, 10)) == len(uids)
+
+@pytest.mark.parametrize("entries, chats, interval", [
+	([("is_online", "1"), ("is_in_match", "1")], True,
+		"POLL_INTERVAL_IN_MATCH"),
+	([("is_online", "1"), ("is_in_match", "0")], True,
+		"POLL_INTERVAL_IN_LOBBY"),
+	([("is_online", "1"), ("is_banned", "1")], True, "POLL_INTERVAL_BANNED"),
+	([("is_online", "1")], False, "POLL_INTERVAL_NO_CHATS"),
+	([("is_online", "0")], True, "POLL_INTERVAL_RECENTLY_OFFLINE")
+])
+def test_poll_interval_by_activity(entries, chats, interval):
+	player = pathylib.TrackedPlayer({"uid": f"poll_{interval}",
+		"chats": {"1": {}} if chats else {}})
+	now = 1_600_000_000
+	player.timeline.add_entries([pathylib.TimelineEntry(now - 10, "_",
+		stat_name, value) for stat_name, value in entries])
+	player.read_timeline()
+	assert player.get_poll_interval(now) == getattr(pathylib, interval)
+
+def test_poll_interval_grows_with_offline_time():
+	player = pathylib.TrackedPlayer({"uid": "poll_offline", "chats": {"1": {}}})
+	now = 1_600_000_000
+	player.timeline.add_entries([
+		pathylib.TimelineEntry(now - 10 ** 6, "_", "is_online", "1"),
+		pathylib.TimelineEntry(now - 10 ** 6 + 60, "_", "is_online", "0")])
+	player.read_timeline()
+	
+	intervals = [player.get_poll_interval(now - 10 ** 6 + 60 + offline) for \
+		offline in (60, pathylib.SESS_MAX_BREAK + 1,
+		pathylib.POLL_LONG_OFFLINE_AFTER + 1)]
+	assert intervals == [pathylib.POLL_INTERVAL_RECENTLY_OFFLINE,
+		pathylib.POLL_INTERVAL_OFFLINE, pathylib.POLL_INTERVAL_LONG_OFFLINE]
@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+import ratelimit
+from ratelimit import TokenBucket
+
+@pytest.fixture
+def clock(monkeypatch):
+	"Fake time, which sleeps move forward"
+	now = [1000.0]
+	sleeps = []
+	def _sleep(seconds):
+		sleeps.append(seconds)
+		now[0] += seconds
+	monkeypatch.setattr(ratelimit.time, "time", lambda: now[0])
+	monkeypatch.setattr(ratelimit.time, "sleep", _sleep)
+	return now, sleeps
+
+def test_burst_then_rate(clock):
+	now, sleeps = clock
+	bucket = TokenBucket("test", rate=2, burst=3)
+	for _ in range(7):
+		assert bucket.acquire()
+	assert sleeps == [0.5] * 4 and now[0] == 1002
+	
+	now[0] += 10 # tokens don't pile up over the burst
+	for _ in range(4):
+		bucket.acquire()
+	assert sleeps[4:] == [0.5]
+	assert bucket.get_stats()["waited"] == 5
+
+def test_non_blocking_and_timeout(clock):
+	now, sleeps = clock
+	bucket = TokenBucket("test", rate=1)
+	assert bucket.acquire(block=False)
+	assert not bucket.acquire(block=False)
+	assert not bucket.acquire(timeout=0.5)
+	assert bucket.acquire(timeout=1)
+	assert sleeps == [1]
+	assert bucket.get_stats()["rejected"] == 2
+
+def test_throttling_pauses_and_slows_down(clock):
+	now, sleeps = clock
+	bucket = TokenBucket("test", rate=10, burst=10)
+	bucket.report_throttled(retry_after=3)
+	assert bucket.rate == 5
+	bucket.acquire()
+	assert sleeps == [3]
+	
+	for _ in range(10):
+		bucket.report_throttled()
+	assert bucket.rate == 1 # min rate share
+	for _ in range(20):
+		bucket.report_success()
+	assert bucket.rate == 10
+	assert bucket.get_stats()["throttled"] == 11
+
+def test_waiting_callers_are_spread_by_rate():
+	bucket = TokenBucket("test", rate=50)
+	acquired = []
+	
+	def _acquire():
+		for _ in range(5):
+			bucket.acquire()
+			acquired.append(time.time())
+	threads = [threading.Thread(target=_acquire) for _ in range(4)]
+	started = time.time()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	
+	assert len(acquired) == 20
+	assert max(acquired) - started >= 19 / 50 - 0.01
+	assert bucket.get_stats()["acquired"] == 20
+
+@pytest.mark.parametrize("value, seconds", [
+	("5", 5), ("1.5", 1.5), ("-3", 0), (None, None),
+	("Wed, 21 Oct 2015 07:28:00 GMT", None)
+])
+def test_parse_retry_after(value, seconds):
+	assert ratelimit.parse_retry_after(value) == seconds
+
+def test_rate_limiter_buckets():
+	limiter = ratelimit.RateLimiter({"a": (100, 2)})
+	assert limiter.acquire("a") and limiter.acquire("a")
+	assert not limiter.acquire("a", block=False)
+	limiter.add_bucket("b", 1)
+	assert set(limiter.get_stats()) == {"a", "b"}
+	with pytest.raises(KeyError):
+		limiter.acquire("c")
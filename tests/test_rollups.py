@@ -0,0 +1,137 @@
+import random
+import pytest
+import pathylib
+from pathylib import RollupTable, StoredTimeline, TimelineEntry
+
+def _entries(records):
+	return [TimelineEntry(*record) for record in records]
+
+@pytest.fixture
+def records(make_records):
+	"Records with rank score changing in some of the matches"
+	rnd = random.Random(3)
+	records, rank = [], 1000
+	for record in make_records(3000):
+		records.append(record)
+		if record[2] == "level" and rnd.random() < 0.5:
+			rank += rnd.randint(-50, 100)
+			records.append((record[0], "_", "br_rank_score", str(rank)))
+	return records
+
+def _online_time(records):
+	timestamps = sorted({r[0] for r in records})
+	is_online, total = None, 0
+	for timestamp, next_timestamp in zip(timestamps, timestamps[1:] + [None]):
+		for record in records:
+			if record[0] == timestamp and record[2] == "is_online":
+				is_online = record[3]
+		if is_online == "1" and next_timestamp:
+			total += next_timestamp - timestamp
+	return total
+
+def _match_types(records):
+	"Types of the matches of the timeline split, which can't change anymore"
+	timeline = pathylib.Timeline()
+	timeline.add_entries(_entries(records))
+	types = {}
+	for seg in timeline.split_by_states()[:-2]:
+		if isinstance(seg, pathylib.MatchTimeline) and seg.is_ended():
+			types[seg.get_type()] = types.get(seg.get_type(), 0) + 1
+	return types
+
+def _sum(rows):
+	total = {}
+	for row in rows:
+		pathylib.add_rollup_row(total, row)
+	return total
+
+def test_rollups_match_timeline(records):
+	rollups = RollupTable()
+	rollups.add_entries(_entries(records))
+	# entries of the last timestamp are held until a newer one comes
+	counted = [r for r in records if r[0] < records[-1][0]]
+	
+	for period in ("hour", "day"):
+		total = _sum([row for _, row in rollups.get_rows(period)])
+		assert total["online"] == _online_time(counted)
+		assert total["matches"] == _match_types(counted)
+		assert len(total["matches"]) == 3
+
+def test_daily_rows_are_not_changed_by_reads(records):
+	rollups = RollupTable()
+	rollups.add_entries(_entries(records))
+	hours = [(hour, dict(row)) for hour, row in rollups.get_rows("hour")]
+	
+	days = rollups.get_rows("day")
+	assert rollups.get_rows("day") == days
+	days[-1][1]["matches"]["inPublicMatch"] = -1
+	days[-1][1]["online"] = -1
+	assert rollups.get_rows("day") != days
+	assert rollups.get_rows("day")[:-1] == days[:-1]
+	assert rollups.get_rows("hour") == hours
+
+def test_entries_of_a_timestamp_split_across_batches(records):
+	whole, split = RollupTable(), RollupTable()
+	whole.add_entries(_entries(records))
+	for i in range(0, len(records), 7): # batches cut timestamps in parts
+		split.add_entries(_entries(records[i:i + 7]))
+	assert split.get_rows("hour") == whole.get_rows("hour")
+	
+	older = RollupTable()
+	older.add_entries(_entries(records))
+	older.add_entries(_entries(records[:100])) # older ones are skipped
+	older.add_entries(_entries(records[-3:])) # held ones are added again
+	assert older.get_rows("hour") == whole.get_rows("hour")
+
+def test_rollups_continue_from_saved_state(tmp_path, records):
+	whole = RollupTable()
+	whole.add_entries(_entries(records))
+	
+	# reopened timeline catches its rollups up with the entries added
+	# after the last saved state, some of them split by the batches
+	path = tmp_path / "player.txt"
+	for i in range(0, len(records), 150):
+		timeline = StoredTimeline(path)
+		if i % 300:
+			timeline.get_rollups()
+		timeline.add_entries(_entries(records[i:i + 150]))
+	
+	timeline = StoredTimeline(path)
+	for period in ("hour", "day"):
+		assert timeline.get_rollups(period) == whole.get_rows(period)
+
+def test_broken_rollups_are_rebuilt(tmp_path, records):
+	timeline = StoredTimeline(tmp_path / "player.txt")
+	timeline.add_entries(_entries(records))
+	rows = timeline.get_rollups("day")
+	
+	timeline.rollups.path.write_text("s {broken\n", encoding="utf-8")
+	reopened = StoredTimeline(timeline.path)
+	assert reopened.get_rollups("day") == rows
+
+class _Player():
+	def __init__(self, timeline):
+		self.timeline = timeline
+
+def test_rollups_cmd_runs_on_main_worker(tmp_path, monkeypatch, records):
+	timeline = StoredTimeline(tmp_path / "player.txt")
+	timeline.add_entries(_entries(records))
+	threads = []
+	get_rollup_summary = timeline.get_rollup_summary
+	def _get_rollup_summary(start, end):
+		threads.append(pathylib.threading.current_thread().name)
+		return get_rollup_summary(start, end)
+	monkeypatch.setattr(timeline, "get_rollup_summary", _get_rollup_summary)
+	monkeypatch.setattr(pathylib.time, "time", lambda: records[-1][0])
+	
+	daemon = pathylib.PathyDaemon()
+	daemon.main_worker.start()
+	player = _Player(timeline)
+	monkeypatch.setattr(daemon, "get_player_by_uid",
+		lambda uid: player if uid == "1" else None)
+	try:
+		resp = daemon.handle_cmd("rollups", {"uid": "1", "days": 1000})
+		assert '"online": ' in resp and threads == ["main"]
+		assert daemon.handle_cmd("rollups", {"uid": "2"}) == "Unknown player"
+	finally:
+		daemon.main_worker.stop(drop_pending=True)
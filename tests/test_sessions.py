@@ -0,0 +1,89 @@
+import pytest
+import pathylib
+from pathylib import Timeline, MatchTimeline, TimelineEntry
+
+@pytest.fixture(autouse=True)
+def translations(monkeypatch):
+	monkeypatch.setattr(pathylib.resmgr, "trans",
+		lambda txt, default=None: txt if default is None else default)
+
+def _timeline(records, start_stat=None):
+	timeline = Timeline(dict(start_stat or {}))
+	timeline.add_entries(TimelineEntry(*record) for record in records)
+	return timeline
+
+def _as_records(timeline):
+	return [(e.timestamp, e.legend, e.stat_name, e.stat_value) for \
+		e in timeline.iter()]
+
+def _split(records, start_stat):
+	"State segments as (is_match, start stat, records), made linearly"
+	stat = dict(start_stat)
+	segs = [(stat.get(("_", "is_in_match")) == "1", dict(stat), [])]
+	timestamps = sorted({r[0] for r in records})
+	for timestamp in timestamps:
+		items = [r for r in records if r[0] == timestamp]
+		values = {r[1:3]: r[3] for r in items}
+		segs[-1][2].extend(items)
+		if values.get(("_", "is_online")) or values.get(("_", "is_in_match")):
+			segs.append((values.get(("_", "is_in_match")) == "1", dict(stat),
+				list(items)))
+		stat.update(values)
+	return segs
+
+def test_split_by_states_matches_linear_split(make_records):
+	records = make_records(1500)
+	start_stat = {("_", "is_online"): "1", ("_", "legend"): "Wraith"}
+	timeline = _timeline(records, start_stat)
+	
+	segs = timeline.split_by_states()
+	expected = _split(records, start_stat)
+	assert len(segs) == len(expected) > 100
+	for seg, (is_match, seg_start_stat, seg_records) in zip(segs, expected):
+		assert isinstance(seg, MatchTimeline) == is_match
+		assert seg.start_stat == seg_start_stat
+		assert _as_records(seg) == seg_records
+		assert seg.get_state() == seg.get_summary().get_state()
+		if is_match:
+			assert bool(seg.result_stamp) == seg.is_real()
+
+def test_split_and_format_sweep_once(monkeypatch, make_records):
+	timeline = _timeline(make_records(600), {("_", "is_online"): "1"})
+	sweeps = []
+	iter_ranges = Timeline._iter_timestamp_ranges
+	def _iter_timestamp_ranges(self):
+		sweeps.append(self)
+		return iter_ranges(self)
+	monkeypatch.setattr(Timeline, "_iter_timestamp_ranges",
+		_iter_timestamp_ranges)
+	
+	segs = timeline.split_by_states()
+	timeline.format()
+	timeline.get_states_duration()
+	for seg in segs:
+		seg.format()
+	assert sweeps == [timeline]
+
+def test_segment_views_are_copied_on_write(make_records):
+	records = make_records(300)
+	timeline = _timeline(records)
+	seg = timeline.split_by_states()[1]
+	seg_records = _as_records(seg)
+	
+	seg.add_entry(TimelineEntry(records[-1][0] + 1, "_", "level", "1"))
+	assert _as_records(timeline) == records
+	assert _as_records(seg)[:-1] == seg_records
+
+@pytest.mark.parametrize("values, state", [
+	({("_", "is_online"): "1"}, "inLobby"),
+	({("_", "is_online"): "0"}, "offline"),
+	({("_", "is_in_match"): "1"}, "inMatch")
+])
+def test_segment_state(values, state):
+	records = [(1600000000, "_", "level", "1")] + [(1600000010, *key, value) \
+		for key, value in values.items()] + [(1600000020, "_", "legend",
+		"Wraith")]
+	segs = _timeline(records).split_by_states()
+	assert segs[-1].get_state() == state
+	assert segs[-1].get_legend() == "Wraith" or state != "inLobby" or \
+		segs[-1].get_legend() is None
@@ -0,0 +1,442 @@
+import json
+import pytest
+import pathylib
+from pathylib import StoredTimeline, BinaryStoredTimeline, TimelineEntry
+
+@pytest.fixture(params=[StoredTimeline, BinaryStoredTimeline])
+def timeline_cls(request):
+	return request.param
+
+def _entries(records):
+	return [TimelineEntry(*record) for record in records]
+
+def _end_stat(records):
+	return {(legend, stat_name): value for _, legend, stat_name, value in \
+		records}
+
+def test_end_stat_survives_reopen(tmp_path, monkeypatch, timeline_cls,
+		make_records):
+	monkeypatch.setattr(pathylib, "TIMELINE_SNAPSHOT_INTERVAL", 256)
+	records = make_records(500)
+	path = tmp_path / "player.ptl"
+	timeline = timeline_cls(path)
+	timeline.add_entries(_entries(records[:250]))
+	assert timeline.get_end_stat() == _end_stat(records[:250])
+	timeline.add_entries(_entries(records[250:]))
+	assert timeline.get_end_stat() == _end_stat(records)
+	assert timeline.snapshot_path.exists()
+	
+	reopened = timeline_cls(path)
+	assert reopened.get_end_stat() == _end_stat(records)
+
+def test_end_stat_replays_entries_after_snapshot(tmp_path, monkeypatch,
+		timeline_cls, make_records):
+	records = make_records(300)
+	path = tmp_path / "player.ptl"
+	timeline = timeline_cls(path)
+	timeline.add_entries(_entries(records[:100]))
+	timeline.get_end_stat()
+	timeline.save_snapshot()
+	timeline.add_entries(_entries(records[100:])) # not snapshotted
+	
+	reopened = timeline_cls(path)
+	assert reopened._read_snapshot()[1] < path.stat().st_size
+	assert reopened.get_end_stat() == _end_stat(records)
+
+@pytest.mark.parametrize("snapshot", [
+	"not json",
+	json.dumps({"stat": []}),
+	json.dumps({"offset": 10 ** 9, "stat": [["_", "level", "1"]]}),
+	json.dumps({"offset": 7, "stat": [["_", "level", "1"]]})
+])
+def test_end_stat_ignores_broken_snapshot(tmp_path, timeline_cls,
+		make_records, snapshot):
+	records = make_records(200)
+	path = tmp_path / "player.ptl"
+	timeline_cls(path).add_entries(_entries(records))
+	timeline = timeline_cls(path)
+	timeline.snapshot_path.write_text(snapshot, encoding="utf-8")
+	
+	assert timeline.get_end_stat() == _end_stat(records)
+
+def _records_between(records, start, end):
+	return [r for r in records if (start is None or r[0] >= start) and \
+		(end is None or r[0] <= end)]
+
+def _as_records(entries):
+	return [(e.timestamp, e.legend, e.stat_name, e.stat_value) for \
+		e in entries]
+
+@pytest.fixture
+def indexed_timeline(tmp_path, monkeypatch, timeline_cls, make_records):
+	"Timeline of 2000 records with a dense index, and its records"
+	monkeypatch.setattr(pathylib, "TIMELINE_INDEX_STEP", 200)
+	records = make_records(2000)
+	timeline = timeline_cls(tmp_path / "player.ptl")
+	for i in range(0, len(records), 100):
+		timeline.add_entries(_entries(records[i:i + 100]))
+	return timeline, records
+
+def test_range_reads_match_full_scan(indexed_timeline):
+	timeline, records = indexed_timeline
+	timestamps = sorted({r[0] for r in records})
+	assert len(timeline.index.offsets) > 10
+	
+	ranges = [(None, None), (timestamps[0] - 1, timestamps[5]),
+		(timestamps[100], timestamps[300]), (timestamps[-3], None),
+		(None, timestamps[50]), (timestamps[-1] + 1, None),
+		(timestamps[200], timestamps[200])]
+	for start, end in ranges:
+		expected = _records_between(records, start, end)
+		assert _as_records(timeline.iter(start=start, end=end)) == expected
+		assert _as_records(timeline.iter(reverse=True, start=start,
+			end=end)) == expected[::-1]
+
+def test_outdated_index_is_rebuilt(indexed_timeline, timeline_cls,
+		make_records):
+	timeline, records = indexed_timeline
+	index_text = timeline.index.path.read_text(encoding="utf-8")
+	timeline.index.path.write_text(index_text + "99999999999 99999999\n",
+		encoding="utf-8")
+	
+	reopened = timeline_cls(timeline.path)
+	middle = records[1000][0]
+	assert _as_records(reopened.iter(start=middle)) == \
+		_records_between(records, middle, None)
+	assert reopened.index.offsets[-1] < timeline.path.stat().st_size
+
+def test_reopen_with_single_index_point(tmp_path, make_records):
+	# index of a short text timeline only has the point at offset 0
+	records = make_records(20)
+	path = tmp_path / "player.ptl"
+	StoredTimeline(path).add_entries(_entries(records))
+	
+	reopened = StoredTimeline(path)
+	reopened._load_index()
+	assert list(reopened.index.offsets) == [0]
+	assert _as_records(reopened.iter(start=records[0][0])) == records
+
+def _stat_until(records, moment, inclusive=True):
+	return _end_stat([r for r in records if r[0] < moment or \
+		(inclusive and r[0] == moment)])
+
+@pytest.fixture
+def checkpointed_timeline(tmp_path, monkeypatch, timeline_cls, make_records):
+	"Timeline of 2000 records with frequent checkpoints, and its records"
+	monkeypatch.setattr(pathylib, "TIMELINE_CHECKPOINT_INTERVAL", 2000)
+	records = make_records(2000)
+	timeline = timeline_cls(tmp_path / "player.ptl")
+	for i in range(0, len(records), 50):
+		timeline.add_entries(_entries(records[i:i + 50]))
+	return timeline, records
+
+def test_stat_at_moments(checkpointed_timeline):
+	timeline, records = checkpointed_timeline
+	assert len(timeline.index.checkpoint_offsets) > 5
+	
+	timestamps = sorted({r[0] for r in records})
+	moments = [timestamps[0] - 1] + timestamps[::37] + [timestamps[-1] + 1]
+	for moment in moments:
+		assert timeline.get_stat_at(moment) == _stat_until(records, moment)
+		assert timeline.get_stat_before(moment) == \
+			_stat_until(records, moment, inclusive=False)
+
+def test_stat_before_first_checkpoint_stops_at_it(checkpointed_timeline,
+		monkeypatch):
+	timeline, records = checkpointed_timeline
+	first_checkpoint = timeline.index.checkpoint_timestamps[0]
+	moment = records[0][0] # some stats only appear later
+	
+	read = []
+	iter_entries = timeline._iter_entries
+	def _counting_iter(*args, **kwargs):
+		for record in iter_entries(*args, **kwargs):
+			read.append(record)
+			yield record
+	monkeypatch.setattr(timeline, "_iter_entries", _counting_iter)
+	
+	assert timeline.get_stat_at(moment) == _stat_until(records, moment)
+	before_checkpoint = [r for r in records if r[0] <= first_checkpoint]
+	assert len(read) <= len(before_checkpoint) + 1
+
+@pytest.fixture
+def rotated_timeline(tmp_path, monkeypatch, timeline_cls, make_records):
+	"Timeline of 2000 records rotated daily, and its records"
+	monkeypatch.setattr(pathylib, "TIMELINE_SEGMENT_PERIOD", "%Y-%m-%d")
+	monkeypatch.setattr(pathylib, "TIMELINE_CHECKPOINT_INTERVAL", 4000)
+	records = make_records(2000)
+	timeline = timeline_cls(tmp_path / "player.ptl")
+	for i in range(0, len(records), 20):
+		timeline.add_entries(_entries(records[i:i + 20]))
+	return timeline, records
+
+@pytest.mark.parametrize("compression", ["gzip", "lzma"])
+def test_rotated_segments_read_as_one_timeline(rotated_timeline, monkeypatch,
+		timeline_cls, compression):
+	monkeypatch.setattr(pathylib, "TIMELINE_ARCHIVE_COMPRESSION", compression)
+	timeline, records = rotated_timeline
+	timeline.rotate() # the last one uses the compression being tested
+	segments = timeline.archive.get_segments()
+	assert len(segments) > 3
+	assert segments[-1]["name"].endswith(".xz" if compression == "lzma" \
+		else ".gz")
+	
+	reopened = timeline_cls(timeline.path)
+	assert _as_records(reopened.iter()) == records
+	assert _as_records(reopened.iter(reverse=True)) == records[::-1]
+	assert reopened.get_end_stat() == _end_stat(records)
+
+def _record_key(record):
+	if isinstance(record, pathylib.TimelineCheckpoint):
+		return (record.timestamp, record.stat)
+	return _as_records([record])[0]
+
+@pytest.mark.parametrize("compression", ["gzip", "lzma"])
+def test_segments_are_streamed(rotated_timeline, monkeypatch, compression):
+	monkeypatch.setattr(pathylib, "TIMELINE_ARCHIVE_COMPRESSION", compression)
+	timeline, records = rotated_timeline
+	timeline.rotate()
+	def _whole_read(*args, **kwargs):
+		raise AssertionError("segment read whole")
+	for module in (pathylib.gzip, pathylib.lzma):
+		monkeypatch.setattr(module, "decompress", _whole_read)
+	
+	archive = timeline.archive
+	files = set(archive.dir.iterdir())
+	segment = archive.get_segments()[-1]
+	forward = list(archive.iter_segment(segment, with_checkpoints=True))
+	backward = list(archive.iter_segment(segment, reverse=True,
+		with_checkpoints=True))
+	assert [_record_key(r) for r in backward] == \
+		[_record_key(r) for r in forward[::-1]]
+	assert any(isinstance(r, pathylib.TimelineCheckpoint) for r in forward)
+	
+	reverse = timeline.iter(reverse=True, stat_names=["level"])
+	assert _as_records([next(reverse)]) == \
+		[r for r in records if r[2] == "level"][-1:]
+	assert set(archive.dir.iterdir()) != files # decompressed copy
+	reverse.close() # stopped early, the decompressed copy is still removed
+	assert set(archive.dir.iterdir()) == files
+	assert _as_records(timeline.iter()) == records
+
+def test_range_reads_across_segments(rotated_timeline):
+	timeline, records = rotated_timeline
+	segments = timeline.archive.get_segments()
+	start, end = segments[1]["start"] + 1, segments[3]["end"] + 1
+	
+	expected = _records_between(records, start, end)
+	assert _as_records(timeline.iter(start=start, end=end)) == expected
+	assert _as_records(timeline.iter(reverse=True, start=start, end=end)) \
+		== expected[::-1]
+	for moment in (start, segments[2]["start"], end, records[-1][0]):
+		assert timeline.get_stat_at(moment) == _stat_until(records, moment)
+
+def test_unrecorded_segment_is_added_to_manifest(rotated_timeline,
+		timeline_cls):
+	timeline, records = rotated_timeline
+	timeline.archive.manifest_path.unlink()
+	
+	reopened = timeline_cls(timeline.path)
+	assert _as_records(reopened.iter()) == records
+	assert reopened.archive.manifest_path.exists()
+
+def test_entries_of_a_timestamp_are_written_at_once(tmp_path, monkeypatch,
+		timeline_cls, make_records):
+	records = make_records(500)
+	writes = []
+	append = pathylib.filepool.singleton.append
+	def _counting_append(path, data):
+		writes.append(path)
+		return append(path, data)
+	monkeypatch.setattr(pathylib.filepool.singleton, "append",
+		_counting_append)
+	
+	timeline = timeline_cls(tmp_path / "player.ptl")
+	timeline.add_entries(_entries(records))
+	timeline_writes = [p for p in writes if str(p) == str(timeline.path)]
+	assert len(timeline_writes) == len({r[0] for r in records})
+	assert _as_records(timeline_cls(timeline.path).iter()) == records
+
+def test_reverse_reads_with_stat_names(indexed_timeline):
+	timeline, records = indexed_timeline
+	stat_names = {"is_online", "level"}
+	expected = [r for r in reversed(records) if r[2] in stat_names]
+	assert _as_records(timeline.iter(reverse=True,
+		stat_names=stat_names)) == expected
+	
+	end = records[1500][0]
+	assert _as_records(timeline.iter(reverse=True, end=end,
+		stat_names=stat_names)) == [r for r in expected if r[0] <= end]
+
+def _session_moments(records):
+	timestamps = sorted({r[0] for r in records})
+	return [timestamps[0] - 1] + [t + d for t in timestamps[::7] for \
+		d in (-1, 0, 1, 1000)] + [timestamps[-1] + 10 ** 6]
+
+def test_session_index_matches_timeline_scan(tmp_path, timeline_cls,
+		make_records):
+	records = make_records(1500)
+	stored = timeline_cls(tmp_path / "player.ptl")
+	for i in range(0, len(records), 30):
+		stored.add_entries(_entries(records[i:i + 30]))
+	memory = pathylib.Timeline()
+	memory.add_entries(_entries(records))
+	
+	reopened = timeline_cls(stored.path)
+	for moment in _session_moments(records):
+		assert stored.get_last_online(moment) == \
+			memory.get_last_online(moment)
+		assert reopened.get_sess_start(moment) == \
+			memory.get_sess_start(moment)
+
+def test_outdated_session_index_is_rebuilt(tmp_path, timeline_cls,
+		make_records):
+	records = make_records(800)
+	online = [i for i, r in enumerate(records) if r[2] == "is_online"]
+	# index is left behind at a value different from the last one
+	split = [i for i in online if records[i][3] != records[online[-1]][3]][-1]
+	stored = timeline_cls(tmp_path / "player.ptl")
+	stored.add_entries(_entries(records[:split + 1]))
+	stored.get_sess_start(records[-1][0]) # session index is loaded
+	sessions_text = stored.sessions.path.read_text(encoding="utf-8")
+	stored.add_entries(_entries(records[split + 1:]))
+	stored.sessions.path.write_text(sessions_text, encoding="utf-8")
+	
+	reopened = timeline_cls(stored.path)
+	memory = pathylib.Timeline()
+	memory.add_entries(_entries(records))
+	for moment in _session_moments(records):
+		assert reopened.get_sess_start(moment) == \
+			memory.get_sess_start(moment)
+	assert reopened.sessions.path.read_text(encoding="utf-8") != \
+		sessions_text
+
+@pytest.mark.parametrize("keys", [
+	[("_", "is_online")],
+	[("_", "is_online"), ("_", "is_in_match")],
+	[("_", "is_online"), ("Wraith", "tracker_kills")], # not posted
+	[("_", "absent")]
+])
+def test_keys_reads_match_full_scan(indexed_timeline, keys):
+	timeline, records = indexed_timeline
+	expected = [r for r in records if (r[1], r[2]) in keys]
+	middle = records[1000][0]
+	
+	assert _as_records(timeline.iter(keys=keys)) == expected
+	assert _as_records(timeline.iter(reverse=True, keys=keys)) == \
+		expected[::-1]
+	assert _as_records(timeline.iter(keys=keys, start=middle)) == \
+		[r for r in expected if r[0] >= middle]
+	assert _as_records(timeline.iter(reverse=True, keys=keys, end=middle)) \
+		== [r for r in expected[::-1] if r[0] <= middle]
+
+@pytest.mark.parametrize("stat_names", [["is_online"], ["legend"], []])
+def test_keys_reads_with_stat_names(indexed_timeline, stat_names):
+	timeline, records = indexed_timeline
+	keys = [("_", "is_online"), ("_", "is_in_match"), ("_", "legend")]
+	expected = [r for r in records if (r[1], r[2]) in keys and \
+		(not stat_names or r[2] in stat_names)]
+	
+	assert _as_records(timeline.iter(keys=keys,
+		stat_names=stat_names)) == expected
+	assert _as_records(timeline.iter(keys=keys[:2], stat_names=stat_names,
+		start=records[1000][0])) == [r for r in expected if \
+		r[2] != "legend" and r[0] >= records[1000][0]]
+
+def test_keys_reads_include_tail_not_in_index(indexed_timeline,
+		timeline_cls, make_records):
+	timeline, records = indexed_timeline
+	timeline._load_index()
+	more = [(r[0] + 10 ** 6, *r[1:]) for r in make_records(300, seed=2)]
+	timeline_cls(timeline.path).add_entries(_entries(more)) # someone else
+	
+	keys = [("_", "is_online")]
+	expected = [r for r in records + more if (r[1], r[2]) in keys]
+	assert _as_records(timeline.iter(keys=keys)) == expected
+
+def test_index_is_rebuilt_for_new_posted_stats(indexed_timeline, monkeypatch,
+		timeline_cls):
+	timeline, records = indexed_timeline
+	monkeypatch.setattr(pathylib, "TIMELINE_POSTINGS_STATS", ["level"])
+	
+	reopened = timeline_cls(timeline.path)
+	keys = [("_", "level")]
+	assert _as_records(reopened.iter(keys=keys)) == \
+		[r for r in records if (r[1], r[2]) in keys]
+	assert reopened.index.posted_stats == ["level"]
+	assert list(reopened.index.postings) == keys
+
+@pytest.fixture
+def skewed_records(make_records):
+	"Records where the clock goes back by 20000 s halfway"
+	records = make_records(2000)
+	split = next(i for i in range(1000, len(records)) if \
+		records[i][0] != records[i - 1][0])
+	return records[:split] + [(ts - 20000, *rest) for ts, *rest in \
+		records[split:]]
+
+def _linear_sub_timeline(records, start, end):
+	"Start stat and records of a sub timeline as the linear filter did it"
+	start_stat, entries = {}, []
+	for record in records:
+		if record[0] < start:
+			start_stat[record[1:3]] = record[3]
+		elif record[0] > end:
+			break
+		else:
+			entries.append(record)
+	return start_stat, entries
+
+def test_sub_timeline_of_unordered_timeline(skewed_records):
+	timeline = pathylib.Timeline()
+	timeline.add_entries(_entries(skewed_records))
+	assert not timeline._columns.is_sorted
+	
+	timestamps = sorted({r[0] for r in skewed_records})
+	n = len(timestamps)
+	for start, end in [(timestamps[0], timestamps[-1]),
+			(timestamps[n // 5], timestamps[n // 2]),
+			(timestamps[n * 2 // 3], timestamps[n * 4 // 5])]:
+		start_stat, entries = _linear_sub_timeline(skewed_records, start, end)
+		sub_timeline = timeline.get_sub_timeline(start, end)
+		assert sub_timeline.start_stat == start_stat
+		assert _as_records(sub_timeline.iter()) == entries
+
+def test_reads_of_unordered_timeline_match_filter(tmp_path, monkeypatch,
+		timeline_cls, skewed_records):
+	monkeypatch.setattr(pathylib, "TIMELINE_INDEX_STEP", 200)
+	monkeypatch.setattr(pathylib, "TIMELINE_CHECKPOINT_INTERVAL", 2000)
+	path = tmp_path / "player.ptl"
+	timeline = timeline_cls(path)
+	for i in range(0, len(skewed_records), 100):
+		timeline.add_entries(_entries(skewed_records[i:i + 100]))
+	assert not timeline.is_ordered()
+	
+	reopened = timeline_cls(path) # the flag is kept in the index
+	assert not reopened.is_ordered()
+	timestamps = sorted({r[0] for r in skewed_records})
+	n = len(timestamps)
+	for start, end in [(timestamps[n // 10], timestamps[n * 2 // 3]),
+			(timestamps[n * 3 // 4], None), (None, timestamps[n // 3])]:
+		expected = _records_between(skewed_records, start, end)
+		assert _as_records(reopened.iter(start=start, end=end)) == expected
+		assert _as_records(reopened.iter(reverse=True, start=start,
+			end=end)) == expected[::-1]
+		assert _as_records(reopened.iter(start=start, end=end,
+			keys=[("_", "is_online")])) == \
+			[r for r in expected if r[1:3] == ("_", "is_online")]
+	
+	for moment in timestamps[::37]:
+		assert reopened.get_stat_at(moment) == \
+			_stat_until(skewed_records, moment)
+		assert reopened.get_stat_before(moment) == \
+			_stat_until(skewed_records, moment, inclusive=False)
+		sub_timeline = reopened.get_sub_timeline(moment, moment + 50000)
+		assert _as_records(sub_timeline.iter()) == \
+			_records_between(skewed_records, moment, moment + 50000)
+
+def test_ordered_timeline_is_not_marked(indexed_timeline, timeline_cls):
+	timeline, _ = indexed_timeline
+	assert timeline_cls(timeline.path).is_ordered()
+	assert "u" not in timeline.index.path.read_text(
+		encoding="utf-8").splitlines()
@@ -0,0 +1,58 @@
+import io
+import pytest
+import pathylib
+from pathylib import TimelineEntry, TimelineCheckpoint
+
+LINES = [
+	"1600000000 _ level 100",
+	"1600000000 Wraith tracker_kills 5",
+	"1600000001 _ name Some%20Player%24",
+	"1600000002.5 _ level 1.25", # legacy float timestamp
+	"1600000003 _ is_online 1\r",
+	"1600000004 _ level $null",
+	"not an entry",
+	"1600000005 _ too many chunks here",
+	"",
+	TimelineCheckpoint(1600000005, {("_", "level"): "7"}).serialize(),
+	"1600000006 Bloodhound tracker_damage 10"
+]
+
+def _as_tuples(records):
+	return [(r.timestamp, r.stat) if isinstance(r, TimelineCheckpoint) \
+		else (r.timestamp, r.legend, r.stat_name, r.stat_value) for \
+		r in records]
+
+def _parsed_one_by_one(lines, with_checkpoints):
+	records = []
+	for line in lines:
+		record = pathylib.parse_timeline_line(line, "test", with_checkpoints)
+		if record:
+			records.append(record)
+	return records
+
+@pytest.mark.parametrize("with_checkpoints", [False, True])
+def test_chunk_parse_matches_line_parse(with_checkpoints):
+	data = "\n".join(LINES).encode("utf-8")
+	records = pathylib.parse_timeline_chunk(data, "test", with_checkpoints)
+	
+	assert _as_tuples(records) == \
+		_as_tuples(_parsed_one_by_one(LINES, with_checkpoints))
+	assert records[2].stat_value == "Some Player$"
+	assert records[3].timestamp == 1600000002.5
+	assert len(records) == 7 + with_checkpoints
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1024 * 1024])
+def test_chunks_are_cut_at_line_ends(chunk_size, make_records):
+	records = make_records(500)
+	data = "".join(TimelineEntry(*r).serialize() + "\n" for r in records)
+	
+	parsed = pathylib.iter_text_chunks(io.BytesIO(data.encode("utf-8")),
+		"test", chunk_size=chunk_size)
+	assert _as_tuples(parsed) == records
+
+def test_entry_numeric_value_is_lazy():
+	entry = TimelineEntry(1, "_", "level", "12.5")
+	assert not hasattr(entry, "__dict__")
+	assert entry.stat_value_num == 12.5
+	assert TimelineEntry(1, "_", "name", "x").stat_value_num is None
+	assert TimelineEntry(1, "_", "level", "$null").isnull
@@ -0,0 +1,122 @@
+import threading
+import pytest
+import pathylib
+import timelinequery
+from pathylib import StoredTimeline, TimelineEntry
+
+def _entries(records):
+	return [TimelineEntry(*record) for record in records]
+
+def _numbers(records, key, start, end):
+	return [float(r[3]) for r in records if r[1:3] == key and \
+		start <= r[0] <= end and r[3] != "$null"]
+
+@pytest.fixture
+def timeline(tmp_path, make_records):
+	records = make_records(1000)
+	timeline = StoredTimeline(tmp_path / "player.txt")
+	timeline.add_entries(_entries(records))
+	return timeline, records
+
+def test_aggregates_match_records(timeline):
+	timeline, records = timeline
+	timestamps = sorted({r[0] for r in records})
+	start, end = timestamps[100], timestamps[-100]
+	key = ("Wraith", "tracker_kills")
+	numbers = _numbers(records, key, start, end)
+	before = _numbers(records, key, 0, start - 1)
+	
+	def _run(aggregate):
+		return timelinequery.run_query(timeline, aggregate, start=start,
+			end=end, keys=[key])[key]
+	
+	assert _run("count") == len([r for r in records if r[1:3] == key and \
+		start <= r[0] <= end and r[3] != "$null"])
+	assert _run("min") == min(numbers)
+	assert _run("max") == max(numbers)
+	assert float(_run("last")) == numbers[-1]
+	assert _run("delta") == numbers[-1] - (before[-1] if before else \
+		numbers[0])
+
+def test_duration_counts_value_held_from_before_range():
+	timeline = pathylib.Timeline()
+	timeline.add_entries(_entries([
+		(100, "_", "is_online", "1"),
+		(200, "_", "is_online", "0"),
+		(260, "_", "is_online", "1")
+	]))
+	result = timelinequery.run_query(timeline, "duration", start=150,
+		end=300, stat_names=["is_online"])
+	assert result == {("_", "is_online"): {"1": 50 + 40, "0": 60}}
+
+def test_query_filters_legends(timeline):
+	timeline, records = timeline
+	result = timelinequery.run_query(timeline, "count", legends=["Wraith"],
+		end=records[-1][0])
+	assert result and all(legend == "Wraith" for legend, _ in result)
+
+def test_unknown_aggregate():
+	with pytest.raises(ValueError):
+		timelinequery.TimelineQuery("median")
+
+class _Player():
+	def __init__(self, timeline):
+		self.timeline = timeline
+
+@pytest.fixture
+def daemon(monkeypatch, timeline):
+	daemon = pathylib.PathyDaemon()
+	daemon.main_worker.start()
+	player = _Player(timeline[0])
+	monkeypatch.setattr(daemon, "get_player_by_uid",
+		lambda uid: player if uid == "1" else None)
+	yield daemon
+	daemon.main_worker.stop(drop_pending=True)
+
+def test_query_cmd_runs_on_main_worker(daemon, monkeypatch):
+	threads = []
+	run = timelinequery.TimelineQuery.run
+	def _run(query, timeline):
+		threads.append(threading.current_thread().name)
+		return run(query, timeline)
+	monkeypatch.setattr(timelinequery.TimelineQuery, "run", _run)
+	
+	resp = daemon.handle_cmd("query", {"uid": "1", "aggregate": "count",
+		"stat_names": ["is_online"]})
+	assert resp.startswith("<pre>_ is_online: ")
+	assert threads == ["main"]
+	assert daemon.handle_cmd("query", {"uid": "2"}) == "Unknown player"
+
+def test_query_cmd_times_out_on_busy_worker(daemon, monkeypatch):
+	monkeypatch.setattr(pathylib, "DAEMON_CMD_TIMEOUT", 0.1)
+	release = threading.Event()
+	daemon.main_worker.task(release.wait).run(5)
+	try:
+		assert daemon.handle_cmd("query", {"uid": "1"}).startswith("Timed out")
+	finally:
+		release.set()
+
+def test_queries_see_whole_appends(daemon, timeline):
+	# appends and query commands are serialized by the main worker
+	timeline, records = timeline
+	start = records[-1][0] + 1
+	args = {"uid": "1", "aggregate": "count", "start": start,
+		"end": start + 1000, "stat_names": ["test_stat"]}
+	counts = []
+	
+	def _query():
+		for _ in range(20):
+			resp = daemon.handle_cmd("query", args)
+			counts.append(int(resp.split(": ")[1][:-len("</pre>")]) \
+				if ": " in resp else 0)
+	threads = [threading.Thread(target=_query) for _ in range(3)]
+	for thread in threads:
+		thread.start()
+	for i in range(40):
+		daemon.main_worker.task(timeline.add_entries).run(_entries(
+			[(start + i, "_", "test_stat", str(j)) for j in range(5)]))
+	for thread in threads:
+		thread.join()
+	
+	assert len(counts) == 60 and all(count % 5 == 0 for count in counts)
+	assert daemon.handle_cmd("query", args) == "<pre>_ test_stat: 200</pre>"
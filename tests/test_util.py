@@ -0,0 +1,45 @@
+import random
+import pytest
+import util
+
+def _lines(n, seed=1):
+	rnd = random.Random(seed)
+	return [f"{i} " + "x" * rnd.randint(0, 300) for i in range(n)]
+
+@pytest.mark.parametrize("buf_size", [1, 64, 65536])
+def test_reverse_readline_matches_reversed_lines(tmp_path, buf_size):
+	lines = _lines(500)
+	path = tmp_path / "t.txt"
+	path.write_bytes("\n".join(lines).encode() + b"\n")
+	expected = [line.encode() for line in reversed(lines)]
+	
+	assert list(util.reverse_readline(path, buf_size=buf_size)) == expected
+	assert list(util.reverse_readline(path.read_bytes(),
+		buf_size=buf_size)) == expected
+
+def test_reverse_readline_edge_cases(tmp_path):
+	path = tmp_path / "t.txt"
+	path.write_bytes(b"")
+	assert list(util.reverse_readline(path)) == []
+	
+	data = b"a\r\nb\n\nc" # crlf, blank line and no trailing newline
+	assert list(util.reverse_readline(data)) == [b"c", b"b", b"a"]
+
+def test_reverse_readline_of_size_prefix():
+	data = b"1 a\n2 b\n3 c\n"
+	assert list(util.reverse_readline(data, size=8)) == [b"2 b", b"1 a"]
+	assert list(util.reverse_readline(data, size=0)) == []
+
+def test_reverse_readline_contains_filter(tmp_path):
+	lines = _lines(300)
+	lines[10] += " is_online "
+	lines[200] += " level is_online "
+	lines[250] += " level "
+	path = tmp_path / "t.txt"
+	path.write_bytes("\n".join(lines).encode() + b"\n")
+	
+	needles = [b" is_online ", b" level "]
+	expected = [l.encode() for l in reversed(lines) if \
+		any(n.decode() in l for n in needles)]
+	assert list(util.reverse_readline(path, contains=needles)) == expected
+	assert list(util.reverse_readline(path, contains=[b"absent"])) == []
@@ -0,0 +1,110 @@
+import threading
+import time
+from concurrent.futures import CancelledError
+import pytest
+from pathylib import WorkerThread
+
+@pytest.fixture
+def make_worker():
+	workers = []
+	def _make(threads=1):
+		worker = WorkerThread("test", daemon=True, threads=threads)
+		worker.start()
+		workers.append(worker)
+		return worker
+	yield _make
+	for worker in workers:
+		worker.stop(drop_pending=True)
+
+def _block(worker):
+	"Occupies the worker until the returned event is set"
+	release = threading.Event()
+	worker.task(release.wait).run(5)
+	return release
+
+def test_sync_task_returns_result_or_raises(make_worker):
+	worker = make_worker()
+	assert worker.task(lambda a, b=0: a + b, sync=True).run(1, b=2) == 3
+	with pytest.raises(ZeroDivisionError):
+		worker.task(lambda: 1 / 0, sync=True).run()
+	assert worker.task(lambda: 1, sync=True).run() == 1 # still alive
+	
+	worker.stop() # the last task is accounted after its result
+	stats = worker.get_stats()
+	assert stats["done"] == 3 and stats["failed"] == 1
+	assert stats["queued"] == stats["running"] == 0
+
+def test_async_tasks_run_in_order_with_futures(make_worker):
+	worker = make_worker()
+	order, then = [], []
+	futures = [worker.task(order.append, then=lambda: then.append(1)).run(i) \
+		for i in range(100)]
+	assert futures[-1].result(5) is None
+	assert order == list(range(100)) and len(then) == 100
+	assert all(future.done() for future in futures)
+
+def test_task_max_by_tag(make_worker):
+	worker = make_worker()
+	release = _block(worker)
+	for _ in range(3):
+		worker.task(lambda: None, max=3, tag="a").run()
+	worker.task(lambda: None, max=1, tag="b").run()
+	with pytest.raises(OverflowError):
+		worker.task(lambda: None, max=3, tag="a").run()
+	assert worker.get_stats()["queued_by_tag"] == {"a": 3, "b": 1}
+	
+	release.set()
+	worker.task(lambda: None, sync=True).run()
+	assert worker.get_stats()["queued_by_tag"] == {}
+	worker.task(lambda: None, max=1, tag="b").run()
+	with pytest.raises(ValueError):
+		worker.task(lambda: None, max=1)
+
+def test_sync_timeout(make_worker):
+	worker = make_worker()
+	release = _block(worker)
+	with pytest.raises(TimeoutError):
+		worker.task(lambda: None, sync=True, timeout=0.05).run()
+	release.set()
+
+def test_sync_task_from_own_thread_runs_inline(make_worker):
+	worker = make_worker()
+	def _outer():
+		return worker.task(threading.current_thread, sync=True).run()
+	assert worker.task(_outer, sync=True, timeout=1).run().name == "test"
+
+def test_stop_lets_queued_tasks_finish(make_worker):
+	worker = make_worker()
+	release = _block(worker)
+	done = []
+	futures = [worker.task(done.append).run(i) for i in range(5)]
+	release.set()
+	worker.stop()
+	assert done == list(range(5)) and not worker.is_alive()
+	assert all(future.done() for future in futures)
+	with pytest.raises(RuntimeError):
+		worker.task(lambda: None).run()
+
+def test_stop_drops_pending(make_worker):
+	worker = make_worker()
+	release = _block(worker)
+	future = worker.task(lambda: None).run()
+	threading.Timer(0.05, release.set).start()
+	worker.stop(drop_pending=True)
+	with pytest.raises(CancelledError):
+		future.result(0)
+
+def test_pool_runs_tasks_at_once(make_worker):
+	worker = make_worker(threads=3)
+	barrier = threading.Barrier(3, timeout=5)
+	futures = [worker.task(barrier.wait).run() for _ in range(3)]
+	assert sorted(future.result(5) for future in futures) == [0, 1, 2]
+	assert worker.get_stats()["alive"] == 3
+
+def test_wait_and_run_times_are_accounted(make_worker):
+	worker = make_worker()
+	worker.task(time.sleep).run(0.05)
+	worker.task(lambda: None, sync=True).run()
+	stats = worker.get_stats()
+	assert stats["max_run_time"] >= 0.05
+	assert stats["max_wait_time"] >= 0.04
@@ -1,5 +1,5 @@
-import requests, json, re, io
-import util
+import json, re, io
+import util, ratelimit, httpclient
 from pathlib import Path
 from hashlib import md5
 from const import *
@@ -9,13 +9,21 @@ class TgBotApiError(Exception):
 	pass
 
 def call(method, params={}, files={}):
-	resp = requests.post(
+	ratelimit.singleton.acquire("tg_api")
+	resp = httpclient.singleton.post(
 		f"https://api.telegram.org/bot{BOT_TOKEN}/{method}",
 		data=params,
 		files=files
 	)
 	tg_reply = json.loads(resp.text)
 	
+	if resp.status_code == 429:
+		retry_after = tg_reply.get("parameters", {}).get("retry_after") or \
+			ratelimit.parse_retry_after(resp.headers.get("Retry-After"))
+		ratelimit.singleton.report_throttled("tg_api", retry_after)
+	elif resp.ok:
+		ratelimit.singleton.report_success("tg_api")
+	
 	if (not "result" in tg_reply) or (not tg_reply["ok"]) or (not resp.ok):
 		raise TgBotApiError("result['ok'] == False:\n" \
 			+ json.dumps(tg_reply, indent="\t"))
@@ -45,7 +53,7 @@ def download_url_proxied(url, dest=None, use_cache=True):
 		tg_url = f"https://api.telegram.org/file/bot" \
 			f"{BOT_TOKEN}/{tg_file['file_path']}"
 		
-		resp = requests.get(tg_url, allow_redirects=True)
+		resp = httpclient.singleton.get(tg_url, allow_redirects=True)
 		file_bytes = resp.content
 		
 		if use_cache:
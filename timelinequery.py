@@ -0,0 +1,183 @@
+import time
+import util
+
+class TimelineQuery():
+	"""
+	Aggregates timeline entries per (legend, stat_name) key in a single pass
+	over timeline.iter, keeping only the running aggregate of each key, so
+	that queries can be run against the whole history of a live timeline.
+	Aggregates:
+	  delta    - sum of changes of numeric value (counting the change from
+	             the value before the range start)
+	  count    - number of non-null entries
+	  min, max - of numeric values
+	  last     - last non-null value
+	  duration - seconds spent with each value within the range
+	"""
+	def __init__(self, aggregate, start=None, end=None, keys=None,
+			stat_names=None, legends=None):
+		if aggregate not in AGGREGATES:
+			raise ValueError(f"Unknown timeline query aggregate: {aggregate}")
+		
+		self.aggregate = aggregate
+		self.start = start
+		self.end = end
+		self.keys = [tuple(k) for k in keys] if keys else None
+		self.stat_names = stat_names
+		self.legends = legends
+	
+	@classmethod
+	def from_args(cls, args):
+		"Makes query of ctl action args, days are counted back from now"
+		start, end = args.get("start"), args.get("end")
+		if args.get("days") is not None:
+			start = int(time.time() - float(args["days"]) * 86400)
+		
+		return cls(args.get("aggregate", "delta"),
+			start=int(start) if start is not None else None,
+			end=int(end) if end is not None else None,
+			keys=args.get("keys"),
+			stat_names=args.get("stat_names"),
+			legends=args.get("legends"))
+	
+	def run(self, timeline):
+		"Returns {(legend, stat_name): result} of the keys met in the range"
+		end = self.end
+		if end is None: # entries added while running are not counted
+			end = int(time.time())
+		
+		start_stat = {}
+		if self.start is not None and self.aggregate in ("delta", "duration"):
+			start_stat = timeline.get_stat_before(self.start)
+		
+		aggregate_cls = AGGREGATES[self.aggregate]
+		results = {}
+		if self.aggregate == "duration": # values held through the range
+			for key, value in start_stat.items():
+				if self._is_selected(key):
+					results[key] = aggregate_cls(value, self.start)
+		
+		for entry in timeline.iter(start=self.start, end=end,
+				stat_names=self.stat_names, keys=self.keys):
+			key = (entry.legend, entry.stat_name)
+			if self.legends and entry.legend not in self.legends:
+				continue
+			
+			if key not in results:
+				results[key] = aggregate_cls(start_stat.get(key), self.start)
+			results[key].add(entry.timestamp, entry.stat_value)
+		
+		return {k: v.get_result(end) for k, v in results.items()}
+	
+	def _is_selected(self, key):
+		if self.keys is not None and key not in self.keys:
+			return False
+		if self.stat_names and key[1] not in self.stat_names:
+			return False
+		if self.legends and key[0] not in self.legends:
+			return False
+		return True
+	
+	def format(self, results):
+		text = ""
+		for (legend, stat_name), result in sorted(results.items(),
+				key=lambda item: (str(item[0][0]), str(item[0][1]))):
+			if isinstance(result, dict):
+				result = ", ".join([f"{value}: {util.format_time(seconds)}" \
+					for value, seconds in result.items()])
+			text += f"{legend} {stat_name}: {result}\n"
+		
+		return text.strip() or "No entries"
+
+class DeltaAggregate():
+	"Sum of the changes, which is the last value minus the first one"
+	def __init__(self, value_before, start):
+		self.first = self.last = util.to_num(value_before)
+	
+	def add(self, timestamp, value):
+		value = util.to_num(value)
+		if value is None:
+			return
+		if self.first is None:
+			self.first = value
+		self.last = value
+	
+	def get_result(self, end):
+		if self.first is None:
+			return 0
+		return self.last - self.first
+
+class CountAggregate():
+	def __init__(self, value_before, start):
+		self.count = 0
+	
+	def add(self, timestamp, value):
+		if value != "$null":
+			self.count += 1
+	
+	def get_result(self, end):
+		return self.count
+
+class MinAggregate():
+	def __init__(self, value_before, start):
+		self.value = None
+	
+	def add(self, timestamp, value):
+		value = util.to_num(value)
+		if value is not None and (self.value is None or value < self.value):
+			self.value = value
+	
+	def get_result(self, end):
+		return self.value
+
+class MaxAggregate(MinAggregate):
+	def add(self, timestamp, value):
+		value = util.to_num(value)
+		if value is not None and (self.value is None or value > self.value):
+			self.value = value
+
+class LastAggregate():
+	def __init__(self, value_before, start):
+		self.value = None
+	
+	def add(self, timestamp, value):
+		if value != "$null":
+			self.value = value
+	
+	def get_result(self, end):
+		return self.value
+
+class DurationAggregate():
+	def __init__(self, value_before, start):
+		self.value = value_before
+		self.since = start
+		self.durations = {}
+	
+	def add(self, timestamp, value):
+		self._count(timestamp)
+		self.value, self.since = value, timestamp
+	
+	def get_result(self, end):
+		self._count(end)
+		self.since = end
+		return self.durations
+	
+	def _count(self, until):
+		if self.since is None or self.value in (None, "$null"):
+			return
+		value = str(self.value)
+		self.durations[value] = self.durations.get(value, 0) + \
+			max(0, until - self.since)
+
+AGGREGATES = {
+	"delta": DeltaAggregate,
+	"count": CountAggregate,
+	"min": MinAggregate,
+	"max": MaxAggregate,
+	"last": LastAggregate,
+	"duration": DurationAggregate
+}
+
+def run_query(timeline, aggregate, **kwargs):
+	"Shortcut for TimelineQuery(aggregate, **kwargs).run(timeline)"
+	return TimelineQuery(aggregate, **kwargs).run(timeline)
@@ -1,6 +1,6 @@
-import time, traceback, subprocess, os, requests, json, pytz, datetime, \
-	random, re, threading, io, string
-import tgapi
+import time, traceback, subprocess, os, json, pytz, datetime, \
+	random, re, threading, io, string, mmap
+import tgapi, httpclient
 from pathlib import Path
 from const import *
 from PIL import Image
@@ -142,7 +142,7 @@ def calc_mid_percentage(targ_num, comp_nums):
 	return -1
 
 def get_yt_videos(channel_url):
-	channel_page = requests.get(channel_url).text
+	channel_page = httpclient.singleton.get(channel_url).text
 	video_ids = re.findall("\"videoId\":\\s*\"([^\"]+)\"", channel_page)
 	
 	result_videos = []
@@ -153,60 +153,49 @@ def get_yt_videos(channel_url):
 	
 	return result_videos
 
-def reverse_readline(path, buf_size=8192):
+def reverse_readline(source, size=None, contains=None, buf_size=65536):
 	"""
-	A generator that returns the lines of a file in reverse order
-	modified from from https://stackoverflow.com/a/23646049
+	A generator that returns the lines of a file (or bytes) in reverse order
+	without line breaks, optionally only of its first size bytes.
+	Files are mmapped and searched in place. If contains byte strings are
+	given, only the lines having any of them are returned, and the rest
+	is skipped with rfind without being looked at
 	"""
-	def _line(line):
-		return line.decode("utf-8").strip("\r\n") + "\n"
+	if isinstance(source, (bytes, bytearray)):
+		yield from _reverse_lines(source, size, contains, buf_size)
+		return
 	
-	with open(path, "rb") as file:
-		segment = None
-		offset = 0
-		file.seek(0, os.SEEK_END)
-		file_size = remaining_size = file.tell()
-		
-		while remaining_size > 0:
-			offset = min(file_size, offset + buf_size)
-			file.seek(file_size - offset)
-			buffer = file.read(min(remaining_size, buf_size))
-			remaining_size -= buf_size
-			lines = buffer.split(b"\n")
-			
-			# The first line of the buffer is probably not a complete line so
-			# we'll save it and append it to the last line of the next buffer
-			# we read
-			if segment is not None:
-				# If the previous chunk starts right from the beginning of line
-				# do not concat the segment to the last line of new chunk.
-				# Instead, yield the segment first
-				
-				if buffer[-1] != b"\n":
-					lines[-1] += segment
-				else:
-					yield _line(segment)
-			segment = lines[0]
-			
-			for index in range(len(lines) - 1, 0, -1):
-				if lines[index]:
-					yield _line(lines[index])
-		
-		# Don't yield None if the file was empty
-		if segment is not None:
-			yield _line(segment)
-
-_interval_data = {}
-def cap_freq(tag, min_interval):
-	# supports parallel threads! (probably)
-	if not tag in _interval_data:
-		_interval_data[tag] = time.time()
+	with open(source, "rb") as file:
+		if not os.fstat(file.fileno()).st_size:
+			return # empty files can't be mmapped
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+			yield from _reverse_lines(buffer, size, contains, buf_size)
+
+def _reverse_lines(buffer, size, contains, buf_size):
+	end = len(buffer) if size is None else min(size, len(buffer))
+	if contains:
+		# last known occurrence of every string before the end
+		found = {s: buffer.rfind(s, 0, end) for s in contains}
+		while end > 0:
+			for s, pos in found.items():
+				if pos + len(s) > end:
+					found[s] = buffer.rfind(s, 0, end)
+			pos = max(found.values())
+			if pos < 0:
+				return
+			start = buffer.rfind(b"\n", 0, pos) + 1
+			line_end = buffer.find(b"\n", pos, end)
+			yield buffer[start:end if line_end < 0 else line_end].rstrip(b"\r")
+			end = start - 1
 		return
 	
-	time_to_wait = min_interval - (time.time() - _interval_data[tag])
-	if time_to_wait > 0:
-		_interval_data[tag] = time.time() + time_to_wait
-		time.sleep(time_to_wait)
+	# chunks are cut at line starts, so they always have whole lines only
+	while end > 0:
+		start = buffer.rfind(b"\n", 0, max(0, end - buf_size)) + 1
+		for line in reversed(buffer[start:end].split(b"\n")):
+			if line:
+				yield line.rstrip(b"\r")
+		end = start - 1
 
 def get_state():
 	def _try_read(path):